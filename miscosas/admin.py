@@ -1,9 +1,11 @@
 from django.contrib import admin
-from .models import Feed, Item, Vote, Comment, Profile
+from .models import Feed, FeedJob, Item, Vote, Comment, Profile, KeyResolution
 
 # Register your models here.
 admin.site.register(Feed)
 admin.site.register(Item)
 admin.site.register(Vote)
 admin.site.register(Comment)
-admin.site.register(Profile)
\ No newline at end of file
+admin.site.register(Profile)
+admin.site.register(KeyResolution)
+admin.site.register(FeedJob)
\ No newline at end of file
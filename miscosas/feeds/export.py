@@ -0,0 +1,101 @@
+"""
+Export of the whole catalog as NDJSON, one JSON object per line
+"""
+
+import json
+import zlib
+from datetime import timedelta
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+
+# Rows read from the database at a time
+EXPORT_CHUNK_SIZE = 2000
+
+# Bytes of lines sent together
+BLOCK_SIZE = 64 * 1024
+
+# Seconds the watermark is set back from the start of the export, the
+# times of the rows are taken before their transactions commit, so a
+# row can show up later than others with a newer time
+WATERMARK_MARGIN = 60
+
+# Fields written for each table, and the field with the
+# last time a row changed, which since is compared with
+EXPORT_TABLES = {
+    'feed': (('id', 'key', 'title', 'source', 'chosen', 'score', 'updated'), 'updated'),
+    'item': (('id', 'key', 'title', 'feed_id', 'description', 'picture',
+              'upvote_count', 'downvote_count', 'updated'), 'updated'),
+    'vote': (('id', 'positive', 'date', 'user_id', 'item_id'), 'date'),
+    'comment': (('id', 'title', 'content', 'date', 'user_id', 'item_id'), 'date'),
+}
+
+
+def table_models():
+    from miscosas.models import Feed, Item, Vote, Comment
+    return {'feed': Feed, 'item': Item, 'vote': Vote, 'comment': Comment}
+
+
+def deletion_model():
+    from miscosas.models import Deletion
+    return Deletion
+
+
+def export_lines(since=None, tables=EXPORT_TABLES, chunk_size=EXPORT_CHUNK_SIZE):
+    """Yields the rows of the tables as lines of JSON, each one with
+    a type key that names its table.
+
+    If since is given only the rows that changed after it are written,
+    followed by lines of type deletion with the table and id of the
+    rows removed after it.
+    The last line has type watermark and the time up to which all the
+    rows were written, to pass as since in the next export; it is
+    missing if the export did not finish. It is some time before the
+    export started, so the rows changed just before it are written
+    again in the next one."""
+    models = table_models()
+    until = timezone.now() - timedelta(seconds=WATERMARK_MARGIN)
+    for table in tables:
+        fields, changed = EXPORT_TABLES[table]
+        rows = models[table].objects.all()
+        if since is not None:
+            rows = rows.filter(**{changed + '__gt': since})
+        for row in rows.order_by('pk').values(*fields).iterator(chunk_size):
+            yield json_line({'type': table, **row})
+    if since is not None:
+        deletions = deletion_model().objects.filter(table__in=list(tables), date__gt=since)
+        for table, pk, date in (deletions.order_by('pk')
+                .values_list('table', 'object_id', 'date').iterator(chunk_size)):
+            yield json_line({'type': 'deletion', 'table': table, 'id': pk, 'date': date})
+    # The encoder would round the microseconds
+    yield json_line({'type': 'watermark', 'until': until.isoformat()})
+
+
+def json_line(data):
+    return (json.dumps(data, cls=DjangoJSONEncoder) + '\n').encode('utf-8')
+
+
+def blocks(lines, size=BLOCK_SIZE):
+    """Joins a sequence of byte strings in blocks of about size bytes."""
+    block = []
+    length = 0
+    for line in lines:
+        block.append(line)
+        length += len(line)
+        if length >= size:
+            yield b''.join(block)
+            block = []
+            length = 0
+    if block:
+        yield b''.join(block)
+
+
+def gzip_lines(lines):
+    """Compresses a sequence of byte strings as a gzip stream,
+    yielding the compressed data when there is some."""
+    compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS)
+    for line in lines:
+        data = compressor.compress(line)
+        if data:
+            yield data
+    yield compressor.flush()
@@ -1,14 +1,48 @@
-from urllib.request import urlopen, Request
+import hashlib
+from collections import namedtuple
+from itertools import chain, islice
+from tempfile import SpooledTemporaryFile
+from urllib.error import HTTPError
+from urllib.request import Request
 from urllib.parse import quote
 
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
 from project.secretkeys import LAST_FM_API_KEY, GOODREADS_API_KEY, SPOTIFY_API_KEY
 from miscosas.apps import MisCosasConfig as Config
+from miscosas import fragments
+from miscosas.pagecache import feed_pages, item_tag
 from .ytchannel import YTChannel
 from .lastfmartist import LastFmArtist
 from .subreddit import Subreddit
 from .flickrtag import FlickrTag
 from .goodreadsauthor import GoodreadsAuthor, get_author_id
 from .spotifyartist import SpotifyArtist, get_artist_id
+from .httppool import urlopen
+from .ratelimit import set_rate_limit
+
+
+# Amount of items that were created, changed or left as they were
+# when the entries of a feed document were stored
+IngestStats = namedtuple('IngestStats', ['inserted', 'updated', 'unchanged'])
+
+# Values that identify the version of a feed document:
+# the ETag and Last-Modified headers and a hash of the body
+Validators = namedtuple('Validators', ['etag', 'last_modified', 'content_hash'])
+
+# Result of requesting a feed document, parser is None if
+# the document has not changed since the given validators
+FetchResult = namedtuple('FetchResult', ['key', 'parser', 'validators'])
+
+# Amount of entries written to the database at once
+BATCH_SIZE = 100
+
+# Downloaded documents bigger than this are kept
+# in a temporary file instead of in memory
+SPOOL_SIZE = 1024 * 1024
+CHUNK_SIZE = 16 * 1024
 
 
 class FeedData:
@@ -22,7 +56,9 @@ class FeedData:
                  feed_parser,
                  icon,
                  api_key="",
-                 pre_load=None):
+                 pre_load=None,
+                 max_items=None,
+                 rate_limit=None):
         """
         Initializes the required data to access the feed.
 
@@ -46,7 +82,14 @@ class FeedData:
             An optional API key if the source API requires it
         pre_load: func
             An optional function that is executed before the
-            document with the data is requested and parsed
+            document with the data is requested and parsed, it
+            returns the headers of the requests and the key of
+            the feed, which it only looks up if resolve is True
+        max_items: int
+            An optional maximum amount of items read from a document
+        rate_limit: tuple
+            An optional limit of requests to the host of data_url, as
+            requests per second and requests that can be made at once
         """
 
         self._feed_url = feed_url
@@ -57,6 +100,9 @@ class FeedData:
         self.icon = icon
         self._api_key = api_key
         self._pre_load = pre_load
+        self._max_items = max_items
+        if rate_limit:
+            set_rate_limit(data_url, *rate_limit)
 
     def get_feed_url(self, feed_key):
         """ Returns the url of the feed with the given key. """
@@ -75,40 +121,213 @@ class FeedData:
         """Load the info from a new or existing feed.
 
         Returns the updated feed."""
+        from miscosas.models import Feed
+
+        # Some feeds are stored with the id their name is resolved to
+        headers, feed_key = self._resolve(feed_key)
+        feed = Feed.objects.filter(key=feed_key, source=self._source).first()
+        validators = feed.validators if feed else None
 
-        headers = {}
+        # The whole document is downloaded before the
+        # transaction that writes it locks the database
+        result = self._fetch(feed_key, headers, validators)
+        if result.parser is None:
+            # Nothing changed, only make sure the feed is chosen
+            self.save_validators(feed, result.validators)
+            if not feed.chosen:
+                feed.chosen = True
+                feed.save(update_fields=['chosen'])
+            return feed
+
+        feed, _ = self.store_parser(result.key, result.parser, validators=result.validators)
+        return feed
+
+    def fetch(self, feed_key, validators=None, resolve=True):
+        """Downloads the document of a feed
+        without touching the database.
+
+        If the validators of the last version of the document
+        are given, the request is conditional and the document
+        is not parsed when it has not changed. If resolve is False
+        the key is the one a feed is stored with, which is not
+        looked up again.
+
+        Returns a FetchResult, its parser reads the
+        downloaded document while its items are iterated."""
+        headers, feed_key = self._resolve(feed_key, resolve)
+        return self._fetch(feed_key, headers, validators)
+
+    def save_validators(self, feed, validators):
+        """Saves the validators of a document that did not change,
+        the server might have given it another ETag or date."""
+        from miscosas.models import Feed
+
+        if validators is None or validators == feed.validators:
+            return
+        # Nothing shown in the pages changed, so no signals are sent
+        Feed.objects.filter(pk=feed.pk).update(**validators._asdict())
+        for field, value in validators._asdict().items():
+            setattr(feed, field, value)
+
+    def _resolve(self, feed_key, resolve=True):
+        """Returns the headers of the requests of a feed
+        and the key it is stored with."""
         if self._pre_load:
-            headers, feed_key = self._pre_load(feed_key, self._api_key)
+            return self._pre_load(feed_key, self._api_key, resolve)
+        return {}, feed_key
+
+    def _fetch(self, feed_key, headers, validators):
+        feed_key, response = self._request(feed_key, headers, validators)
+        if response is None:
+            return FetchResult(feed_key, None, validators)
+
+        body = SpooledTemporaryFile(SPOOL_SIZE)
+        digest = hashlib.sha256()
+        with response:
+            for chunk in iter(lambda: response.read(CHUNK_SIZE), b''):
+                digest.update(chunk)
+                body.write(chunk)
+
+        new_validators = self._validators(response, digest.hexdigest())
+        if validators and validators.content_hash == new_validators.content_hash:
+            body.close()
+            return FetchResult(feed_key, None, new_validators)
+
+        body.seek(0)
+        return FetchResult(feed_key, self._parser(body, self._max_items), new_validators)
+
+    def _request(self, feed_key, headers, validators=None):
+        """Requests the document of a feed, conditionally
+        if there are validators.
+
+        Returns the key of the feed and the open response,
+        which is None if the document has not changed."""
+        headers = dict(headers)
+        if validators and validators.etag:
+            headers['If-None-Match'] = validators.etag
+        if validators and validators.last_modified:
+            headers['If-Modified-Since'] = validators.last_modified
 
         url = self.get_data_url(feed_key)
         request = Request(url, headers=headers)
-        response = urlopen(request)
+        try:
+            return feed_key, urlopen(request)
+        except HTTPError as error:
+            if error.code == 304 and validators:
+                return feed_key, None
+            raise
+
+    def _validators(self, response, content_hash):
+        return Validators(
+            response.headers.get('ETag', ''),
+            response.headers.get('Last-Modified', ''),
+            content_hash)
+
+    def store(self, feed_key, feed_title, items_data, choose=True, validators=None):
+        """Writes a feed and its items to the database.
+
+        The entries are compared with the items the feed already has
+        and all the changes are written in bulk in a single transaction.
+        The feed is marked as chosen unless choose is False, and the
+        Validators of the document are saved if given.
+
+        Returns the updated feed and the IngestStats of the write."""
+        return self._write(feed_key, lambda: feed_title,
+                           batched(items_data, BATCH_SIZE), choose, validators)
+
+    def store_parser(self, feed_key, parser, choose=True, validators=None):
+        """Writes a feed and its items to the database like store does,
+        the items are written in batches while the parser reads them.
+
+        If the parser fails nothing is written."""
+        return self._write(feed_key, parser.feed_title,
+                           batched(parser.iter_items(), BATCH_SIZE), choose, validators)
 
-        return self._parse(response, feed_key)
+    def _write(self, feed_key, feed_title, batches, choose, validators):
+        from miscosas.models import Feed
 
-    def _parse(self, response, feed_key):
-        """Parses an HTTPResponse into a Feed with Items."""
+        with transaction.atomic():
+            # The title is known once the first entries are parsed
+            first_batch = next(batches, [])
+
+            defaults = {'title': feed_title()}
+            if choose:
+                defaults['chosen'] = True
+            if validators:
+                defaults.update(validators._asdict())
+
+            feed = (Feed.objects.select_for_update()
+                .filter(key=feed_key, source=self._source).first())
+            if feed is None:
+                feed = Feed.objects.create(key=feed_key, source=self._source, **defaults)
+                changed = set()
+            else:
+                changed = {field for field, value in defaults.items() if getattr(feed, field) != value}
+                for field in changed:
+                    setattr(feed, field, defaults[field])
+
+            stats = IngestStats(0, 0, 0)
+            for batch in chain([first_batch], batches):
+                batch_stats = self._write_items(feed, batch)
+                stats = IngestStats(*(total + count for total, count in zip(stats, batch_stats)))
+
+            # A feed that did not change keeps its update time and its cached
+            # pages, the changes of its items bump their own pages
+            if changed - set(Validators._fields):
+                feed.save()
+            elif changed:
+                Feed.objects.filter(pk=feed.pk).update(**{field: defaults[field] for field in changed})
+
+        return feed, stats
+
+    def _write_items(self, feed, entries):
+        """Compares entries with the items of the feed
+        and writes the changes in bulk."""
         from miscosas.models import Feed, Item
 
-        parser = self._parser(response)
+        # Later entries with a repeated key replace the earlier ones
+        entries = {entry['key']: entry for entry in entries}
 
-        feed, _ = Feed.objects.update_or_create(
-            key=feed_key,
-            source=self._source,
-            defaults={
-                'title': parser.feed_title(),
-                'chosen': True,
-            })
+        existing = {item.key: item for item in
+                    Item.objects.filter(feed=feed, key__in=list(entries))}
+        new_items = []
+        changed_items = []
+        # bulk_update does not set the auto_now fields
+        now = timezone.now()
+        for key, entry in entries.items():
+            item = existing.get(key)
+            if item is None:
+                new_items.append(Item(**entry, feed=feed))
+            elif any(getattr(item, field) != value for field, value in entry.items()):
+                for field, value in entry.items():
+                    setattr(item, field, value)
+                item.updated = now
+                changed_items.append(item)
 
-        for item in parser.items_data():
-            Item.objects.update_or_create(
-                key=item['key'],
-                defaults={
-                    **item,
-                    'feed': feed,
-                })
+        Item.objects.bulk_create(new_items)
+        if new_items:
+            # Neither does it send the signals that count the items
+            Feed.objects.filter(pk=feed.pk).update(item_count=F('item_count') + len(new_items))
+        Item.objects.bulk_update(changed_items, ['title', 'description', 'picture', 'updated'])
+        # The bulk writes do not send the signals that render the fragments again
+        if new_items or changed_items:
+            fragments.bump(
+                fragments.feed_key(feed.pk), *feed_pages(feed.pk),
+                *(key for item in changed_items
+                  for key in (fragments.item_key(item.pk), item_tag(item.pk))))
 
-        return feed
+        unchanged = len(entries) - len(new_items) - len(changed_items)
+        return IngestStats(len(new_items), len(changed_items), unchanged)
+
+
+def batched(iterable, size):
+    """Yields lists with the next size elements of iterable."""
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
 
 
 YOUTUBE_FEED = FeedData(
@@ -117,7 +336,8 @@ YOUTUBE_FEED = FeedData(
     "http://www.youtube.com/feeds/videos.xml?channel_id={feed}",
     Config.YOUTUBE,
     YTChannel,
-    "https://s.ytimg.com/yts/img/favicon_144-vfliLAfaB.png")
+    "https://s.ytimg.com/yts/img/favicon_144-vfliLAfaB.png",
+    rate_limit=(2, 4))
 
 LAST_FM_FEED = FeedData(
     "https://www.last.fm/music/{feed}",
@@ -126,7 +346,9 @@ LAST_FM_FEED = FeedData(
     Config.LASTFM,
     LastFmArtist,
     "https://www.last.fm/static/images/logo_static.adb61955725c.png",
-    LAST_FM_API_KEY)
+    LAST_FM_API_KEY,
+    # Five requests per second averaged over five minutes
+    rate_limit=(4, 5))
 
 REDDIT_FEED = FeedData(
     "https://www.reddit.com/r/{feed}",
@@ -134,7 +356,9 @@ REDDIT_FEED = FeedData(
     "https://www.reddit.com/r/{feed}.rss",
     Config.REDDIT,
     Subreddit,
-    "http://t1.gstatic.com/images?q=tbn:ANd9GcThsotATP9ktYH_-oqNK6lYSI2USCxC-9nhbqScnKqvWFyxmL64")
+    "http://t1.gstatic.com/images?q=tbn:ANd9GcThsotATP9ktYH_-oqNK6lYSI2USCxC-9nhbqScnKqvWFyxmL64",
+    # Sixty requests per minute without authentication
+    rate_limit=(1, 5))
 
 FLICKR_FEED = FeedData(
     "https://www.flickr.com/search/?tags={feed}",
@@ -142,7 +366,8 @@ FLICKR_FEED = FeedData(
     "https://www.flickr.com/services/feeds/photos_public.gne?tags={feed}",
     Config.FLICKR,
     FlickrTag,
-    "https://cdn.kustomerhostedcontent.com/media/5aecd7338a0607779d1ec9cc/966e09a41a33f89fe18f2ab227336f09.png")
+    "https://cdn.kustomerhostedcontent.com/media/5aecd7338a0607779d1ec9cc/966e09a41a33f89fe18f2ab227336f09.png",
+    rate_limit=(2, 4))
 
 GOODREADS_FEED = FeedData(
     "https://www.goodreads.com/author/show/{feed}",
@@ -152,7 +377,9 @@ GOODREADS_FEED = FeedData(
     GoodreadsAuthor,
     "http://d.gr-assets.com/misc/1454549143-1454549143_goodreads_misc.png",
     GOODREADS_API_KEY,
-    get_author_id)
+    get_author_id,
+    # One request per second, also for the author names
+    rate_limit=(1, 1))
 
 SPOTIFY_FEED = FeedData(
     "https://open.spotify.com/artist/{feed}",
@@ -162,7 +389,8 @@ SPOTIFY_FEED = FeedData(
     SpotifyArtist,
     "https://pluspng.com/img-png/spotify-logo-png-open-2000.png",
     SPOTIFY_API_KEY,
-    get_artist_id)
+    get_artist_id,
+    rate_limit=(5, 10))
 
 FEEDS_DATA = {
     Config.YOUTUBE: YOUTUBE_FEED,
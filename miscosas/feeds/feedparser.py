@@ -1,20 +1,27 @@
 from abc import ABC, abstractmethod
+from xml.sax import make_parser, SAXParseException
+from xml.sax.handler import ContentHandler
 
 
 class FeedParser(ABC):
     """
     Base class to make parsers for the Feed and Item models
+
+    The document is parsed while the items are iterated,
+    so entries can be used before the whole document is read.
     """
 
-    @abstractmethod
-    def __init__(self, stream):
+    def __init__(self, stream, limit=None):
         """
         Parameters
         ----------
         stream : HttpResponse
-            The data to parse
+            The data to parse, it is closed once it has been parsed
+        limit : int
+            Optional maximum amount of items to read
         """
-        pass
+        self.stream = stream
+        self.limit = limit
 
     @abstractmethod
     def feed_title(self):
@@ -22,6 +29,61 @@ class FeedParser(ABC):
         pass
 
     @abstractmethod
+    def parse_entries(self):
+        """Yields each entry of the document as a dictionary
+        as soon as it has been parsed."""
+        pass
+
+    @abstractmethod
+    def is_item_complete(self, item):
+        """Checks if an individual entry has all expected fields."""
+        pass
+
+    @abstractmethod
+    def item_data(self, item):
+        """
+        Returns a dictionary with the fields of an entry matching
+        the fields in the Item model: key, title, description, picture.
+
+        Description and picture are optional.
+        """
+        pass
+
+    def skip_entry(self, item):
+        """Whether an entry should not become an item."""
+        return False
+
+    def check_feed(self):
+        """Raises ParsingError if the feed data is not valid."""
+        if not self.feed_title():
+            raise ParsingError("Feed has no title")
+
+    def iter_items(self):
+        """Yields the validated data of each item of the feed,
+        with the same fields as items_data, while it is parsed.
+
+        Raises ParsingError as soon as something wrong is found."""
+        count = 0
+        try:
+            for entry in self.parse_entries():
+                if self.skip_entry(entry):
+                    continue
+                if count == 0:
+                    self.check_feed()
+                if not self.is_item_complete(entry):
+                    raise ParsingError("Some item is missing fields")
+
+                yield self.item_data(entry)
+                count += 1
+                if self.limit and count >= self.limit:
+                    return
+
+            if count == 0:
+                self.check_feed()
+                raise ParsingError("Feed has no items")
+        finally:
+            self.stream.close()
+
     def items_data(self):
         """
         Returns a list of dictionaries with entries matching the fields
@@ -29,9 +91,75 @@ class FeedParser(ABC):
 
         Descriptiona and picture are optional.
         """
+        return list(self.iter_items())
+
+
+class SaxFeedParser(FeedParser):
+    """Base class for parsers of XML documents that use a SAX
+    content handler, the document is fed to the parser in chunks."""
+
+    CHUNK_SIZE = 16 * 1024
+
+    # ContentHandler class used to read the document
+    handler_class = None
+
+    def __init__(self, stream, limit=None):
+        super().__init__(stream, limit)
+        self.parser = make_parser()
+        self.handler = self.handler_class()
+        self.parser.setContentHandler(self.handler)
+
+    @abstractmethod
+    def new_entries(self):
+        """Returns the entries completed by the handler
+        since the last call and forgets them."""
         pass
 
+    def parse_entries(self):
+        try:
+            while True:
+                chunk = self.stream.read(self.CHUNK_SIZE)
+                if chunk:
+                    self.parser.feed(chunk)
+                else:
+                    self.parser.close()
+                yield from self.new_entries()
+                if not chunk:
+                    return
+        except SAXParseException as error:
+            raise ParsingError(f"Malformed document: {error}")
+
+
+class TextHandler(ContentHandler):
+    """Base class for the SAX content handlers of the parsers.
+
+    Expat can split the text of an element in many calls to characters,
+    the pieces are kept in a list and only joined when it is used."""
+
+    def __init__(self):
+        """Initialization of variables for the parser
+        * in_content: reading target content (leaf strings)
+        * content: target content being read
+        """
+        super().__init__()
+        self.in_content = False
+        self._chunks = []
+
+    @property
+    def content(self):
+        return "".join(self._chunks)
+
+    def characters(self, chars):
+        if self.in_content:
+            self._chunks.append(chars)
+
+    def clear_content(self):
+        """Forgets the content read, to be called when an element ends."""
+        self._chunks = []
+        self.in_content = False
+
+
 class ParsingError(RuntimeError):
     """Exception to signal something went wrong
     with pasing a feed document."""
-    pass
\ No newline at end of file
+    pass
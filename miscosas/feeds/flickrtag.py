@@ -1,44 +1,38 @@
 #!/usr/bin/python3
 
-from xml.sax.handler import ContentHandler
-from xml.sax import make_parser
+from .feedparser import SaxFeedParser, TextHandler
 
-from .feedparser import FeedParser, ParsingError
 
-
-class FlickrHandler(ContentHandler):
+class FlickrHandler(TextHandler):
     """Class to handle events fired by the SAX parser
 
     Fills in self.photos with data from photo items
     with a tag in Flickr.
     """
 
-    ENTRY_TAGS = [
+    ENTRY_TAGS = frozenset([
         'content',
         'title',
-    ]
+    ])
 
     ENTRY_ARGS = {
         'link': 'href',
     }
 
-    FEED_TAGS = [
+    FEED_TAGS = frozenset([
         'title'
-    ]
+    ])
 
     ENTRY_TAG = 'entry'
 
     def __init__(self):
         """Initialization of variables for the parser
-        * in_content: reading target content (leaf strings)
-        * content: target content being read
         * photos: list of photos in the tag,
             each photo is a dictionary (title, content, link)
         * current_entry: the information from the current photo
         """
-        self.in_content = False
+        super().__init__()
         self.in_entry = False
-        self.content = ""
         self.photos = []
         self.current_entry = {}
         self.name = ""
@@ -64,50 +58,34 @@ class FlickrHandler(ContentHandler):
             self.current_entry = {}
             self.in_entry = False
 
-        self.content = ""
-        self.in_content = False
-
-    def characters(self, chars):
-        if self.in_content:
-            self.content = self.content + chars
+        self.clear_content()
 
 
-class FlickrTag(FeedParser):
+class FlickrTag(SaxFeedParser):
     """Class to get photos from a tag in Flickr.
 
     Extracts item info from the XML document for a Flickr tag rss feed.
     """
 
-    def __init__(self, stream):
-        self.parser = make_parser()
-        self.handler = FlickrHandler()
-        self.parser.setContentHandler(self.handler)
-        self.parser.parse(stream)
+    handler_class = FlickrHandler
 
-        # Make sure all expected fields are filled
-        if not self.handler.name:
-            raise ParsingError("Feed has no title")
-        if not self.handler.photos:
-            raise ParsingError("Feed has no items")
-        if any(not self.is_item_complete(item) for item in self.handler.photos):
-            raise ParsingError("Some item is missing fields")
+    def new_entries(self):
+        photos, self.handler.photos = self.handler.photos, []
+        return photos
 
     def feed_title(self):
         return self.handler.name
 
-    def items_data(self):
-        items = []
-        for photo in self.handler.photos:
-            items.append({
-                'key': photo['link']
-                    .replace("https://www.flickr.com/photos/", "")[:-1],
-                'title': photo['title'],
-                'description': photo['content'],
-            })
-        return items
+    def item_data(self, item):
+        return {
+            'key': item['link']
+                .replace("https://www.flickr.com/photos/", "")[:-1],
+            'title': item['title'],
+            'description': item['content'],
+        }
 
     def is_item_complete(self, item):
         """Checks if an individual item has all expected fields."""
         return (item.get('link') and
                 item.get('title') and
-                item.get('content'))
\ No newline at end of file
+                item.get('content'))
@@ -1,50 +1,48 @@
 #!/usr/bin/python3
 
-from time import sleep
-from xml.sax.handler import ContentHandler
-from xml.sax import make_parser
 from xml.etree import ElementTree
-from urllib.request import urlopen
 from urllib.parse import quote
 
-from .feedparser import FeedParser, ParsingError
+from miscosas.apps import MisCosasConfig as Config
+from .feedparser import SaxFeedParser, TextHandler, ParsingError
+from .httppool import urlopen
+from .keycache import resolve_name
 
 
-class GoodreadsHandler(ContentHandler):
+class GoodreadsHandler(TextHandler):
     """Class to handle events fired by the SAX parser
 
     Fills in self.books with data from book items
     in a goodreads author book list.
     """
 
-    ENTRY_TAGS = [
+    ENTRY_TAGS = frozenset([
         'id',
         'title',
         'image_url',
         'description',
         'ratings_count',
-    ]
+    ])
 
-    TITLE_TAG = 'name'
+    TITLE_TAGS = frozenset([
+        'name'
+    ])
 
     ENTRY_TAG = 'book'
-    ENTRY_CHILD_TAGS = [
+    ENTRY_CHILD_TAGS = frozenset([
         'authors',
         'work',
-    ]
+    ])
 
     def __init__(self):
         """Initialization of variables for the parser
-        * in_content: reading target content (leaf strings)
-        * content: target content being read
         * books: list of books from the author,
             each book is a dictionary (id, title, image_url, description)
         * current_entry: the information from the current book
         """
-        self.in_content = False
+        super().__init__()
         self.in_entry = False
         self.in_authors = False
-        self.content = ""
         self.books = []
         self.current_entry = {}
         self.name = ""
@@ -52,7 +50,7 @@ class GoodreadsHandler(ContentHandler):
     def startElement(self, name, attrs):
         self.in_content = (
             (self.in_entry and not self.in_authors and name in self.ENTRY_TAGS) or
-            (not self.in_entry and name in self.TITLE_TAG)
+            (not self.in_entry and name in self.TITLE_TAGS)
         )
         if name == self.ENTRY_TAG:
             self.in_entry = True
@@ -62,7 +60,7 @@ class GoodreadsHandler(ContentHandler):
     def endElement(self, name):
         if self.in_entry and not self.in_authors and name in self.ENTRY_TAGS:
             self.current_entry[name] = self.content
-        elif not self.in_entry and name in self.TITLE_TAG:
+        elif not self.in_entry and name in self.TITLE_TAGS:
             self.name = self.content
         elif name == self.ENTRY_TAG:
             self.books.append(self.current_entry)
@@ -71,59 +69,42 @@ class GoodreadsHandler(ContentHandler):
         elif name in self.ENTRY_CHILD_TAGS:
             self.in_authors = False
 
-        self.content = ""
-        self.in_content = False
+        self.clear_content()
 
-    def characters(self, chars):
-        if self.in_content:
-            self.content = self.content + chars
 
-
-class GoodreadsAuthor(FeedParser):
+class GoodreadsAuthor(SaxFeedParser):
     """Class to get books from a author in Goodreads.
 
     Uses Goodreads API to get a list of books from author name
     or author id
     """
 
-    def __init__(self, stream):
-        # Get books list from xml
-        self.parser = make_parser()
-        self.handler = GoodreadsHandler()
-        self.parser.setContentHandler(self.handler)
-        self.parser.parse(stream)
+    handler_class = GoodreadsHandler
+
+    def new_entries(self):
+        books, self.handler.books = self.handler.books, []
+        return books
 
-        # Remove books with less than 1000 reviews
+    def skip_entry(self, item):
+        # Skip books with less than 1000 reviews
         # as they are probably language variations
         try:
-            self.books = [book for book in self.handler.books if int(book['ratings_count']) >= 1000]
+            return int(item['ratings_count']) < 1000
         except KeyError:
             raise ParsingError("Missing expected tag")
         except ValueError:
             raise ParsingError("Could not parse ratings count")
 
-
-        # Make sure all expected fields are filled
-        if not self.handler.name:
-            raise ParsingError("Feed has no title")
-        if not self.books:
-            raise ParsingError("Feed has no items")
-        if any(not self.is_item_complete(item) for item in self.books):
-            raise ParsingError("Some item is missing fields")
-
     def feed_title(self):
         return self.handler.name
 
-    def items_data(self):
-        items = []
-        for book in self.books:
-            items.append({
-                'key': book['id'],
-                'title': book['title'],
-                'description': book['description'],
-                'picture': book['image_url'],
-            })
-        return items
+    def item_data(self, item):
+        return {
+            'key': item['id'],
+            'title': item['title'],
+            'description': item['description'],
+            'picture': item['image_url'],
+        }
 
     def is_item_complete(self, item):
         ''' Checks if an individual item has all expected fields '''
@@ -133,25 +114,29 @@ class GoodreadsAuthor(FeedParser):
                 'image_url' in item)
 
 
-def get_author_id(author_name: str, api_key: str):
+
+def get_author_id(author_name: str, api_key: str, resolve=True):
     """Translates an author name into a Goodreads author id."""
     # Key is already an author id, not a name
-    if author_name.isdigit():
+    if author_name.isdigit() or not resolve:
         return {}, author_name
 
+    author_id = resolve_name(Config.GOODREADS, author_name,
+                             lambda name: search_author_id(name, api_key))
+    if author_id is None:
+        raise ParsingError("Key not found")
+    return {}, author_id
+
+
+def search_author_id(author_name: str, api_key: str):
+    """Asks Goodreads for the id of an author name,
+    returns None if there is no author with that name."""
     url = "https://www.goodreads.com/api/author_url/{feed}?key={api_key}"
     url = str.format(url, feed=quote(author_name), api_key=api_key)
-    stream = urlopen(url)
-
-    tree = ElementTree.parse(stream)
+    with urlopen(url) as stream:
+        tree = ElementTree.parse(stream)
     node = tree.find('author')
-    if node:
-        author_id = node.attrib['id']
-    else:
-        raise ParsingError("Key not found")
 
-    # Goodreads API has a one request per second limit
-    # Forcing sleep during 1 second to not risk losing
-    # the developer key
-    sleep(1)
-    return {}, author_id
\ No newline at end of file
+    if node is None:
+        return None
+    return node.attrib['id']
@@ -0,0 +1,304 @@
+import gzip
+import threading
+import zlib
+from time import sleep
+from collections import defaultdict
+from http.client import HTTPConnection, HTTPSConnection, HTTPException
+from io import BytesIO
+from urllib.error import URLError, HTTPError
+from urllib.parse import urlsplit, urljoin
+from urllib.request import Request
+
+from django.conf import settings
+
+from .ratelimit import limiter_for, retry_after
+
+REDIRECT_CODES = (301, 302, 303, 307, 308)
+# Answers of servers that get too many requests, which are made
+# again after the time they ask for or an increasing delay
+RETRY_CODES = (429, 503)
+RETRY_DELAY = 1
+# Requests are not made again if the server asks to wait longer than this
+MAX_RETRY_WAIT = 60
+
+# Exceptions raised when a kept-alive connection
+# was closed by the server while it was idle
+STALE_CONNECTION_ERRORS = (ConnectionResetError, BrokenPipeError, HTTPException)
+
+USER_AGENT = 'MisCosas feed reader'
+
+
+class ConnectionPool:
+    """Keeps HTTP connections open to be reused by the next
+    requests to the same host."""
+
+    def __init__(self, maxsize=4, timeout=10, max_redirects=5, max_retries=2):
+        """
+        Parameters
+        ----------------
+        maxsize : int
+            Maximum amount of idle connections kept for each host
+        timeout : float
+            Seconds to wait when connecting or receiving data
+        max_redirects : int
+            Maximum amount of redirections followed by a request
+        max_retries : int
+            Maximum amount of times a request is made again
+            when the server answers that it is busy
+        """
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self.max_redirects = max_redirects
+        self.max_retries = max_retries
+        self._idle = defaultdict(list)
+        self._lock = threading.Lock()
+
+    def urlopen(self, request, data=None):
+        """Makes a request like urllib.request.urlopen does.
+
+        Redirections are followed, responses with an error status
+        raise HTTPError and connection problems raise URLError.
+        Requests to hosts with a rate limit wait for their turn, and
+        requests answered with 429 or 503 are made again after the
+        time given by Retry-After, which the other requests to the
+        host wait too.
+
+        Parameters
+        ----------------
+        request : str or Request
+            The url or the request to make
+        data : bytes
+            Optional body of the request when request is an url
+
+        Returns a PooledResponse that can be read as a file.
+        """
+        if isinstance(request, str):
+            request = Request(request, data)
+
+        url = request.full_url
+        method = request.get_method()
+        body = request.data
+        headers = {name.title(): value for name, value in request.header_items()}
+        headers.setdefault('User-Agent', USER_AGENT)
+        headers['Accept-Encoding'] = 'gzip, deflate'
+        if body is not None:
+            headers.setdefault('Content-Type', 'application/x-www-form-urlencoded')
+
+        for attempt in range(self.max_retries + 1):
+            response = self._follow(url, method, body, headers)
+            if response.status not in RETRY_CODES:
+                break
+            wait = retry_after(response.headers)
+            if wait is None:
+                wait = RETRY_DELAY * 2 ** attempt
+            limiter = limiter_for(response.url)
+            if limiter:
+                # Longer pauses would keep the requests waiting for too long
+                limiter.pause(min(wait, MAX_RETRY_WAIT))
+            if attempt == self.max_retries or wait > MAX_RETRY_WAIT:
+                break
+            response.read()
+            response.close()
+            if not limiter:
+                sleep(wait)
+
+        if not 200 <= response.status < 300:
+            raise HTTPError(url, response.status, response.reason,
+                            response.headers, BytesIO(response.read()))
+        return response
+
+    def _follow(self, url, method, body, headers):
+        """Sends a request following its redirections."""
+        for _ in range(self.max_redirects + 1):
+            response = self._send(url, method, body, headers)
+            if response.status not in REDIRECT_CODES or 'Location' not in response.headers:
+                return response
+            response.read()
+            response.close()
+            url = urljoin(url, response.headers['Location'])
+            if response.status == 303 or (response.status in (301, 302) and method == 'POST'):
+                method, body = 'GET', None
+        raise HTTPError(url, response.status, 'Too many redirections',
+                        response.headers, None)
+
+    def _send(self, url, method, body, headers):
+        """Sends a request through a pooled connection,
+        once the rate limit of the host allows it."""
+        limiter = limiter_for(url)
+        if limiter:
+            limiter.acquire()
+        parts = urlsplit(url)
+        key = (parts.scheme, parts.hostname, parts.port)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+
+        connection, reused = self._get_connection(key)
+        try:
+            connection.request(method, path, body, headers)
+            raw = connection.getresponse()
+        except STALE_CONNECTION_ERRORS as error:
+            connection.close()
+            if not reused:
+                raise URLError(error)
+            # Try again with a new connection
+            return self._send_new(key, url, method, path, body, headers)
+        except OSError as error:
+            connection.close()
+            raise URLError(error)
+
+        return PooledResponse(self, key, connection, raw, url)
+
+    def _send_new(self, key, url, method, path, body, headers):
+        """Sends a request through a new connection."""
+        connection = self._new_connection(key)
+        try:
+            connection.request(method, path, body, headers)
+            raw = connection.getresponse()
+        except (OSError, HTTPException) as error:
+            connection.close()
+            raise URLError(error)
+        return PooledResponse(self, key, connection, raw, url)
+
+    def _get_connection(self, key):
+        """Returns an idle connection to the host or a new one,
+        and whether it was reused."""
+        with self._lock:
+            if self._idle[key]:
+                return self._idle[key].pop(), True
+        return self._new_connection(key), False
+
+    def _new_connection(self, key):
+        scheme, host, port = key
+        if scheme == 'https':
+            return HTTPSConnection(host, port, timeout=self.timeout)
+        return HTTPConnection(host, port, timeout=self.timeout)
+
+    def release(self, key, connection):
+        """Returns a connection to the pool after its response was read."""
+        with self._lock:
+            if len(self._idle[key]) < self.maxsize:
+                self._idle[key].append(connection)
+                return
+        connection.close()
+
+    def clear(self):
+        """Closes all the idle connections."""
+        with self._lock:
+            idle, self._idle = self._idle, defaultdict(list)
+        for connections in idle.values():
+            for connection in connections:
+                connection.close()
+
+
+class PooledResponse:
+    """Response of a pooled request, the body is decompressed
+    while it is read and the connection goes back to the pool
+    once the body has been read completely."""
+
+    def __init__(self, pool, key, connection, raw, url):
+        self._pool = pool
+        self._key = key
+        self._connection = connection
+        self._raw = raw
+        self.url = url
+        self.status = raw.status
+        self.reason = raw.reason
+        self.headers = raw.headers
+
+        encoding = raw.headers.get('Content-Encoding', '').lower()
+        if encoding == 'gzip':
+            self._stream = gzip.GzipFile(fileobj=raw)
+        elif encoding == 'deflate':
+            self._stream = DeflateReader(raw)
+        else:
+            self._stream = raw
+
+    @property
+    def code(self):
+        return self.status
+
+    def getcode(self):
+        return self.status
+
+    def read(self, amt=None):
+        data = self._stream.read() if amt is None else self._stream.read(amt)
+        if self._raw.isclosed():
+            self._release()
+        return data
+
+    def close(self):
+        """Frees the connection, if the body was not read completely
+        the connection can not be reused and is closed."""
+        if self._connection is None:
+            return
+        if not self._raw.isclosed():
+            self._raw.close()
+            self._connection.close()
+            self._connection = None
+            return
+        self._release()
+
+    def _release(self):
+        if self._connection is None:
+            return
+        if self._raw.will_close:
+            self._connection.close()
+        else:
+            self._pool.release(self._key, self._connection)
+        self._connection = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class DeflateReader:
+    """Decompresses a deflate encoded stream while it is read."""
+
+    CHUNK_SIZE = 16 * 1024
+
+    def __init__(self, raw):
+        self._raw = raw
+        self._decompressor = zlib.decompressobj()
+        self._started = False
+        self._buffer = b''
+
+    def read(self, amt=None):
+        while amt is None or len(self._buffer) < amt:
+            chunk = self._raw.read(self.CHUNK_SIZE)
+            if not chunk:
+                self._buffer += self._decompressor.flush()
+                break
+            self._buffer += self._decompress(chunk)
+
+        if amt is None:
+            data, self._buffer = self._buffer, b''
+        else:
+            data, self._buffer = self._buffer[:amt], self._buffer[amt:]
+        return data
+
+    def _decompress(self, chunk):
+        try:
+            data = self._decompressor.decompress(chunk)
+        except zlib.error:
+            if self._started:
+                raise
+            # Some servers send raw deflate data without the zlib header
+            self._decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+            data = self._decompressor.decompress(chunk)
+        self._started = True
+        return data
+
+
+# Pool shared by all the feed sources
+POOL = ConnectionPool(
+    getattr(settings, 'FEEDS_HTTP_POOL_SIZE', 4),
+    getattr(settings, 'FEEDS_HTTP_TIMEOUT', 10))
+
+
+def urlopen(request, data=None):
+    """Makes a request through the shared connection pool."""
+    return POOL.urlopen(request, data)
@@ -0,0 +1,132 @@
+import os
+import socket
+from datetime import timedelta
+from urllib.error import URLError, HTTPError
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .feedhandler import FEEDS_DATA
+from .feedparser import ParsingError
+
+# Seconds a worker has to finish a job before others can claim it
+LEASE_TIME = 5 * 60
+# Seconds before the first retry of a failed job, doubled on each retry
+RETRY_DELAY = 30
+# Due jobs looked at each time a worker tries to claim one,
+# in case other workers claim the first ones at the same time
+CLAIM_CANDIDATES = 10
+# Seconds between reloads of the page of a pending job
+JOB_REFRESH = 2
+
+
+def max_attempts():
+    return getattr(settings, 'FEED_JOB_ATTEMPTS', 5)
+
+
+def worker_name():
+    """Identifies the process running the jobs."""
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def enqueue_feed(source, feed_key, user=None):
+    """Asks for a feed to be loaded by the workers,
+    if it was already asked for the same job is returned.
+
+    The feed is chosen for the user once it is loaded."""
+    from miscosas.models import FeedJob
+
+    with transaction.atomic():
+        job = (FeedJob.objects
+            .filter(source=source, key=feed_key, state__in=(FeedJob.PENDING, FeedJob.RUNNING))
+            .order_by('pk').first())
+        if job is None:
+            job = FeedJob.objects.create(source=source, key=feed_key)
+        if user is not None and user.is_authenticated:
+            job.users.add(user)
+    return job
+
+
+def claim_job(worker=None, lease=LEASE_TIME):
+    """Marks the first due job as run by a worker.
+
+    A job is due if it is pending and its retry time has
+    passed, or if it is running and its lease has ended.
+    Several workers can claim jobs at the same time, each
+    job is claimed by only one of them.
+
+    Returns the claimed job or None if there are no due jobs."""
+    from miscosas.models import FeedJob
+
+    now = timezone.now()
+    due = (FeedJob.objects
+        .filter(Q(state=FeedJob.PENDING, run_after__lte=now) |
+                Q(state=FeedJob.RUNNING, lease_until__lte=now))
+        .order_by('run_after', 'pk')
+        .values_list('pk', 'state', 'lease_until')[:CLAIM_CANDIDATES])
+    for pk, state, lease_until in due:
+        # Only changes the job if no other worker changed it since it was read
+        claimed = FeedJob.objects.filter(pk=pk, state=state, lease_until=lease_until).update(
+            state=FeedJob.RUNNING,
+            lease_until=now + timedelta(seconds=lease),
+            worker=worker or worker_name(),
+            attempts=F('attempts') + 1)
+        if claimed:
+            return FeedJob.objects.get(pk=pk)
+    return None
+
+
+def run_job(job):
+    """Loads the feed of a claimed job.
+
+    Errors that can go away, like connection problems or
+    overloaded servers, make the job be tried again later
+    until it has been tried too many times."""
+    from miscosas.models import FeedJob
+
+    try:
+        if job.attempts > max_attempts():
+            raise RuntimeError("The job was not finished in time too many times")
+        feed = FEEDS_DATA[job.source].load(job.key)
+    except Exception as error:
+        job.error = str(error)
+        if is_transient(error) and job.attempts < max_attempts():
+            job.state = FeedJob.PENDING
+            job.run_after = timezone.now() + timedelta(
+                seconds=RETRY_DELAY * 2 ** (job.attempts - 1))
+        else:
+            job.state = FeedJob.FAILED
+    else:
+        with transaction.atomic():
+            for user in job.users.select_related('profile'):
+                user.profile.chosen_feeds.add(feed)
+            job.feed = feed
+            job.error = ''
+            job.state = FeedJob.DONE
+    job.lease_until = None
+    job.save(update_fields=['state', 'run_after', 'lease_until', 'feed', 'error'])
+    return job
+
+
+def is_transient(error):
+    """Whether a request that raised error might work later."""
+    if isinstance(error, HTTPError):
+        return error.code == 429 or error.code >= 500
+    if isinstance(error, ParsingError):
+        return False
+    return isinstance(error, (URLError, OSError))
+
+
+def run_due_jobs(worker=None, limit=None):
+    """Runs jobs until there are no due jobs or limit jobs have run.
+
+    Returns the jobs that were run."""
+    jobs = []
+    while limit is None or len(jobs) < limit:
+        job = claim_job(worker)
+        if job is None:
+            break
+        jobs.append(run_job(job))
+    return jobs
@@ -0,0 +1,49 @@
+from datetime import timedelta
+
+from django.utils import timezone
+
+# Time a name is translated without asking the source again
+FOUND_TTL = timedelta(days=30)
+# Time a name that did not exist is not asked again
+NOT_FOUND_TTL = timedelta(days=1)
+
+
+def normalize_name(name: str):
+    """Name with lower case letters and single spaces."""
+    return ' '.join(name.split()).casefold()
+
+
+def resolve_name(source: str, name: str, lookup):
+    """Translates a name into the id the source uses for it.
+
+    The answers are kept in the database, including the names
+    that were not found, so that the source is only asked again
+    after they expire.
+
+    Parameters
+    ----------------
+    source : str
+        The identifier for the source of the data
+    name : str
+        The name to translate
+    lookup : func
+        Function that asks the source for the id of a name,
+        it returns None if the name does not exist
+
+    Returns the id or None if the name does not exist.
+    """
+    from miscosas.models import KeyResolution
+
+    normalized = normalize_name(name)
+    cached = KeyResolution.objects.filter(source=source, name=normalized).first()
+    if cached:
+        ttl = FOUND_TTL if cached.remote_id else NOT_FOUND_TTL
+        if cached.date + ttl > timezone.now():
+            return cached.remote_id or None
+
+    remote_id = lookup(name)
+    KeyResolution.objects.update_or_create(
+        source=source,
+        name=normalized,
+        defaults={'remote_id': remote_id or ''})
+    return remote_id
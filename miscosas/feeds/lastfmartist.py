@@ -1,34 +1,28 @@
 #!/usr/bin/python3
 
-from xml.sax.handler import ContentHandler
-from xml.sax import make_parser
+from .feedparser import SaxFeedParser, TextHandler
 
-from .feedparser import FeedParser, ParsingError
 
-
-class LastFmHandler(ContentHandler):
+class LastFmHandler(TextHandler):
     """Class to handle events fired by the SAX parser
 
     Fills in self.albums with data from albums
     in a Last.fm artist XML document.
     """
 
-    ALBUM_TAGS = [
+    ALBUM_TAGS = frozenset([
         'name',
         'image'
-    ]
+    ])
 
     def __init__(self):
         """Initialization of variables for the parser
-        * in_content: reading target content (leaf strings)
-        * content: target content being read
         * albums: list of albums in the artist,
             each album is a dictionary (name, image)
         * current_album: the information from the current entry
         """
-        self.in_content = False
+        super().__init__()
         self.in_artist = False
-        self.content = ""
         self.albums = []
         self.current_album = {}
         self.name = ""
@@ -51,46 +45,30 @@ class LastFmHandler(ContentHandler):
         if name == 'artist':
             self.in_artist = False
 
-        self.content = ""
-        self.in_content = False
-
-    def characters(self, chars):
-        if self.in_content:
-            self.content = self.content + chars
+        self.clear_content()
 
 
-class LastFmArtist(FeedParser):
+class LastFmArtist(SaxFeedParser):
     """Class to get albums in a last.fm artist.
 
     Extracts video info from the XML document for a last.fm artist.
     """
 
-    def __init__(self, stream):
-        self.parser = make_parser()
-        self.handler = LastFmHandler()
-        self.parser.setContentHandler(self.handler)
-        self.parser.parse(stream)
+    handler_class = LastFmHandler
 
-        # Make sure all expected fields are filled
-        if not self.handler.name:
-            raise ParsingError("Feed has no title")
-        if not self.handler.albums:
-            raise ParsingError("Feed has no items")
-        if any(not self.is_item_complete(item) for item in self.handler.albums):
-            raise ParsingError("Some item is missing fields")
+    def new_entries(self):
+        albums, self.handler.albums = self.handler.albums, []
+        return albums
 
     def feed_title(self):
         return self.handler.name
 
-    def items_data(self):
-        items = []
-        for album in self.handler.albums:
-            items.append({
-                'key': album['name'],
-                'title': album['name'],
-                'picture': album['image'],
-            })
-        return items
+    def item_data(self, item):
+        return {
+            'key': item['name'],
+            'title': item['name'],
+            'picture': item['image'],
+        }
 
     def is_item_complete(self, item):
         ''' Checks if an individual item has all expected fields '''
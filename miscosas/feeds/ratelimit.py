@@ -0,0 +1,84 @@
+import threading
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from time import monotonic, sleep
+from urllib.parse import urlsplit
+
+# Limiters of the hosts that have one, by host and port
+LIMITERS = {}
+
+
+class RateLimiter:
+    """Token bucket that spaces the requests made to a host.
+
+    Requests over the rate are not rejected, they wait for their
+    turn in the order they arrived."""
+
+    def __init__(self, rate, burst=1):
+        """
+        Parameters
+        ----------------
+        rate : float
+            Requests per second allowed on average
+        burst : int
+            Requests that can be made at once after a quiet period
+        """
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        # Time the tokens were counted, later than now while paused
+        self._updated = monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Waits until a request can be made, returns the seconds waited."""
+        with self._lock:
+            now = monotonic()
+            if now > self._updated:
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+            # Negative tokens are the requests already waiting
+            self._tokens -= 1
+            wait = (self._updated - now) + max(-self._tokens, 0) / self.rate
+        if wait > 0:
+            sleep(wait)
+        return wait
+
+    def pause(self, seconds):
+        """Makes no request for some seconds, for when the host
+        answered that it is getting too many requests."""
+        with self._lock:
+            self._updated = max(self._updated, monotonic() + seconds)
+            # Only one request is made as soon as the pause ends
+            self._tokens = min(self._tokens, 1)
+
+
+def host_key(url):
+    return urlsplit(url).netloc.lower()
+
+
+def set_rate_limit(url, rate, burst=1):
+    """Limits the requests made to the host of url."""
+    LIMITERS[host_key(url)] = RateLimiter(rate, burst)
+
+
+def limiter_for(url):
+    """Limiter of the host of url, None if it has no limit."""
+    return LIMITERS.get(host_key(url))
+
+
+def retry_after(headers):
+    """Seconds to wait given by a Retry-After header,
+    as seconds or as a date, None if there is none."""
+    value = headers.get('Retry-After', '').strip()
+    if not value:
+        return None
+    if value.isdigit():
+        return int(value)
+    try:
+        date = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=timezone.utc)
+    return max((date - datetime.now(timezone.utc)).total_seconds(), 0)
@@ -0,0 +1,96 @@
+from collections import namedtuple, defaultdict, deque, Counter
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from django.db import connections
+
+from .feedhandler import FEEDS_DATA
+
+# Maximum amount of documents being downloaded at the same time
+MAX_WORKERS = 8
+# Maximum amount of documents being downloaded at the same time
+# from the same source, to not overload any external API
+MAX_PER_SOURCE = 4
+
+# Outcome of refreshing a feed, stats is None if there was an error
+# or if the document had not changed since the last refresh
+RefreshResult = namedtuple('RefreshResult', ['feed', 'stats', 'error'])
+
+
+def refresh_feeds(feeds, max_workers=MAX_WORKERS, max_per_source=MAX_PER_SOURCE):
+    """Updates the data of several feeds.
+
+    The documents are downloaded in parallel by a pool of threads,
+    while they are parsed and written to the database one at a time
+    from the calling thread as each download finishes.
+
+    Parameters
+    ----------------
+    feeds : Iterable[Feed]
+        The feeds to refresh
+    max_workers : int
+        Maximum amount of downloads at the same time
+    max_per_source : int
+        Maximum amount of downloads at the same time for a single source
+
+    Yields a RefreshResult for each feed in the order they finish.
+    """
+    pending = defaultdict(deque)
+    for feed in feeds:
+        pending[feed.source].append(feed)
+
+    running = {}
+    active = Counter()
+
+    with ThreadPoolExecutor(max_workers) as executor:
+
+        def submit_ready():
+            """Starts the downloads that fit in the worker limits."""
+            for source, queue in pending.items():
+                while (queue and active[source] < max_per_source and
+                       len(running) < max_workers):
+                    feed = queue.popleft()
+                    future = executor.submit(fetch_feed, feed)
+                    running[future] = feed
+                    active[source] += 1
+
+        submit_ready()
+        while running:
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            finished = [(future, running.pop(future)) for future in done]
+            for _, feed in finished:
+                active[feed.source] -= 1
+
+            # Keep the pool busy while the results are written
+            submit_ready()
+
+            for future, feed in finished:
+                yield store_result(feed, future)
+
+
+def fetch_feed(feed):
+    """Downloads the document of a feed from a worker thread."""
+    try:
+        # The stored key is not looked up again, it could be a name
+        # that resolves to another feed by now
+        return FEEDS_DATA[feed.source].fetch(feed.key, feed.validators, resolve=False)
+    finally:
+        # Name lookups might have opened a connection in this thread
+        connections.close_all()
+
+
+def store_result(feed, future):
+    """Parses and writes the document of a finished download."""
+    try:
+        result = future.result()
+        if result.parser is None:
+            FEEDS_DATA[feed.source].save_validators(feed, result.validators)
+            return RefreshResult(feed, None, None)
+        feed, stats = FEEDS_DATA[feed.source].store_parser(
+            result.key,
+            result.parser,
+            choose=False,
+            validators=result.validators)
+        return RefreshResult(feed, stats, None)
+    except Exception as error:
+        # A broken feed must not stop the refresh of the rest
+        return RefreshResult(feed, None, error)
@@ -0,0 +1,142 @@
+import heapq
+import math
+from datetime import datetime, timedelta
+
+from django.db.models import Count
+from django.utils import timezone
+
+from .refresh import refresh_feeds, MAX_WORKERS, MAX_PER_SOURCE
+
+# Limits of the time between two refreshes of a feed, in seconds
+MIN_INTERVAL = 5 * 60
+MAX_INTERVAL = 7 * 24 * 60 * 60
+# Interval of feeds whose change rate is still unknown
+BASE_INTERVAL = 60 * 60
+# New items expected between two refreshes of a feed
+TARGET_NEW_ITEMS = 1
+# Weight of the last refresh in the averaged change rate
+RATE_SMOOTHING = 0.3
+# Feeds are scheduled again from the database this often, in seconds,
+# to know of the feeds added or changed by other processes
+RELOAD_INTERVAL = 10 * 60
+
+# Due time of feeds that were never scheduled
+NEVER = datetime.min.replace(tzinfo=timezone.utc)
+
+
+def feed_weight(subscribers, chosen):
+    """How much sooner a feed is refreshed for its audience:
+    each doubling of its subscribers shortens its interval."""
+    return 1 + math.log2(1 + subscribers) + (1 if chosen else 0)
+
+
+def next_interval(change_rate, quiet_refreshes, weight=1):
+    """Seconds until the next refresh of a feed.
+
+    It is the time TARGET_NEW_ITEMS take to appear at the change
+    rate, in new items per hour, doubled for each refresh in a row
+    without new items and divided by the weight of the feed."""
+    if change_rate > 0:
+        interval = TARGET_NEW_ITEMS / change_rate * 60 * 60
+    else:
+        interval = BASE_INTERVAL
+    interval = min(interval * 2 ** min(quiet_refreshes, 32), MAX_INTERVAL)
+    return max(interval / weight, MIN_INTERVAL)
+
+
+def schedule_feed(feed, new_items, now=None, failed=False):
+    """Records the result of a refresh of a feed and when it
+    has to be refreshed again.
+
+    The feed needs a subscribers attribute with the amount
+    of users that chose it. Returns the next refresh time."""
+    from miscosas.models import Feed
+
+    now = now or timezone.now()
+    change_rate = feed.change_rate
+    quiet_refreshes = feed.quiet_refreshes + 1
+    last_new_items = feed.last_new_items
+    if not failed:
+        elapsed = (now - feed.last_refresh).total_seconds() if feed.last_refresh else BASE_INTERVAL
+        observed = new_items / max(elapsed, MIN_INTERVAL) * 60 * 60
+        if feed.last_refresh is None:
+            change_rate = observed
+        else:
+            change_rate = RATE_SMOOTHING * observed + (1 - RATE_SMOOTHING) * change_rate
+        if new_items:
+            quiet_refreshes = 0
+            last_new_items = now
+
+    weight = feed_weight(feed.subscribers, feed.chosen)
+    next_refresh = now + timedelta(seconds=next_interval(change_rate, quiet_refreshes, weight))
+    Feed.objects.filter(pk=feed.pk).update(
+        next_refresh=next_refresh,
+        last_refresh=now if not failed else feed.last_refresh,
+        last_new_items=last_new_items,
+        change_rate=change_rate,
+        quiet_refreshes=quiet_refreshes)
+    return next_refresh
+
+
+class RefreshScheduler:
+    """Refreshes the feeds when they are due, from a priority
+    queue of the feeds ordered by their next refresh time."""
+
+    def __init__(self, max_feeds=MAX_WORKERS * 4, max_workers=MAX_WORKERS,
+                 max_per_source=MAX_PER_SOURCE):
+        """
+        Parameters
+        ----------------
+        max_feeds : int
+            Maximum amount of feeds refreshed in a round
+        max_workers : int
+            Maximum amount of downloads at the same time
+        max_per_source : int
+            Maximum amount of downloads at the same time for a single source
+        """
+        self.max_feeds = max_feeds
+        self.max_workers = max_workers
+        self.max_per_source = max_per_source
+        self._queue = []
+        self._loaded = None
+
+    def load(self, now=None):
+        """Fills the queue with the due times of all the feeds."""
+        from miscosas.models import Feed
+
+        self._queue = [(next_refresh or NEVER, pk) for pk, next_refresh
+                       in Feed.objects.values_list('pk', 'next_refresh')]
+        heapq.heapify(self._queue)
+        self._loaded = now or timezone.now()
+
+    def next_due(self):
+        """Time of the next due feed, None if there are no feeds."""
+        return self._queue[0][0] if self._queue else None
+
+    def run_once(self, now=None):
+        """Refreshes the feeds that are due and schedules them again.
+
+        Yields the RefreshResult of each refreshed feed."""
+        from miscosas.models import Feed
+
+        now = now or timezone.now()
+        if self._loaded is None or (now - self._loaded).total_seconds() > RELOAD_INTERVAL:
+            self.load(now)
+
+        due = []
+        while self._queue and self._queue[0][0] <= now and len(due) < self.max_feeds:
+            due.append(heapq.heappop(self._queue)[1])
+        if not due:
+            return
+
+        feeds = (Feed.objects.filter(pk__in=due)
+            .annotate(subscribers=Count('users')).order_by())
+        subscribers = {feed.pk: feed.subscribers for feed in feeds}
+        for result in refresh_feeds(feeds, self.max_workers, self.max_per_source):
+            # The stored feed does not have the subscribers
+            result.feed.subscribers = subscribers.get(result.feed.pk, 0)
+            new_items = result.stats.inserted if result.stats else 0
+            next_refresh = schedule_feed(result.feed, new_items, timezone.now(),
+                                         failed=result.error is not None)
+            heapq.heappush(self._queue, (next_refresh, result.feed.pk))
+            yield result
@@ -1,15 +1,73 @@
-from xml.etree.ElementTree import Element, SubElement, tostring
-from xml.dom import minidom
 import json
-from collections.abc import Iterable
+from io import BytesIO
+from xml.sax.saxutils import XMLGenerator
 
-from django.http.response import HttpResponse, Http404
-from django.core.serializers import serialize
+from django.http.response import HttpResponse, StreamingHttpResponse, Http404
+from django.core.serializers.json import DjangoJSONEncoder
 from django.core.handlers.wsgi import WSGIRequest
-from django.db.models.query import QuerySet
 from django.db.models import Model
 
 from miscosas.models import Feed, Item, Comment, User
+from .serializers import section_serializer
+
+# Spaces of indentation of the XML documents
+DEFAULT_INDENT = 2
+
+
+class XmlWriter:
+    """Writes an XML document piece by piece, flush returns
+    the text written since the last time it was called."""
+
+    def __init__(self, indent=DEFAULT_INDENT):
+        self._output = BytesIO()
+        self._generator = XMLGenerator(self._output, 'utf-8', short_empty_elements=True)
+        self._indent = indent
+        # Whether each open element has child elements
+        self._open = []
+        self._generator.startDocument()
+
+    def start(self, tag: str, **attrs):
+        """Opens an element that will contain other elements."""
+        self._new_line()
+        self._generator.startElement(tag, attrs)
+        self._open.append(False)
+
+    def end(self, tag: str):
+        """Closes the last element opened."""
+        if self._open.pop():
+            self._line_break()
+        self._generator.endElement(tag)
+
+    def element(self, tag: str, text=None, **attrs):
+        """Writes an element with only text inside."""
+        self._new_line()
+        self._generator.startElement(tag, attrs)
+        if text:
+            self._generator.characters(text)
+        self._generator.endElement(tag)
+
+    def close(self):
+        self._generator.endDocument()
+        if self._indent:
+            self._generator.ignorableWhitespace('\n')
+
+    def flush(self):
+        data = self._output.getvalue()
+        self._output.seek(0)
+        self._output.truncate()
+        return data
+
+    def _new_line(self):
+        if not self._open:
+            # The root element goes right after the declaration
+            return
+        self._open[-1] = True
+        self._line_break()
+
+    def _line_break(self):
+        if self._indent:
+            self._generator.ignorableWhitespace('\n' + ' ' * self._indent * len(self._open))
+
 
 def render_document(request: WSGIRequest, context: dict, format: str) -> HttpResponse:
     """Returns the page requested as a document."""
@@ -21,135 +79,126 @@ def render_document(request: WSGIRequest, context: dict, format: str) -> HttpRes
         return Http404("Not supported")
 
 def render_xml(request: WSGIRequest, context: dict):
-    """Returns the page context as XML."""
-    xml = Element('page')
-    SubElement(xml, 'link', href=request.build_absolute_uri(request.path))
-    for name in context:
+    """Returns the page context as XML, it is sent while it is written.
+
+    The indent query parameter sets the spaces of indentation,
+    0 writes the document in a single line."""
+    try:
+        indent = max(int(request.GET.get('indent', DEFAULT_INDENT)), 0)
+    except ValueError:
+        indent = DEFAULT_INDENT
+    return StreamingHttpResponse(xml_document(request, context, indent), content_type='text/xml')
+
+def xml_document(request: WSGIRequest, context: dict, indent: int):
+    """Yields the pieces of the XML document of a page."""
+    writer = XmlWriter(indent)
+    writer.start('page')
+    writer.element('link', href=request.build_absolute_uri(request.path))
+    yield writer.flush()
+
+    for name, value in context.items():
         if name == 'title':
-            SubElement(xml, name).text = context[name]
-        elif isinstance(context[name], Iterable):
-            if any(isinstance(i, Feed) for i in context[name]):
-                feeds = SubElement(xml, 'feeds', name=name)
-                feeds.extend([feed_xml(request, feed, False) for feed in context[name]])
-            elif any(isinstance(i, Item) for i in context[name]):
-                items = SubElement(xml, 'items', {'name': name})
-                items.extend([item_xml(request, item, False) for item in context[name]])
-            elif any(isinstance(i, User) for i in context[name]):
-                xml.extend([user_xml(request, user, False) for user in context[name]])
-        elif isinstance(context[name], Feed):
-            xml.append(feed_xml(request, context[name], True))
-        elif isinstance(context[name], Item):
-            xml.append(item_xml(request, context[name], True))
-        elif isinstance(context[name], User):
-            xml.append(user_xml(request, context[name], True))
-    return HttpResponse(prettify(xml), content_type='text/xml')
-
-def prettify(elem):
-    """Returns a pretty-printed XML string for the Element."""
-    rough_string = tostring(elem, 'utf-8')
-    reparsed = minidom.parseString(rough_string)
-    return reparsed.toprettyxml(indent="  ")
-
-def feed_xml(request: WSGIRequest, feed: Feed, detailed: bool):
-    """Returns a Feed model as XML."""
-    element = Element('feed')
-    SubElement(element, 'title').text = feed.title
-    SubElement(element, 'source').text = feed.source_pretty
+            writer.element(name, value)
+            continue
+        serializer = section_serializer(value)
+        if serializer is None:
+            continue
+        if isinstance(value, Model):
+            instance, = serializer.rows([value])
+            if isinstance(instance, Feed):
+                feed_xml(writer, request, instance, True)
+            elif isinstance(instance, Item):
+                item_xml(writer, request, instance, True)
+            elif isinstance(instance, User):
+                user_xml(writer, request, instance, True)
+            yield writer.flush()
+            continue
+        if serializer.model not in (Feed, Item, User):
+            continue
+
+        section = None
+        for row in serializer.iter_rows(value):
+            if section is None and serializer.model is not User:
+                section = 'feeds' if serializer.model is Feed else 'items'
+                writer.start(section, name=name)
+            if serializer.model is Feed:
+                feed_xml(writer, request, row, False)
+            elif serializer.model is Item:
+                item_xml(writer, request, row, False)
+            else:
+                user_xml(writer, request, row, False)
+            yield writer.flush()
+        if section:
+            writer.end(section)
+
+    writer.end('page')
+    writer.close()
+    yield writer.flush()
+
+def feed_xml(writer: XmlWriter, request: WSGIRequest, feed: Feed, detailed: bool):
+    """Writes a Feed model as XML."""
+    writer.start('feed')
+    writer.element('title', feed.title)
+    writer.element('source', feed.source_pretty)
     if detailed:
-        SubElement(element, 'link', href=feed.link)
-        SubElement(element, 'chosen').text = str(feed.chosen)
+        writer.element('link', href=feed.link)
+        writer.element('chosen', str(feed.chosen))
     else:
-        SubElement(element, 'link', href=request.build_absolute_uri('/feed/' + str(feed.pk)))
-    return element
+        writer.element('link', href=request.build_absolute_uri('/feed/' + str(feed.pk)))
+    writer.end('feed')
 
-def item_xml(request: WSGIRequest, item: Item, detailed: bool):
-    """Returns an Item model as XML."""
-    element = Element('item')
-    SubElement(element, 'title').text = item.title
+def item_xml(writer: XmlWriter, request: WSGIRequest, item: Item, detailed: bool):
+    """Writes an Item model as XML."""
+    writer.start('item')
+    writer.element('title', item.title)
     if detailed:
-        SubElement(element, 'link', href=item.link)
-        SubElement(element, 'description').text = item.description
-        SubElement(element, 'image', src=item.picture)
-        element.extend([comment_xml(comment) for comment in item.comments.all().order_by('-date')[:20]])
+        writer.element('link', href=item.link)
+        writer.element('description', item.description)
+        writer.element('image', src=item.picture)
+        for comment in item.comments.all().order_by('-date')[:20]:
+            comment_xml(writer, comment)
     else:
-        SubElement(element, 'link', href=request.build_absolute_uri('/item/' + str(item.pk)))
-    SubElement(element, 'upvotes').text = str(item.upvote_count)
-    SubElement(element, 'downvotes').text = str(item.downvote_count)
-    element.append(feed_xml(request, item.feed, False))
-    return element
-
-def comment_xml(comment: Comment):
-    """Returns a Comment model as XML."""
-    element = Element('comment')
-    SubElement(element, 'title').text = comment.title
-    SubElement(element, 'content').text = comment.content
-    SubElement(element, 'date').text = str(comment.date)
-    return element
-
-def user_xml(request: WSGIRequest, user: User, detailed: bool):
-    """Returns a User model as XML."""
-    element = Element('user')
-    SubElement(element, 'name').text = user.username
+        writer.element('link', href=request.build_absolute_uri('/item/' + str(item.pk)))
+    writer.element('upvotes', str(item.upvote_count))
+    writer.element('downvotes', str(item.downvote_count))
+    feed_xml(writer, request, item.feed, False)
+    writer.end('item')
+
+def comment_xml(writer: XmlWriter, comment: Comment):
+    """Writes a Comment model as XML."""
+    writer.start('comment')
+    writer.element('title', comment.title)
+    writer.element('content', comment.content)
+    writer.element('date', str(comment.date))
+    writer.end('comment')
+
+def user_xml(writer: XmlWriter, request: WSGIRequest, user: User, detailed: bool):
+    """Writes a User model as XML."""
+    writer.start('user')
+    writer.element('name', user.username)
     if not detailed:
-        SubElement(element, 'link', href=request.build_absolute_uri('/user/' + user.username))
-    return element
+        writer.element('link', href=request.build_absolute_uri('/user/' + user.username))
+    writer.end('user')
 
 def render_json(request: WSGIRequest, context: dict):
-    """Returns the page context as JSON."""
-    delete_key = []
-    for name in context:
-        # Parse a query set into a list of dictionaries with the
-        # fields from the each object
-        if isinstance(context[name], QuerySet):
-            if any(isinstance(i, Item) for i in context[name]):
-                extra = [item_votes_json(item) for item in context[name]]
-                context[name] = [{**d, **e} for d, e in zip(list(context[name].values()), extra)]
-            elif any(isinstance(i, User) for i in context[name]):
-                extra = [user_profile_json(user) for user in context[name]]
-                context[name] = [{**d, **e} for d, e in zip(list(context[name].values('username')), extra)]
-            else:
-                context[name] = list(context[name].values())
-        # Parse a model instance into a dictionary with its field
-        elif isinstance(context[name], Model):
-            if isinstance(context[name], Item):
-                data = json.loads(serialize('json', [context[name]]))[0]['fields']
-                context[name] = {**data, **item_votes_json(context[name])}
-            elif isinstance(context[name], User):
-                data = json.loads(serialize('json', [context[name]]))[0]['fields']
-                context[name] = {'username': data['username'], **user_profile_json(context[name])}
-            else:
-                context[name] = json.loads(serialize('json', [context[name]]))[0]['fields']
-        # Parse a list of model instances into a list of dictionaries with
-        # each object's fields
-        elif isinstance(context[name], list):
-            data = json.loads(serialize('json', context[name]))
-            if any(isinstance(i, Item) for i in context[name]):
-                extra = [item_votes_json(item) for item in context[name]]
-                context[name] = [{**(d['fields']), **e} for d, e in zip(data, extra)]
-            elif any(isinstance(i, User) for i in context[name]):
-                extra = [user_profile_json(user) for user in context[name]]
-                context[name] = [{'username': d['fields']['username'], **e} for d, e in zip(data, extra)]
-            else:
-                context[name] = [d['fields'] for d in data]
-        # Delete all other keys from the context
-        elif not isinstance(context[name], str):
-            delete_key.append(name)
-
-    for key in delete_key:
-        del context[key]
-    return HttpResponse(json.dumps(context, indent=4), content_type="application/json")
-
-def item_votes_json(item):
-    """Returns dictionary with Item model extra fields for the json."""
-    return {
-        'upvotes': item.upvote_count,
-        'downvotes': item.downvote_count
-    }
-
-def user_profile_json(user):
-    """Returns dictionary with User model extra fields for the json."""
-    return {
-        'picture': user.profile.picture,
-        'votes': user.votes.count(),
-        'comments': user.comments.count(),
-    }
+    """Returns the page context as JSON.
+
+    Instances of the models are written with their serializers,
+    other values that are not strings are left out."""
+    data = {}
+    for name, value in context.items():
+        serializer = section_serializer(value)
+        if isinstance(value, str):
+            data[name] = value
+        elif serializer is None:
+            # Empty lists of instances
+            if isinstance(value, list) and not value:
+                data[name] = []
+        elif isinstance(value, Model):
+            instance, = serializer.rows([value])
+            data[name] = serializer.to_dict(instance)
+        else:
+            data[name] = [serializer.to_dict(row) for row in serializer.rows(value)]
+
+    return HttpResponse(json.dumps(data, indent=4, cls=DjangoJSONEncoder),
+                        content_type="application/json")
@@ -0,0 +1,124 @@
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Model
+from django.db.models.query import QuerySet
+
+from miscosas.models import Feed, Item, Comment, User
+
+
+class Serializer:
+    """Declares how the instances of a model are written in the
+    JSON and XML documents of the pages."""
+
+    model = None
+    # Fields of the model written for each instance, or paths
+    # to attributes of related instances like 'profile.picture'
+    fields = ()
+    # Amounts written for each instance, each one is the name of a
+    # counter (which can be a path too) or an expression to annotate
+    counts = {}
+    # Relations that are read together with the instances
+    related = ()
+
+    def rows(self, entries):
+        """Returns the instances of a QuerySet or a list of instances
+        read with a single query that includes their counts."""
+        if isinstance(entries, QuerySet) and not (entries.query.is_sliced and self.annotations()):
+            return list(self.prepare(entries))
+
+        # Read the instances again, keeping their order
+        if isinstance(entries, QuerySet):
+            pks = list(entries.values_list('pk', flat=True))
+        else:
+            pks = [entry.pk for entry in entries]
+        if not pks:
+            return []
+        rows = {row.pk: row for row in self.prepare(self.model.objects.filter(pk__in=pks))}
+        return [rows[pk] for pk in pks if pk in rows]
+
+    def iter_rows(self, entries):
+        """Yields the instances like rows does, whole query sets
+        are read in chunks instead of all at once."""
+        if isinstance(entries, QuerySet) and not entries.query.is_sliced:
+            yield from self.prepare(entries).iterator()
+        else:
+            yield from self.rows(entries)
+
+    def prepare(self, qset):
+        """Adds the related instances and the counts to a QuerySet."""
+        qset = qset.select_related(*self.related)
+        annotations = self.annotations()
+        if annotations:
+            qset = qset.annotate(**annotations)
+        return qset
+
+    def annotations(self):
+        return {self.alias(name): expression for name, expression in self.counts.items()
+                if not isinstance(expression, str)}
+
+    def alias(self, name):
+        return name + '_total'
+
+    def to_dict(self, instance):
+        """Returns the fields and counts of an instance."""
+        data = {path.split('.')[-1]: self.value(instance, path) for path in self.fields}
+        for name, expression in self.counts.items():
+            if isinstance(expression, str):
+                data[name] = self.value(instance, expression)
+            else:
+                data[name] = getattr(instance, self.alias(name))
+        return data
+
+    def value(self, instance, path):
+        """Returns the value of a field or attribute path."""
+        *relations, name = path.split('.')
+        for relation in relations:
+            instance = getattr(instance, relation, None)
+        if instance is None:
+            return None
+        try:
+            return instance._meta.get_field(name).value_from_object(instance)
+        except FieldDoesNotExist:
+            return getattr(instance, name, None)
+
+
+class FeedSerializer(Serializer):
+    model = Feed
+    fields = ('id', 'key', 'title', 'source', 'chosen')
+    counts = {'items': 'item_count'}
+
+
+class ItemSerializer(Serializer):
+    model = Item
+    fields = ('id', 'key', 'title', 'feed_id', 'description', 'picture')
+    counts = {'upvotes': 'upvote_count', 'downvotes': 'downvote_count'}
+    related = ('feed',)
+
+
+class CommentSerializer(Serializer):
+    model = Comment
+    fields = ('id', 'title', 'content', 'date', 'user', 'item')
+
+
+class UserSerializer(Serializer):
+    model = User
+    fields = ('username', 'profile.picture')
+    counts = {'votes': 'profile.vote_count', 'comments': 'profile.comment_count'}
+    related = ('profile',)
+
+
+SERIALIZERS = {
+    serializer.model: serializer()
+    for serializer in (FeedSerializer, ItemSerializer, CommentSerializer, UserSerializer)
+}
+
+
+def section_serializer(value):
+    """Returns the serializer for the instances in a context value,
+    or None if it does not hold instances of a known model."""
+    if isinstance(value, QuerySet):
+        return SERIALIZERS.get(value.model)
+    if isinstance(value, (list, tuple)) and value and isinstance(value[0], Model):
+        return SERIALIZERS.get(type(value[0]))
+    if isinstance(value, Model):
+        return SERIALIZERS.get(type(value))
+    return None
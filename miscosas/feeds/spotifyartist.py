@@ -2,10 +2,16 @@
 
 import base64
 import json
-from urllib.request import Request, urlopen
+import threading
+from time import monotonic
+from urllib.error import HTTPError
+from urllib.request import Request
 from urllib.parse import quote
 
+from miscosas.apps import MisCosasConfig as Config
 from .feedparser import FeedParser, ParsingError
+from .httppool import urlopen
+from .keycache import resolve_name
 
 
 class SpotifyHandler:
@@ -53,33 +59,24 @@ class SpotifyArtist(FeedParser):
     Uses Spotify API to get a list of tracks from a JSON response
     """
 
-    def __init__(self, stream):
+    def parse_entries(self):
+        # The response is a short list, it is read at once
         try:
-            self.handler = SpotifyHandler(stream)
+            self.handler = SpotifyHandler(self.stream)
         except (KeyError, IndexError):
             raise ParsingError("Could not parse data")
-
-        # Make sure all expected fields are filled
-        if not self.handler.name:
-            raise ParsingError("Feed has no title")
-        if not self.handler.tracks:
-            raise ParsingError("Feed has no items")
-        if any(not self.is_item_complete(item) for item in self.handler.tracks):
-            raise ParsingError("Some item is missing fields")
+        yield from self.handler.tracks
 
     def feed_title(self):
         return self.handler.name
 
-    def items_data(self):
-        items = []
-        for track in self.handler.tracks:
-            items.append({
-                'key': track['id'],
-                'title': track['name'],
-                'description': track['description'],
-                'picture': track['image'],
-            })
-        return items
+    def item_data(self, item):
+        return {
+            'key': item['id'],
+            'title': item['name'],
+            'description': item['description'],
+            'picture': item['image'],
+        }
 
     def is_item_complete(self, item):
         """Checks if an individual item has all expected fields."""
@@ -89,31 +86,98 @@ class SpotifyArtist(FeedParser):
                 'image' in item)
 
 
-def get_artist_id(artist_name: str, api_key: str):
-    """Translates an artist name into a Spotify artist id."""
-    # Get token
-    token_url = "https://accounts.spotify.com/api/token"
-    authorization = base64.standard_b64encode(api_key.encode('utf-8')).decode('utf-8')
-    headers = {'Authorization' : 'Basic ' + authorization}
-    data = "grant_type=client_credentials".encode('utf-8')
-    request = Request(token_url, data, headers, method='POST')
-    response = urlopen(request)
-    response_dict = json.load(response)
-    token = response_dict.get('access_token')
+class TokenCache:
+    """Keeps the client credentials tokens of the Spotify API
+    and renews them shortly before they expire.
+
+    Threads that need a token while it is being renewed wait
+    for that request instead of making their own."""
+
+    # Seconds before the expiration when a token is renewed
+    EXPIRY_MARGIN = 60
+
+    def __init__(self, token_url="https://accounts.spotify.com/api/token"):
+        self.token_url = token_url
+        self._tokens = {}
+        self._lock = threading.Lock()
+
+    def get(self, api_key: str):
+        """Returns a valid token for the clientID:clientSecret api_key."""
+        token = self._valid_token(api_key)
+        if token:
+            return token
+
+        with self._lock:
+            # It might have been renewed while waiting for the lock
+            token = self._valid_token(api_key)
+            if not token:
+                token = self._request_token(api_key)
+        return token
+
+    def invalidate(self, api_key: str):
+        """Forgets the token of api_key, for when it has been rejected."""
+        self._tokens.pop(api_key, None)
+
+    def _valid_token(self, api_key):
+        token, expires = self._tokens.get(api_key, (None, 0))
+        if monotonic() < expires:
+            return token
+        return None
+
+    def _request_token(self, api_key):
+        authorization = base64.standard_b64encode(api_key.encode('utf-8')).decode('utf-8')
+        headers = {'Authorization' : 'Basic ' + authorization}
+        data = "grant_type=client_credentials".encode('utf-8')
+        request = Request(self.token_url, data, headers, method='POST')
+        with urlopen(request) as response:
+            response_dict = json.load(response)
+
+        token = response_dict.get('access_token')
+        if not token:
+            raise ParsingError("Could not get an access token")
+        expires_in = int(response_dict.get('expires_in', 0))
+        self._tokens[api_key] = (token, monotonic() + expires_in - self.EXPIRY_MARGIN)
+        return token
+
+
+# Tokens shared by all the requests of the process
+TOKENS = TokenCache()
+
+
+def get_artist_id(artist_name: str, api_key: str, resolve=True):
+    """Translates an artist name into a Spotify artist id,
+    if resolve is False only the headers are made."""
+    headers = {'Authorization' : 'Bearer ' + TOKENS.get(api_key)}
+    if not resolve:
+        return headers, artist_name
+    try:
+        artist_id = resolve_name(Config.SPOTIFY, artist_name,
+                                 lambda name: search_artist_id(name, headers))
+    except HTTPError as error:
+        if error.code != 401:
+            raise
+        # The token was rejected before it expired, try with a new one
+        TOKENS.invalidate(api_key)
+        headers = {'Authorization' : 'Bearer ' + TOKENS.get(api_key)}
+        artist_id = resolve_name(Config.SPOTIFY, artist_name,
+                                 lambda name: search_artist_id(name, headers))
+
+    # No artist was found, try using the key as artist id instead
+    if artist_id is None:
+        return headers, artist_name
+    return headers, artist_id
+
 
-    # Search artist name to get id
+def search_artist_id(artist_name: str, headers: dict):
+    """Searches an artist name with the API to get its id,
+    returns None if no artist was found."""
     search_url = f"https://api.spotify.com/v1/search?q={quote(artist_name)}&type=artist&limit=1"
-    headers = {'Authorization' : 'Bearer ' + token}
     request = Request(search_url, headers=headers, method='GET')
-    response = urlopen(request)
-
-    # Get artist id from response
-    response_dict = json.load(response)
+    with urlopen(request) as response:
+        # Get artist id from response
+        response_dict = json.load(response)
     items = response_dict['artists']['items']
 
-    # No artist was found, try using it the key as artist id instead
     if len(items) == 0:
-        return headers, artist_name
-
-    artist_id = items[0].get('id')
-    return headers, artist_id
+        return None
+    return items[0].get('id')
@@ -1,41 +1,35 @@
 #!/usr/bin/python3
 
-from xml.sax.handler import ContentHandler
-from xml.sax import make_parser
+from .feedparser import SaxFeedParser, TextHandler, ParsingError
 
-from .feedparser import FeedParser, ParsingError
 
-
-class RedditHandler(ContentHandler):
+class RedditHandler(TextHandler):
     """Class to handle events fired by the SAX parser
 
     Fills in self.news with data from news items
     in a subreddit RSS feed.
     """
 
-    ENTRY_TAGS = [
+    ENTRY_TAGS = frozenset([
         'content',
         'id',
         'title',
-    ]
+    ])
 
-    FEED_TAGS = [
+    FEED_TAGS = frozenset([
         'title'
-    ]
+    ])
 
     ENTRY_TAG = 'entry'
 
     def __init__(self):
         """Initialization of variables for the parser
-        * in_content: reading target content (leaf strings)
-        * content: target content being read
         * news: list of news in the subreddit,
             each news is a dictionary (title, id, content)
         * current_entry: the information from the current news
         """
-        self.in_content = False
+        super().__init__()
         self.in_entry = False
-        self.content = ""
         self.news = []
         self.current_entry = {}
         self.name = ""
@@ -57,35 +51,25 @@ class RedditHandler(ContentHandler):
             self.current_entry = {}
             self.in_entry = False
 
-        self.content = ""
-        self.in_content = False
-
-    def characters(self, chars):
-        if self.in_content:
-            self.content = self.content + chars
+        self.clear_content()
 
 
-class Subreddit(FeedParser):
+class Subreddit(SaxFeedParser):
     """Class to get news from a subreddit.
 
     Extracts item info from the XML document for a reddit rss feed.
     """
 
-    def __init__(self, stream):
-        self.parser = make_parser()
-        self.handler = RedditHandler()
-        self.parser.setContentHandler(self.handler)
-        self.parser.parse(stream)
+    handler_class = RedditHandler
+
+    def new_entries(self):
+        news, self.handler.news = self.handler.news, []
+        return news
 
-        # Make sure all expected fields are filled
-        if not self.handler.name:
-            raise ParsingError("Feed has no title")
+    def check_feed(self):
+        super().check_feed()
         if self.handler.name == "search results":
             raise ParsingError("Key not found")
-        if not self.handler.news:
-            raise ParsingError("Feed has no items")
-        if any(not self.is_item_complete(item) for item in self.handler.news):
-            raise ParsingError("Some item is missing fields")
 
     def feed_title(self):
         name = self.handler.name
@@ -94,15 +78,12 @@ class Subreddit(FeedParser):
         else:
             return name
 
-    def items_data(self):
-        items = []
-        for news in self.handler.news:
-            items.append({
-                'key': news['id'].split('_')[1],
-                'title': news['title'],
-                'description': self.format_content(news['content']),
-            })
-        return items
+    def item_data(self, item):
+        return {
+            'key': item['id'].split('_')[1],
+            'title': item['title'],
+            'description': self.format_content(item['content']),
+        }
 
     def is_item_complete(self, item):
         ''' Checks if an individual item has all expected fields '''
@@ -117,4 +98,4 @@ class Subreddit(FeedParser):
             span_start = content.find("<span>", pos)
             span_end = content.find("</span>", span_start)
             content = content[:span_start] + content[span_end:]
-        return content
\ No newline at end of file
+        return content
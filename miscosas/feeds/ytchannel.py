@@ -1,24 +1,23 @@
 #!/usr/bin/python3
 
-from xml.sax.handler import ContentHandler
-from xml.sax import make_parser
+from .feedparser import SaxFeedParser, TextHandler
 
-from .feedparser import FeedParser, ParsingError
 
-
-class YTHandler(ContentHandler):
+class YTHandler(TextHandler):
     """Class to handle events fired by the SAX parser
 
     Fills in self.videos with data from videos
     in a YT channel XML document.
     """
 
-    CONTENT_ELEMENTS = [
+    CONTENT_ELEMENTS = frozenset([
         'yt:videoId',
         'media:title',
         'published',
         'media:description',
-    ]
+    ])
+
+    READ_ELEMENTS = CONTENT_ELEMENTS | {'name', 'uri'}
 
     ATTR_ELEMENTS = {
         'link': 'href',
@@ -27,21 +26,17 @@ class YTHandler(ContentHandler):
 
     def __init__(self):
         """Initialization of variables for the parser
-        * inContent: reading target content (leaf strings)
-        * content: target content being readed
         * videos: list of videos (<entry> elements) in the channel,
             each video is a dictionary
         * current_video: the information from the current <entry>
         """
-        self.inContent = False
-        self.content = ""
+        super().__init__()
         self.videos = []
         self.current_video = {}
         self.channel_name = ""
 
     def startElement(self, name, attrs):
-        self.inContent = (name in self.CONTENT_ELEMENTS or
-                          name == 'name' or name == 'uri')
+        self.in_content = name in self.READ_ELEMENTS
         if name in self.ATTR_ELEMENTS:
             self.current_video[name] = attrs.get(self.ATTR_ELEMENTS[name])
 
@@ -54,47 +49,31 @@ class YTHandler(ContentHandler):
         elif name in self.CONTENT_ELEMENTS:
             self.current_video[name] = self.content
 
-        self.content = ""
-        self.inContent = False
-
-    def characters(self, chars):
-        if self.inContent:
-            self.content = self.content + chars
+        self.clear_content()
 
 
-class YTChannel(FeedParser):
+class YTChannel(SaxFeedParser):
     """Class to get videos in a YouTube channel.
 
     Extracts video info from the XML document for a YT channel.
     """
 
-    def __init__(self, stream):
-        self.parser = make_parser()
-        self.handler = YTHandler()
-        self.parser.setContentHandler(self.handler)
-        self.parser.parse(stream)
+    handler_class = YTHandler
 
-        # Make sure all expected fields are filled
-        if not self.handler.channel_name:
-            raise ParsingError("Feed has no title")
-        if not self.handler.videos:
-            raise ParsingError("Feed has no items")
-        if any(not self.is_item_complete(item) for item in self.handler.videos):
-            raise ParsingError("Some item is missing fields")
+    def new_entries(self):
+        videos, self.handler.videos = self.handler.videos, []
+        return videos
 
     def feed_title(self):
         return self.handler.channel_name
 
-    def items_data(self):
-        items = []
-        for video in self.handler.videos:
-            items.append({
-                'key': video['yt:videoId'],
-                'title': video['media:title'],
-                'description': video['media:description'],
-                'picture': video['media:thumbnail'],
-            })
-        return items
+    def item_data(self, item):
+        return {
+            'key': item['yt:videoId'],
+            'title': item['media:title'],
+            'description': item['media:description'],
+            'picture': item['media:thumbnail'],
+        }
 
     def is_item_complete(self, item):
         ''' Checks if an individual item has all expected fields '''
@@ -0,0 +1,79 @@
+"""
+Versions of the data shown in the cached fragments of the templates
+"""
+
+import hashlib
+from uuid import uuid4
+
+from django.core.cache import cache
+from django.db import connection, transaction
+
+# Seconds a rendered fragment is kept
+FRAGMENT_TIMEOUT = 10 * 60
+
+VERSION_PREFIX = 'fragment:version:'
+FRAGMENT_PREFIX = 'fragment:'
+
+# Changed when everything must be rendered again
+ALL = 'all'
+
+
+def item_key(pk):
+    return f'item:{pk}'
+
+def activity_key(pk):
+    """Votes and comments of an item."""
+    return f'item-activity:{pk}'
+
+def feed_key(pk):
+    return f'feed:{pk}'
+
+def user_key(pk):
+    return f'user:{pk}'
+
+
+def data_keys(instance):
+    """Returns the keys of the versions of the data
+    that the fragment of an instance shows."""
+    model = instance._meta.model_name
+    if model == 'item':
+        return [ALL, item_key(instance.pk), activity_key(instance.pk), feed_key(instance.feed_id)]
+    if model == 'feed':
+        return [ALL, feed_key(instance.pk)]
+    if model == 'user':
+        return [ALL, user_key(instance.pk)]
+    raise ValueError(f"No fragments for {model}")
+
+
+def versions(keys):
+    """Returns the current versions of the keys."""
+    names = [VERSION_PREFIX + key for key in keys]
+    found = cache.get_many(names)
+    for name in names:
+        if name not in found:
+            # Forgotten versions get a new value so that the
+            # fragments stored with the old one are not used
+            cache.add(name, uuid4().hex, None)
+            found[name] = cache.get(name)
+    return [found[name] for name in names]
+
+
+def bump(*keys):
+    """Gives new versions to the keys, the fragments
+    that show their data will be rendered again.
+
+    Inside a transaction they are changed again when it commits,
+    in case a fragment was rendered with the old data meanwhile."""
+    def set_versions():
+        cache.set_many({VERSION_PREFIX + key: uuid4().hex for key in keys}, None)
+    set_versions()
+    if connection.in_atomic_block:
+        transaction.on_commit(set_versions)
+
+
+def fragment_key(name, instance, vary_on):
+    """Returns the cache key of a fragment of an instance, which
+    changes with the versions of its data and the values in vary_on."""
+    parts = versions(data_keys(instance)) + [str(value) for value in vary_on]
+    digest = hashlib.md5(':'.join(parts).encode('utf-8')).hexdigest()
+    return f'{FRAGMENT_PREFIX}{name}:{instance.pk}:{digest}'
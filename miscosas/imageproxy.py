@@ -0,0 +1,240 @@
+"""
+Copies of the pictures of the items, resized and kept in a
+directory so that the pages do not load them from their sources
+"""
+
+import hashlib
+import ipaddress
+import os
+import socket
+import tempfile
+import threading
+from contextlib import contextmanager
+from io import BytesIO
+from time import monotonic
+from urllib.error import URLError
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.core.cache import cache
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from .feeds import httppool
+
+# Widths the pictures are resized to, bigger pictures keep their proportions
+PROXY_SIZES = (160, 320, 640)
+PROXY_QUALITY = 85
+# Seconds browsers keep a picture before asking if it changed
+PICTURE_MAX_AGE = 7 * 24 * 60 * 60
+
+# Pictures bigger than this are not downloaded
+MAX_SOURCE_BYTES = 10 * 1024 * 1024
+# Seconds a picture that could not be read is not requested again
+FAILURE_TIMEOUT = 5 * 60
+# Pictures are only downloaded from public addresses with these schemes,
+# unless IMAGE_PROXY_ALLOW_PRIVATE lets the private ones be used too
+PICTURE_SCHEMES = ('http', 'https')
+
+# Once the directory of the pictures is bigger than IMAGE_CACHE_MAX_BYTES,
+# the least recently used ones are removed until it is below LOW_WATER of it
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+LOW_WATER = 0.9
+# The size of the directory is kept as a running total of the pictures this
+# process stores, which is counted again from the files after this many seconds
+# to include the pictures stored by other processes
+RECOUNT_INTERVAL = 10 * 60
+
+# Pictures being made by this process, so that a picture
+# requested by several visitors at once is only fetched once
+_locks = {}
+_locks_lock = threading.Lock()
+
+# Bytes in each directory of pictures and when they were counted
+_sizes = {}
+_sizes_lock = threading.Lock()
+
+
+class PictureError(Exception):
+    """The picture could not be downloaded or read."""
+
+
+def check_public_url(url: str):
+    """Raises URLError unless url is http(s) and its host only
+    has public addresses, so that the urls of the pictures cannot
+    make the site request its own network."""
+    parts = urlsplit(url)
+    if parts.scheme not in PICTURE_SCHEMES or not parts.hostname:
+        raise URLError(f'Not an http url: {url}')
+    if getattr(settings, 'IMAGE_PROXY_ALLOW_PRIVATE', False):
+        return
+    try:
+        port = parts.port or (443 if parts.scheme == 'https' else 80)
+        addresses = socket.getaddrinfo(parts.hostname, port, proto=socket.IPPROTO_TCP)
+    except (socket.gaierror, ValueError) as error:
+        raise URLError(error)
+    for *_, address in addresses:
+        ip = ipaddress.ip_address(address[0].split('%')[0])
+        if not ip.is_global or ip.is_multicast:
+            raise URLError(f'Not a public address: {url}')
+
+
+class PicturePool(httppool.ConnectionPool):
+    """Connection pool that checks the url of every request,
+    including the ones of the redirections."""
+
+    def _send(self, url, method, body, headers):
+        check_public_url(url)
+        return super()._send(url, method, body, headers)
+
+
+_pool = PicturePool(
+    getattr(settings, 'FEEDS_HTTP_POOL_SIZE', 4),
+    getattr(settings, 'FEEDS_HTTP_TIMEOUT', 10))
+
+
+def picture_key(url: str, size: int) -> str:
+    """Name of the stored copy of a picture, it changes with its url."""
+    return hashlib.sha256(f'{size}:{url}'.encode()).hexdigest()[:32]
+
+
+def cache_dir() -> str:
+    return getattr(settings, 'IMAGE_CACHE_DIR', os.path.join(settings.BASE_DIR, 'imagecache'))
+
+
+def picture_path(key: str) -> str:
+    return os.path.join(cache_dir(), key[:2], key + '.jpg')
+
+
+def proxied_picture(url: str, size: int) -> str:
+    """Path of the copy of a picture resized to size, which is
+    downloaded and stored the first time it is requested.
+
+    Raises PictureError if the picture could not be obtained."""
+    key = picture_key(url, size)
+    path = picture_path(key)
+    if _touch(path):
+        return path
+    if cache.get(f'picture-failed:{key}'):
+        raise PictureError(url)
+
+    with _lock(key):
+        if _touch(path):
+            return path
+        try:
+            stored = _store(url, size, path)
+        except PictureError:
+            cache.set(f'picture-failed:{key}', True, FAILURE_TIMEOUT)
+            raise
+    _count_bytes(stored)
+    return path
+
+
+def _touch(path) -> bool:
+    """Marks a stored picture as used, returns whether it exists."""
+    try:
+        os.utime(path)
+        return True
+    except FileNotFoundError:
+        return False
+
+
+@contextmanager
+def _lock(key):
+    with _locks_lock:
+        lock, users = _locks.get(key, (threading.Lock(), 0))
+        _locks[key] = (lock, users + 1)
+    try:
+        with lock:
+            yield
+    finally:
+        with _locks_lock:
+            lock, users = _locks[key]
+            if users == 1:
+                del _locks[key]
+            else:
+                _locks[key] = (lock, users - 1)
+
+
+def _store(url, size, path):
+    """Downloads a picture and writes it resized to path,
+    returns the bytes written."""
+    try:
+        with _pool.urlopen(url) as response:
+            data = response.read(MAX_SOURCE_BYTES + 1)
+    except (URLError, OSError, ValueError) as error:
+        raise PictureError(url) from error
+    if len(data) > MAX_SOURCE_BYTES:
+        raise PictureError(url)
+
+    try:
+        with Image.open(BytesIO(data)) as image:
+            image = ImageOps.exif_transpose(image).convert('RGB')
+            image.thumbnail((size, size * 4), Image.LANCZOS)
+            output = BytesIO()
+            image.save(output, 'jpeg', quality=PROXY_QUALITY, optimize=True, progressive=True)
+    except (UnidentifiedImageError, OSError, Image.DecompressionBombError) as error:
+        raise PictureError(url) from error
+
+    # Written apart and renamed so that no one reads half a file
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    descriptor, temporary = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(descriptor, 'wb') as file:
+            file.write(output.getvalue())
+        os.replace(temporary, path)
+    except OSError:
+        os.remove(temporary)
+        raise
+    return len(output.getvalue())
+
+
+def max_cache_bytes() -> int:
+    return getattr(settings, 'IMAGE_CACHE_MAX_BYTES', DEFAULT_MAX_BYTES)
+
+
+def _count_bytes(size):
+    """Adds a stored picture to the size of the directory, which
+    is only walked when it is too big or its count is too old."""
+    directory = cache_dir()
+    with _sizes_lock:
+        total, counted = _sizes.get(directory, (None, 0.0))
+        if total is not None and monotonic() - counted < RECOUNT_INTERVAL:
+            _sizes[directory] = (total + size, counted)
+            if total + size <= max_cache_bytes():
+                return
+    trim_cache()
+
+
+def trim_cache(max_bytes=None):
+    """Removes the least recently used pictures while
+    the directory is bigger than max_bytes."""
+    if max_bytes is None:
+        max_bytes = max_cache_bytes()
+    directory = cache_dir()
+    entries = []
+    total = 0
+    for subdirectory, _, names in os.walk(directory):
+        for name in names:
+            if name.endswith('.tmp'):
+                # Still being written
+                continue
+            path = os.path.join(subdirectory, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+
+    if total > max_bytes:
+        entries.sort()
+        for _, size, path in entries:
+            if total <= max_bytes * LOW_WATER:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+    with _sizes_lock:
+        _sizes[directory] = (total, monotonic())
@@ -0,0 +1,101 @@
+import os
+import re
+from io import BytesIO
+from time import perf_counter
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from miscosas.feeds.ytchannel import YTChannel
+from miscosas.feeds.lastfmartist import LastFmArtist
+from miscosas.feeds.subreddit import Subreddit
+from miscosas.feeds.flickrtag import FlickrTag
+from miscosas.feeds.goodreadsauthor import GoodreadsAuthor
+from miscosas.feeds.spotifyartist import SpotifyArtist
+from miscosas.feeds.feedparser import SaxFeedParser
+
+FIXTURES_DIR = os.path.join(settings.BASE_DIR, 'miscosas', 'tests', 'fixtures')
+
+# Recorded document of each source and its parser
+FIXTURES = {
+    'youtube.xml': YTChannel,
+    'lastfm.xml': LastFmArtist,
+    'reddit.xml': Subreddit,
+    'flickr.xml': FlickrTag,
+    'goodreads.xml': GoodreadsAuthor,
+    'spotify.json': SpotifyArtist,
+}
+
+
+class ConcatText:
+    """Gathers the content of the handler by string concatenation,
+    the way the handlers used to, to compare with."""
+
+    def __init__(self):
+        super().__init__()
+        self._text = ""
+
+    @property
+    def content(self):
+        return self._text
+
+    def characters(self, chars):
+        if self.in_content:
+            self._text = self._text + chars
+
+    def clear_content(self):
+        self._text = ""
+        self.in_content = False
+
+
+def concat_parser(parser_class):
+    """Returns a version of a SAX parser class
+    whose handler uses string concatenation."""
+    handler_class = type('Concat' + parser_class.handler_class.__name__,
+                         (ConcatText, parser_class.handler_class), {})
+    return type('Concat' + parser_class.__name__,
+                (parser_class,), {'handler_class': handler_class})
+
+
+def best_time(parser_class, data, repeat):
+    """Returns the shortest time in seconds it took to parse data."""
+    times = []
+    for _ in range(repeat):
+        start = perf_counter()
+        parser_class(BytesIO(data)).items_data()
+        times.append(perf_counter() - start)
+    return min(times)
+
+
+class Command(BaseCommand):
+    help = "Measures the time it takes to parse the recorded feed documents."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=20,
+            help="Times each document is parsed, the best time is shown.")
+        parser.add_argument('--scale', type=int, default=1,
+            help="Repeat the paragraphs of the long descriptions this many times.")
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"{'document':<16}{'size':>10}{'concat ms':>12}{'chunks ms':>12}{'speedup':>10}")
+        for name, parser_class in FIXTURES.items():
+            with open(os.path.join(FIXTURES_DIR, name), 'rb') as fixture:
+                data = fixture.read()
+
+            if not issubclass(parser_class, SaxFeedParser):
+                elapsed = best_time(parser_class, data, options['repeat'])
+                self.stdout.write(f"{name:<16}{len(data):>10}{'-':>12}{elapsed * 1000:>12.2f}{'-':>10}")
+                continue
+
+            data = scale_text(data, options['scale'])
+            concat = best_time(concat_parser(parser_class), data, options['repeat'])
+            chunks = best_time(parser_class, data, options['repeat'])
+            self.stdout.write(f"{name:<16}{len(data):>10}{concat * 1000:>12.2f}"
+                              f"{chunks * 1000:>12.2f}{concat / chunks:>9.2f}x")
+
+
+def scale_text(data, scale):
+    """Makes the escaped HTML descriptions of an XML document longer."""
+    if scale == 1:
+        return data
+    return re.sub(rb'&lt;p&gt;.*?&lt;/p&gt;', lambda match: match.group(0) * scale, data)
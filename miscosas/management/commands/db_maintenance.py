@@ -0,0 +1,65 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+# Value of the auto_vacuum pragma that lets the free pages be removed bit by bit
+INCREMENTAL = 2
+
+
+class Command(BaseCommand):
+    help = ("Updates the statistics of the SQLite database, returns its free pages "
+            "to the file system and moves the write-ahead log into the database.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--analyze', action='store_true',
+            help="Only update the statistics the query planner uses.")
+        parser.add_argument('--vacuum', action='store_true',
+            help="Only remove free pages from the file.")
+        parser.add_argument('--checkpoint', action='store_true',
+            help="Only move the write-ahead log into the database and truncate it.")
+        parser.add_argument('--pages', type=int, default=0,
+            help="Free pages to remove, all of them by default.")
+        parser.add_argument('--enable-incremental', action='store_true',
+            help="Make the free pages removable bit by bit, it rewrites the whole file once.")
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError("The database is not SQLite")
+
+        tasks = [task for task in ('analyze', 'vacuum', 'checkpoint') if options[task]]
+        tasks = tasks or ['analyze', 'vacuum', 'checkpoint']
+
+        with connection.cursor() as cursor:
+            if options['enable_incremental']:
+                cursor.execute('PRAGMA auto_vacuum = INCREMENTAL')
+                cursor.execute('VACUUM')
+                self.stdout.write("Incremental vacuum enabled")
+
+            if 'analyze' in tasks:
+                cursor.execute('ANALYZE')
+                self.stdout.write("Statistics updated")
+
+            if 'vacuum' in tasks:
+                cursor.execute('PRAGMA auto_vacuum')
+                if cursor.fetchone()[0] != INCREMENTAL:
+                    self.stdout.write(self.style.WARNING(
+                        "Incremental vacuum is not enabled, use --enable-incremental once"))
+                else:
+                    cursor.execute('PRAGMA freelist_count')
+                    free = cursor.fetchone()[0]
+                    cursor.execute(f"PRAGMA incremental_vacuum({max(options['pages'], 0)})")
+                    cursor.fetchall()
+                    cursor.execute('PRAGMA freelist_count')
+                    self.stdout.write(f"Removed {free - cursor.fetchone()[0]} free pages")
+
+            if 'checkpoint' in tasks:
+                cursor.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+                busy, log, checkpointed = cursor.fetchone()
+                if busy:
+                    self.stdout.write(self.style.WARNING(
+                        "Checkpoint incomplete, the log is in use"))
+                elif log < 0:
+                    self.stdout.write("The database does not use a write-ahead log")
+                else:
+                    self.stdout.write(f"Checkpointed {checkpointed} of {log} log pages")
+
+        self.stdout.write(self.style.SUCCESS("Maintenance done"))
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from miscosas.pagecache import page_cache_stats, reset_page_cache_stats
+
+
+class Command(BaseCommand):
+    help = "Shows how many anonymous page requests were answered from the cache."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true',
+            help="Start counting again after showing the numbers.")
+
+    def handle(self, *args, **options):
+        hits, misses = page_cache_stats()
+        total = hits + misses
+        ratio = hits / total if total else 0
+        self.stdout.write(f"Hits: {hits}, misses: {misses}, hit ratio: {ratio:.1%}")
+        if options['reset']:
+            reset_page_cache_stats()
+            self.stdout.write(self.style.SUCCESS("Counters reset"))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from miscosas.models import rebuild_counters
+
+
+class Command(BaseCommand):
+    help = "Recalculates the vote and comment counters of items, feeds and profiles."
+
+    def handle(self, *args, **options):
+        rebuild_counters()
+        self.stdout.write(self.style.SUCCESS("Counters rebuilt"))
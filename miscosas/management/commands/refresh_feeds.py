@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand
+
+from miscosas.apps import MisCosasConfig as Config
+from miscosas.models import Feed
+from miscosas.feeds.refresh import refresh_feeds, MAX_WORKERS, MAX_PER_SOURCE
+
+
+class Command(BaseCommand):
+    help = "Downloads the latest data of the feeds stored in the database."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--source', action='append', choices=list(Config.SOURCES),
+            help="Only refresh feeds from this source, can be repeated.")
+        parser.add_argument('--chosen', action='store_true',
+            help="Only refresh the feeds chosen to be shown on the main page.")
+        parser.add_argument('--workers', type=int, default=MAX_WORKERS,
+            help="Maximum amount of downloads at the same time.")
+        parser.add_argument('--per-source', type=int, default=MAX_PER_SOURCE,
+            help="Maximum amount of downloads at the same time from a source.")
+
+    def handle(self, *args, **options):
+        feeds = Feed.objects.all()
+        if options['source']:
+            feeds = feeds.filter(source__in=options['source'])
+        if options['chosen']:
+            feeds = feeds.filter(chosen=True)
+
+        refreshed = failed = 0
+        results = refresh_feeds(feeds, options['workers'], options['per_source'])
+        for feed, stats, error in results:
+            if error:
+                failed += 1
+                self.stderr.write(f"{feed}: {error}")
+            elif stats is None:
+                refreshed += 1
+                self.stdout.write(f"{feed}: not modified")
+            else:
+                refreshed += 1
+                self.stdout.write(f"{feed}: {stats.inserted} new, "
+                                  f"{stats.updated} updated, {stats.unchanged} unchanged")
+
+        summary = f"Refreshed {refreshed} feeds, {failed} failed"
+        self.stdout.write(self.style.SUCCESS(summary) if not failed else self.style.WARNING(summary))
@@ -0,0 +1,43 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from miscosas.feeds.jobs import claim_job, run_job, worker_name, LEASE_TIME
+
+
+class Command(BaseCommand):
+    help = ("Loads the feeds that users asked for. Several workers "
+            "can run at the same time, each job is run by one of them.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+            help="Exit when there are no due jobs instead of waiting for more.")
+        parser.add_argument('--poll', type=float, default=1.0,
+            help="Seconds to wait before looking for jobs again when there are none.")
+        parser.add_argument('--lease', type=int, default=LEASE_TIME,
+            help="Seconds a job is kept by this worker before others can claim it.")
+
+    def handle(self, *args, **options):
+        worker = worker_name()
+        self.stdout.write(f"Worker {worker} started")
+        try:
+            while True:
+                close_old_connections()
+                job = claim_job(worker, options['lease'])
+                if job is None:
+                    if options['once']:
+                        break
+                    time.sleep(options['poll'])
+                    continue
+
+                job = run_job(job)
+                if job.state == job.DONE:
+                    self.stdout.write(f"{job}: loaded")
+                elif job.state == job.PENDING:
+                    self.stderr.write(f"{job}: {job.error}, retrying at {job.run_after}")
+                else:
+                    self.stderr.write(f"{job}: {job.error}")
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(self.style.SUCCESS(f"Worker {worker} stopped"))
@@ -0,0 +1,49 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from django.utils import timezone
+
+from miscosas.feeds.refresh import MAX_WORKERS, MAX_PER_SOURCE
+from miscosas.feeds.scheduler import RefreshScheduler, RELOAD_INTERVAL
+
+
+class Command(BaseCommand):
+    help = ("Refreshes each feed when it is due, sooner for the feeds "
+            "that often have new items or that more users chose.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+            help="Refresh the feeds that are due now and exit.")
+        parser.add_argument('--max-feeds', type=int, default=MAX_WORKERS * 4,
+            help="Maximum amount of feeds refreshed at once.")
+        parser.add_argument('--workers', type=int, default=MAX_WORKERS,
+            help="Maximum amount of downloads at the same time.")
+        parser.add_argument('--per-source', type=int, default=MAX_PER_SOURCE,
+            help="Maximum amount of downloads at the same time from a source.")
+
+    def handle(self, *args, **options):
+        scheduler = RefreshScheduler(options['max_feeds'], options['workers'],
+                                     options['per_source'])
+        try:
+            while True:
+                close_old_connections()
+                for feed, stats, error in scheduler.run_once():
+                    if error:
+                        self.stderr.write(f"{feed}: {error}")
+                    elif stats is None:
+                        self.stdout.write(f"{feed}: not modified")
+                    else:
+                        self.stdout.write(f"{feed}: {stats.inserted} new")
+                if options['once']:
+                    break
+
+                next_due = scheduler.next_due()
+                wait = RELOAD_INTERVAL
+                if next_due is not None:
+                    wait = min(max((next_due - timezone.now()).total_seconds(), 0), wait)
+                # The feeds still due are refreshed in the next round
+                time.sleep(max(wait, 1))
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(self.style.SUCCESS("Scheduler stopped"))
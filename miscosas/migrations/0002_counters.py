@@ -0,0 +1,68 @@
+# Generated by Django 3.1.14 on 2026-10-18 08:20
+
+from django.db import migrations, models
+from django.db.models import Count, F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def populate_counters(apps, schema_editor):
+    """Fills the new counters from the existing votes and comments."""
+    Feed = apps.get_model('miscosas', 'Feed')
+    Item = apps.get_model('miscosas', 'Item')
+    Vote = apps.get_model('miscosas', 'Vote')
+    Comment = apps.get_model('miscosas', 'Comment')
+    Profile = apps.get_model('miscosas', 'Profile')
+
+    def count(queryset, field, outer='pk'):
+        subquery = (queryset.filter(**{field: OuterRef(outer)})
+            .order_by().values(field).annotate(total=Count('pk')).values('total'))
+        return Coalesce(Subquery(subquery), 0)
+
+    item_score = (Item.objects.filter(feed=OuterRef('pk'))
+        .order_by().values('feed')
+        .annotate(total=Sum(F('upvote_count') - F('downvote_count')))
+        .values('total'))
+
+    Item.objects.update(
+        upvote_count=count(Vote.objects.filter(positive=True), 'item'),
+        downvote_count=count(Vote.objects.filter(positive=False), 'item'))
+    Feed.objects.update(score=Coalesce(Subquery(item_score), 0))
+    Profile.objects.update(
+        vote_count=count(Vote.objects.all(), 'user', 'user'),
+        comment_count=count(Comment.objects.all(), 'user', 'user'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('miscosas', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='feed',
+            name='score',
+            field=models.IntegerField(default=0, editable=False, verbose_name='score'),
+        ),
+        migrations.AddField(
+            model_name='item',
+            name='downvote_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='downvotes'),
+        ),
+        migrations.AddField(
+            model_name='item',
+            name='upvote_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='upvotes'),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='comment_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='comments'),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='vote_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='votes'),
+        ),
+        migrations.RunPython(populate_counters, migrations.RunPython.noop),
+    ]
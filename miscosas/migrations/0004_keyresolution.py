@@ -0,0 +1,26 @@
+# Generated by Django 3.1.14 on 2026-10-18 08:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('miscosas', '0003_feed_validators'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='KeyResolution',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(choices=[('yt', 'YouTube'), ('lfm', 'last.fm'), ('rd', 'Reddit'), ('fl', 'Flickr'), ('gr', 'Goodreads'), ('sp', 'Spotify')], max_length=32)),
+                ('name', models.CharField(max_length=64)),
+                ('remote_id', models.CharField(blank=True, default='', max_length=64)),
+                ('date', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'unique_together': {('source', 'name')},
+            },
+        ),
+    ]
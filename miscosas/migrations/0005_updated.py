@@ -0,0 +1,23 @@
+# Generated by Django 3.1.14 on 2026-10-18 08:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('miscosas', '0004_keyresolution'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='feed',
+            name='updated',
+            field=models.DateTimeField(auto_now=True, db_index=True, verbose_name='updated'),
+        ),
+        migrations.AddField(
+            model_name='item',
+            name='updated',
+            field=models.DateTimeField(auto_now=True, db_index=True, verbose_name='updated'),
+        ),
+    ]
@@ -0,0 +1,77 @@
+# Generated by Django 3.1.14 on 2026-10-18 09:11
+
+from django.db import migrations, models
+from django.db.models import Count, Min, OuterRef, Subquery, Sum, F
+from django.db.models.functions import Coalesce
+
+
+def merge_duplicate_items(apps, schema_editor):
+    """Keeps the first item of each (feed, key) and moves the
+    comments and votes of the repeated ones to it."""
+    Feed = apps.get_model('miscosas', 'Feed')
+    Item = apps.get_model('miscosas', 'Item')
+    Vote = apps.get_model('miscosas', 'Vote')
+    Comment = apps.get_model('miscosas', 'Comment')
+    Profile = apps.get_model('miscosas', 'Profile')
+
+    feeds = set()
+    users = set()
+    repeated = (Item.objects.order_by().values('feed', 'key')
+        .annotate(first=Min('pk'), total=Count('pk')).filter(total__gt=1))
+    for group in repeated:
+        kept = group['first']
+        others = list(Item.objects.filter(feed=group['feed'], key=group['key'])
+            .exclude(pk=kept).values_list('pk', flat=True))
+        Comment.objects.filter(item__in=others).update(item=kept)
+        for other in others:
+            # A user keeps the vote to the first item if they voted both
+            voters = Vote.objects.filter(item=kept).values('user')
+            Vote.objects.filter(item=other).exclude(user__in=voters).update(item=kept)
+        # The votes that were not moved go away with the repeated items
+        users.update(Vote.objects.filter(item__in=others).values_list('user', flat=True))
+        feeds.add(group['feed'])
+        Item.objects.filter(pk__in=others).delete()
+        Item.objects.filter(pk=kept).update(
+            upvote_count=Vote.objects.filter(item=kept, positive=True).count(),
+            downvote_count=Vote.objects.filter(item=kept, positive=False).count())
+
+    # The other counters are filled again like in 0002_counters
+    item_score = (Item.objects.filter(feed=OuterRef('pk'))
+        .order_by().values('feed')
+        .annotate(total=Sum(F('upvote_count') - F('downvote_count')))
+        .values('total'))
+    user_votes = (Vote.objects.filter(user=OuterRef('user'))
+        .order_by().values('user').annotate(total=Count('pk')).values('total'))
+    Feed.objects.filter(pk__in=feeds).update(score=Coalesce(Subquery(item_score), 0))
+    Profile.objects.filter(user__in=users).update(vote_count=Coalesce(Subquery(user_votes), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('miscosas', '0005_updated'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['item', 'date'], name='comment_item_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='feed',
+            index=models.Index(fields=['source', 'key'], name='feed_source_key_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(fields=['upvote_count'], name='item_upvotes_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='vote',
+            index=models.Index(fields=['user', 'date'], name='vote_user_date_idx'),
+        ),
+        migrations.RunPython(merge_duplicate_items, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='item',
+            constraint=models.UniqueConstraint(fields=('feed', 'key'), name='item_feed_key_unique'),
+        ),
+    ]
@@ -0,0 +1,90 @@
+# Generated by Django 3.1.14 on 2026-10-18 09:18
+
+import hashlib
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.db import migrations, models
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+# The thumbnails as miscosas.thumbnails made them when this migration was
+# written, copied here so that later changes to it do not change the migration
+THUMBNAIL_SIZES = (40, 128, 512)
+THUMBNAIL_FORMATS = {
+    'jpeg': {'extension': 'jpg', 'quality': 85, 'optimize': True, 'progressive': True},
+    'webp': {'extension': 'webp', 'quality': 80, 'method': 4},
+}
+THUMBNAIL_DIR = 'thumbnails'
+
+
+def make_thumbnails(file, storage):
+    """Stores the thumbnails of a picture file and returns its hash
+    and a map of sizes to the names of each format."""
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: file.read(64 * 1024), b''):
+        digest.update(chunk)
+    file.seek(0)
+    content_hash = digest.hexdigest()[:32]
+    names = {str(size): {image_format: f'{THUMBNAIL_DIR}/{content_hash}-{size}.{options["extension"]}'
+                         for image_format, options in THUMBNAIL_FORMATS.items()}
+             for size in THUMBNAIL_SIZES}
+
+    with Image.open(file) as image:
+        image = ImageOps.exif_transpose(image)
+        if image.mode in ('RGBA', 'LA', 'P'):
+            image = image.convert('RGBA')
+            background = Image.new('RGBA', image.size, 'white')
+            image = Image.alpha_composite(background, image)
+        image = image.convert('RGB')
+
+        for size in THUMBNAIL_SIZES:
+            thumbnail = ImageOps.fit(image, (size, size), Image.LANCZOS)
+            for image_format, options in THUMBNAIL_FORMATS.items():
+                name = names[str(size)][image_format]
+                if storage.exists(name):
+                    continue
+                options = {key: value for key, value in options.items() if key != 'extension'}
+                output = BytesIO()
+                thumbnail.save(output, image_format, **options)
+                storage.save(name, ContentFile(output.getvalue()))
+    return content_hash, names
+
+
+def thumbnail_pictures(apps, schema_editor):
+    """Makes the thumbnails of the stored pictures and forgets
+    the pictures whose file is gone or is not a picture."""
+    Profile = apps.get_model('miscosas', 'Profile')
+    for profile in Profile.objects.exclude(_picture__isnull=True).exclude(_picture=''):
+        storage = profile._picture.storage
+        if not storage.exists(profile._picture.name):
+            Profile.objects.filter(pk=profile.pk).update(_picture=None)
+            continue
+        try:
+            with storage.open(profile._picture.name) as file:
+                picture_hash, thumbnails = make_thumbnails(file, storage)
+        except (UnidentifiedImageError, OSError):
+            Profile.objects.filter(pk=profile.pk).update(_picture=None)
+            continue
+        Profile.objects.filter(pk=profile.pk).update(
+            picture_hash=picture_hash, thumbnails=thumbnails)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('miscosas', '0006_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='picture_hash',
+            field=models.CharField(blank=True, default='', editable=False, max_length=32),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='thumbnails',
+            field=models.JSONField(default=dict, editable=False),
+        ),
+        migrations.RunPython(thumbnail_pictures, migrations.RunPython.noop),
+    ]
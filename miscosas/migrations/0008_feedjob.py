@@ -0,0 +1,38 @@
+# Generated by Django 3.1.14 on 2026-10-18 09:26
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('miscosas', '0007_thumbnails'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FeedJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(choices=[('yt', 'YouTube'), ('lfm', 'last.fm'), ('rd', 'Reddit'), ('fl', 'Flickr'), ('gr', 'Goodreads'), ('sp', 'Spotify')], max_length=32)),
+                ('key', models.CharField(max_length=64)),
+                ('state', models.CharField(choices=[('pending', 'pending'), ('running', 'running'), ('done', 'done'), ('failed', 'failed')], default='pending', max_length=8)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('run_after', models.DateTimeField(default=django.utils.timezone.now)),
+                ('lease_until', models.DateTimeField(blank=True, null=True)),
+                ('worker', models.CharField(blank=True, default='', max_length=64)),
+                ('error', models.TextField(blank=True, default='')),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('feed', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='miscosas.feed')),
+                ('users', models.ManyToManyField(blank=True, related_name='feed_jobs', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='feedjob',
+            index=models.Index(fields=['state', 'run_after'], name='feedjob_state_due_idx'),
+        ),
+    ]
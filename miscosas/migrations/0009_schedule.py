@@ -0,0 +1,38 @@
+# Generated by Django 3.1.14 on 2026-10-18 09:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('miscosas', '0008_feedjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='feed',
+            name='change_rate',
+            field=models.FloatField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='feed',
+            name='last_new_items',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='feed',
+            name='last_refresh',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='feed',
+            name='next_refresh',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='feed',
+            name='quiet_refreshes',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 3.1.14 on 2026-10-18 10:26
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def populate_item_count(apps, schema_editor):
+    """Fills the new counter from the existing items."""
+    Feed = apps.get_model('miscosas', 'Feed')
+    Item = apps.get_model('miscosas', 'Item')
+
+    items = (Item.objects.filter(feed=OuterRef('pk'))
+        .order_by().values('feed').annotate(total=Count('pk')).values('total'))
+    Feed.objects.update(item_count=Coalesce(Subquery(items), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('miscosas', '0009_schedule'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='feed',
+            name='item_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='items'),
+        ),
+        migrations.RunPython(populate_item_count, migrations.RunPython.noop),
+    ]
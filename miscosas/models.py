@@ -4,15 +4,21 @@ Models for app MisCosas
 
 import os
 
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Count, F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
 from django.contrib.auth.models import User
 from django.db.models.signals import post_save
 from django.dispatch import receiver
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 from django.utils.html import format_html, format_html_join
 
 from .apps import MisCosasConfig as Config
-from .feeds.feedhandler import FEEDS_DATA
+from .feeds.feedhandler import FEEDS_DATA, Validators
+from .fragments import bump, item_key, activity_key, feed_key, user_key, ALL
+from .pagecache import item_pages, feed_pages, item_tag
+from .thumbnails import make_thumbnails, nearest_thumbnail, delete_thumbnails
 
 def get_feed_help_texts():
     """Help texts for the feed model."""
@@ -28,7 +34,32 @@ def get_feed_help_texts():
     return format_html('<ul>{}</ul>', help_items)
 
 
-class Feed(models.Model):
+class CountersMixin:
+    """Mixin for models with counters that are updated in the database,
+    saving an existing instance does not write its copy of them,
+    which might be out of date.
+
+    The same goes for the SCHEDULE_FIELDS, which only the
+    refresh scheduler writes."""
+
+    COUNTER_FIELDS = ()
+    SCHEDULE_FIELDS = ()
+
+    def save(self, *args, **kwargs):
+        if (not self._state.adding and not args and
+                kwargs.get('update_fields') is None and not kwargs.get('force_insert')):
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.COUNTER_FIELDS
+                and field.name not in self.SCHEDULE_FIELDS]
+        super().save(*args, **kwargs)
+
+
+class Feed(CountersMixin, models.Model):
+    COUNTER_FIELDS = ('score', 'item_count')
+    SCHEDULE_FIELDS = ('next_refresh', 'last_refresh', 'last_new_items',
+                       'change_rate', 'quiet_refreshes')
+
     key = models.CharField(max_length=64,
         verbose_name=_('key'),
         help_text=get_feed_help_texts())
@@ -43,9 +74,34 @@ class Feed(models.Model):
     # Whether the feed is chosen to be shown on the main page or not
     chosen = models.BooleanField(default=True, verbose_name=_('chosen'))
 
+    # The sum of all the votes made on this feed's items
+    score = models.IntegerField(default=0, editable=False, verbose_name=_('score'))
+    item_count = models.PositiveIntegerField(default=0, editable=False, verbose_name=_('items'))
+
+    # Identify the last version of the feed document that was stored
+    etag = models.CharField(max_length=256, blank=True, default='', editable=False)
+    last_modified = models.CharField(max_length=64, blank=True, default='', editable=False)
+    content_hash = models.CharField(max_length=64, blank=True, default='', editable=False)
+
+    # Last time the feed or its score changed
+    updated = models.DateTimeField(auto_now=True, db_index=True, verbose_name=_('updated'))
+
+    # Refresh schedule, from how often the feed gets new items
+    next_refresh = models.DateTimeField(null=True, blank=True, editable=False)
+    last_refresh = models.DateTimeField(null=True, blank=True, editable=False)
+    last_new_items = models.DateTimeField(null=True, blank=True, editable=False)
+    # New items per hour, averaged over the last refreshes
+    change_rate = models.FloatField(default=0, editable=False)
+    # Refreshes in a row without new items or that failed
+    quiet_refreshes = models.PositiveIntegerField(default=0, editable=False)
+
     class Meta:
         verbose_name = _('feed')
         verbose_name_plural = _('feeds')
+        indexes = [
+            # Finds the stored feed of a source when it is loaded
+            models.Index(fields=['source', 'key'], name='feed_source_key_idx'),
+        ]
 
     def __str__(self):
         return Config.SOURCES[self.source] + ': ' + self.title
@@ -55,20 +111,22 @@ class Feed(models.Model):
         """Full string name of the source."""
         return Config.SOURCES[self.source]
 
-    @property
-    def score(self):
-        """The sum of all the votes made on this feed's items."""
-        upvotes = Vote.objects.filter(item__feed=self, positive=True).count()
-        downvotes = Vote.objects.filter(item__feed=self, positive=False).count()
-        return upvotes - downvotes
-
     @property
     def link(self):
         """Link to the external page for this feed."""
         return FEEDS_DATA[self.source].get_feed_url(self.key)
 
+    @property
+    def validators(self):
+        """Validators of the last stored document, None if there are none."""
+        if not (self.etag or self.last_modified or self.content_hash):
+            return None
+        return Validators(self.etag, self.last_modified, self.content_hash)
+
+
+class Item(CountersMixin, models.Model):
+    COUNTER_FIELDS = ('upvote_count', 'downvote_count')
 
-class Item(models.Model):
     key = models.CharField(max_length=64, verbose_name=_('key'))
     title = models.CharField(max_length=64, verbose_name=_('title'))
     # The feed the item came from
@@ -78,34 +136,39 @@ class Item(models.Model):
     description = models.TextField(blank=True, default='', verbose_name=_('description'))
     picture = models.URLField(blank=True, default='', verbose_name=_('picture'))
 
+    # Number of votes to this item, kept up to date when votes change
+    upvote_count = models.PositiveIntegerField(default=0, editable=False,
+        verbose_name=_('upvotes'))
+    downvote_count = models.PositiveIntegerField(default=0, editable=False,
+        verbose_name=_('downvotes'))
+
+    # Last time the item or its votes changed
+    updated = models.DateTimeField(auto_now=True, db_index=True, verbose_name=_('updated'))
+
     class Meta:
         verbose_name = _('item')
         verbose_name_plural = _('items')
+        constraints = [
+            # Keys are only unique within the feed they come from
+            models.UniqueConstraint(fields=['feed', 'key'], name='item_feed_key_unique'),
+        ]
+        indexes = [
+            # The popular items of the main page
+            models.Index(fields=['upvote_count'], name='item_upvotes_idx'),
+        ]
 
     def __str__(self):
         return str(self.feed) + ", " + self.title
 
-    @property
-    def upvote_count(self):
-        """Number of upvotes to this item."""
-        return self.votes.filter(positive=True).count()
-
-    @property
-    def downvote_count(self):
-        """Number of downvotes to this item."""
-        return self.votes.filter(positive=False).count()
-
     @property
     def upvoters(self):
         """List of ids of users that have upvoted this item."""
-        ups = self.votes.filter(positive=True)
-        return [vote.user.pk for vote in ups]
+        return list(self.votes.filter(positive=True).values_list('user_id', flat=True))
 
     @property
     def downvoters(self):
         """List of ids of users that have downvoted this item."""
-        downs = self.votes.filter(positive=False)
-        return [vote.user.pk for vote in downs]
+        return list(self.votes.filter(positive=False).values_list('user_id', flat=True))
 
     @property
     def link(self):
@@ -113,6 +176,66 @@ class Item(models.Model):
         return FEEDS_DATA[self.feed.source].get_item_url(self.feed.key, self.key)
 
 
+class KeyResolution(models.Model):
+    """Id that a source uses for the name of a feed."""
+    source = models.CharField(max_length=32, choices=list(Config.SOURCES.items()))
+    # The name normalized to lower case and single spaces
+    name = models.CharField(max_length=64)
+    # Empty if the source has nothing with that name
+    remote_id = models.CharField(max_length=64, blank=True, default='')
+    date = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('source', 'name',)
+
+    def __str__(self):
+        return Config.SOURCES[self.source] + ': ' + self.name
+
+
+class FeedJob(models.Model):
+    """Request to load a feed, run by the feed workers."""
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATES = [
+        (PENDING, _('pending')),
+        (RUNNING, _('running')),
+        (DONE, _('done')),
+        (FAILED, _('failed')),
+    ]
+
+    source = models.CharField(max_length=32, choices=list(Config.SOURCES.items()))
+    key = models.CharField(max_length=64)
+    # Users that asked for the feed, it is chosen for them once it is loaded
+    users = models.ManyToManyField(User, blank=True, related_name='feed_jobs')
+
+    state = models.CharField(max_length=8, choices=STATES, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    # A pending job is not run before this time
+    run_after = models.DateTimeField(default=timezone.now)
+    # A running job whose lease ended is claimed again, its worker is gone
+    lease_until = models.DateTimeField(null=True, blank=True)
+    worker = models.CharField(max_length=64, blank=True, default='')
+
+    feed = models.ForeignKey(Feed, models.SET_NULL, null=True, blank=True, related_name='+')
+    error = models.TextField(blank=True, default='')
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # The jobs that are due
+            models.Index(fields=['state', 'run_after'], name='feedjob_state_due_idx'),
+        ]
+
+    def __str__(self):
+        return Config.SOURCES[self.source] + ': ' + self.key
+
+    @property
+    def finished(self):
+        return self.state in (self.DONE, self.FAILED)
+
+
 class Vote(models.Model):
     # Whether it was a positive or a negative vote
     positive = models.BooleanField(verbose_name=_('positive'))
@@ -126,6 +249,10 @@ class Vote(models.Model):
         unique_together = ('user', 'item',)
         verbose_name = _('vote')
         verbose_name_plural = _('votes')
+        indexes = [
+            # The latest votes of a user
+            models.Index(fields=['user', 'date'], name='vote_user_date_idx'),
+        ]
 
 
 class Comment(models.Model):
@@ -143,10 +270,24 @@ class Comment(models.Model):
     class Meta:
         verbose_name = _('comment')
         verbose_name_plural = _('comments')
+        indexes = [
+            # The comments of an item from the latest
+            models.Index(fields=['item', 'date'], name='comment_item_date_idx'),
+        ]
+
+
+class Deletion(models.Model):
+    """Row removed from one of the exported tables, so that
+    the exports of the changes can tell to remove it too."""
+    # Name of the table in the exports, the name of the model
+    table = models.CharField(max_length=16)
+    object_id = models.PositiveIntegerField()
+    date = models.DateTimeField(auto_now_add=True, db_index=True)
 
 
-class Profile(models.Model):
+class Profile(CountersMixin, models.Model):
     DEFAULT_PICTURE = 'blank-profile-picture.png'
+    COUNTER_FIELDS = ('vote_count', 'comment_count')
 
     user = models.OneToOneField(User, models.CASCADE, verbose_name=_('user'))
     _picture = models.ImageField(blank=True, null=True, verbose_name=_('picture'))
@@ -156,6 +297,16 @@ class Profile(models.Model):
         default=Config.MEDIUM_FONT, verbose_name=_('font size'))
     chosen_feeds = models.ManyToManyField(Feed, related_name='users')
 
+    # Activity of the user, kept up to date when votes and comments change
+    vote_count = models.PositiveIntegerField(default=0, editable=False,
+        verbose_name=_('votes'))
+    comment_count = models.PositiveIntegerField(default=0, editable=False,
+        verbose_name=_('comments'))
+
+    # Thumbnails of the picture by size and format, made when it is uploaded
+    picture_hash = models.CharField(max_length=32, blank=True, default='', editable=False)
+    thumbnails = models.JSONField(default=dict, editable=False)
+
     class Meta:
         verbose_name = _('profile')
         verbose_name_plural = _('profiles')
@@ -166,23 +317,12 @@ class Profile(models.Model):
     @property
     def picture(self):
         """Current picture for the user."""
-        try:
-            if os.path.isfile(self._picture.path):
-                return self._picture.name
-            Profile.objects.filter(pk=self.pk).update(_picture=None)
-            return self.DEFAULT_PICTURE
-        except ValueError:
-            return self.DEFAULT_PICTURE
+        return self._picture.name or self.DEFAULT_PICTURE
 
-    @property
-    def vote_count(self):
-        """Amount of votes the user has made."""
-        return self.user.votes.count()
-
-    @property
-    def comment_count(self):
-        """Amount of comments the user made."""
-        return self.user.comments.count()
+    def thumbnail(self, width, image_format='jpeg'):
+        """Smallest thumbnail of the picture that fills width pixels,
+        the picture itself if it has no thumbnails."""
+        return nearest_thumbnail(self.thumbnails, width, image_format) or self.picture
 
 
 @receiver(post_save, sender=User)
@@ -196,6 +336,121 @@ def save_user_profile(sender, instance, **kwargs):
     """Saves the profile data when the user is saved."""
     instance.profile.save()
 
+def update_vote_counters(vote: Vote, positive: bool, delta: int):
+    """Adds delta votes to the counters affected by a vote."""
+    counter = 'upvote_count' if positive else 'downvote_count'
+    now = timezone.now()
+    feed_id = Item.objects.filter(pk=vote.item_id).values_list('feed_id', flat=True).first()
+    Item.objects.filter(pk=vote.item_id).update(**{counter: F(counter) + delta, 'updated': now})
+    Feed.objects.filter(pk=feed_id).update(
+        score=F('score') + (delta if positive else -delta), updated=now)
+    Profile.objects.filter(user=vote.user_id).update(vote_count=F('vote_count') + delta)
+    bump(activity_key(vote.item_id), feed_key(feed_id), user_key(vote.user_id),
+         *item_pages(vote.item_id, feed_id))
+
+@receiver(models.signals.pre_save, sender=Vote)
+def remember_vote_state(sender, instance, **kwargs):
+    """Keeps the stored state of a vote that is going to be changed."""
+    instance._stored_positive = None
+    if instance.pk:
+        instance._stored_positive = (Vote.objects.filter(pk=instance.pk)
+            .values_list('positive', flat=True).first())
+
+@receiver(post_save, sender=Vote)
+def count_saved_vote(sender, instance, created, **kwargs):
+    """Updates the counters when a vote is made or flipped."""
+    stored = getattr(instance, '_stored_positive', None)
+    if created or stored is None:
+        update_vote_counters(instance, instance.positive, 1)
+    elif stored != instance.positive:
+        update_vote_counters(instance, stored, -1)
+        update_vote_counters(instance, instance.positive, 1)
+
+@receiver(models.signals.post_delete, sender=Vote)
+def count_deleted_vote(sender, instance, **kwargs):
+    """Updates the counters when a vote is removed."""
+    update_vote_counters(instance, instance.positive, -1)
+
+@receiver(post_save, sender=Comment)
+def count_saved_comment(sender, instance, created, **kwargs):
+    """Updates the counter of the author of a new comment."""
+    if created:
+        Profile.objects.filter(user=instance.user_id).update(
+            comment_count=F('comment_count') + 1)
+    bump(activity_key(instance.item_id), user_key(instance.user_id), item_tag(instance.item_id))
+
+@receiver(models.signals.post_delete, sender=Comment)
+def count_deleted_comment(sender, instance, **kwargs):
+    """Updates the counter of the author of a removed comment."""
+    Profile.objects.filter(user=instance.user_id).update(
+        comment_count=F('comment_count') - 1)
+    bump(activity_key(instance.item_id), user_key(instance.user_id), item_tag(instance.item_id))
+
+def rebuild_counters():
+    """Recalculates all the vote and comment counters
+    from the votes and comments in the database."""
+    def count(queryset, field, outer='pk'):
+        """Number of rows in queryset whose field matches the outer row."""
+        subquery = (queryset.filter(**{field: OuterRef(outer)})
+            .order_by().values(field).annotate(total=Count('pk')).values('total'))
+        return Coalesce(Subquery(subquery), 0)
+
+    item_score = (Item.objects.filter(feed=OuterRef('pk'))
+        .order_by().values('feed')
+        .annotate(total=Sum(F('upvote_count') - F('downvote_count')))
+        .values('total'))
+
+    with transaction.atomic():
+        Item.objects.update(
+            upvote_count=count(Vote.objects.filter(positive=True), 'item'),
+            downvote_count=count(Vote.objects.filter(positive=False), 'item'))
+        Feed.objects.update(
+            score=Coalesce(Subquery(item_score), 0),
+            item_count=count(Item.objects.all(), 'feed'))
+        Profile.objects.update(
+            vote_count=count(Vote.objects.all(), 'user', 'user'),
+            comment_count=count(Comment.objects.all(), 'user', 'user'))
+        bump(ALL)
+
+@receiver(post_save, sender=Feed)
+@receiver(models.signals.post_delete, sender=Feed)
+def change_feed_fragments(sender, instance, **kwargs):
+    """Renders again the fragments and pages that show a changed feed."""
+    bump(feed_key(instance.pk), *feed_pages(instance.pk))
+
+@receiver(post_save, sender=Item)
+def change_item_fragments(sender, instance, created, **kwargs):
+    """Renders again the fragments and pages that show a changed
+    item, and the fragments of its feed if the item is new."""
+    pages = item_pages(instance.pk, instance.feed_id)
+    if created:
+        Feed.objects.filter(pk=instance.feed_id).update(item_count=F('item_count') + 1)
+        bump(item_key(instance.pk), feed_key(instance.feed_id), *pages)
+    else:
+        bump(item_key(instance.pk), *pages)
+
+@receiver(models.signals.post_delete, sender=Item)
+def remove_item_fragments(sender, instance, **kwargs):
+    """Renders again the fragments and pages that show
+    a removed item and its feed."""
+    Feed.objects.filter(pk=instance.feed_id).update(item_count=F('item_count') - 1)
+    bump(item_key(instance.pk), feed_key(instance.feed_id),
+         *item_pages(instance.pk, instance.feed_id))
+
+@receiver(models.signals.post_delete, sender=Feed)
+@receiver(models.signals.post_delete, sender=Item)
+@receiver(models.signals.post_delete, sender=Vote)
+@receiver(models.signals.post_delete, sender=Comment)
+def record_deletion(sender, instance, **kwargs):
+    """Keeps a tombstone of a removed row for the exports."""
+    Deletion.objects.create(table=sender._meta.model_name, object_id=instance.pk)
+
+@receiver(post_save, sender=User)
+@receiver(post_save, sender=Profile)
+def change_user_fragments(sender, instance, **kwargs):
+    """Renders again the fragments that show a changed user or profile."""
+    bump(user_key(instance.pk if sender is User else instance.user_id))
+
 @receiver(models.signals.post_delete, sender=Profile)
 def auto_delete_file_on_delete(sender, instance, **kwargs):
     """Deletes file from filesystem
@@ -203,6 +458,15 @@ def auto_delete_file_on_delete(sender, instance, **kwargs):
     if instance.picture and instance.picture != Profile.DEFAULT_PICTURE:
         if os.path.isfile(instance._picture.path):
             os.remove(instance._picture.path)
+    delete_unused_thumbnails(instance)
+
+@receiver(models.signals.pre_save, sender=Profile)
+def make_profile_thumbnails(sender, instance, **kwargs):
+    """Makes the thumbnails of a newly uploaded picture."""
+    if not instance._picture:
+        instance.picture_hash, instance.thumbnails = '', {}
+    elif not instance._picture._committed:
+        instance.picture_hash, instance.thumbnails = make_thumbnails(instance._picture.file)
 
 @receiver(models.signals.pre_save, sender=Profile)
 def auto_delete_file_on_change(sender, instance, **kwargs):
@@ -215,5 +479,14 @@ def auto_delete_file_on_change(sender, instance, **kwargs):
         if old_profile.picture != new_file and old_profile.picture != Profile.DEFAULT_PICTURE:
             if os.path.isfile(old_profile._picture.path):
                 os.remove(old_profile._picture.path)
+        if old_profile.picture_hash != instance.picture_hash:
+            delete_unused_thumbnails(old_profile)
     except Profile.DoesNotExist:
         return False
+
+def delete_unused_thumbnails(profile):
+    """Deletes the thumbnails of the picture of a profile
+    unless another profile has a picture with the same content."""
+    if profile.picture_hash and not (Profile.objects
+            .filter(picture_hash=profile.picture_hash).exclude(pk=profile.pk).exists()):
+        delete_thumbnails(profile.thumbnails)
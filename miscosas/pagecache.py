@@ -0,0 +1,169 @@
+"""
+Cache of the pages requested by anonymous users
+"""
+
+import hashlib
+import re
+import threading
+from collections import Counter
+from functools import wraps
+from time import monotonic
+
+from django.core.cache import cache
+from django.http import HttpResponse, StreamingHttpResponse
+from django.middleware.csrf import get_token
+from django.utils.translation import get_language
+
+from .fragments import versions, ALL
+
+# Seconds a page is kept, it is also removed when its data changes
+PAGE_TIMEOUT = 10 * 60
+
+PAGE_PREFIX = 'page:'
+HITS_KEY = 'pagecache:hits'
+MISSES_KEY = 'pagecache:misses'
+# Hits and misses are counted by each process and added to
+# the shared counters at most once every STATS_INTERVAL seconds
+STATS_INTERVAL = 30
+
+INDEX = 'page:index'
+FEEDS = 'page:feeds'
+
+# The csrf tokens of the forms are replaced by the one of each user
+CSRF_INPUT = re.compile(rb'(name="csrfmiddlewaretoken" value=")[^"]*(")')
+CSRF_PLACEHOLDER = b'CSRF-TOKEN-PLACEHOLDER'
+
+_counts = Counter()
+_counts_lock = threading.Lock()
+_flushed = monotonic()
+
+
+def feed_tag(pk):
+    return f'page:feed:{pk}'
+
+def item_tag(pk):
+    return f'page:item:{pk}'
+
+
+def item_pages(item_id, feed_id):
+    """Returns the tags of the pages that show the votes
+    or the data of an item."""
+    return [item_tag(item_id), feed_tag(feed_id), INDEX, FEEDS]
+
+def feed_pages(feed_id):
+    """Returns the tags of the pages that show the data of a feed."""
+    return [feed_tag(feed_id), INDEX, FEEDS]
+
+
+def tag_page(request, *tags):
+    """Declares the data a page shows, the page is cached with
+    the current versions of its tags and it is used while none
+    of them changes.
+
+    Views call it before reading the data they show,
+    it can be called again to add more tags."""
+    if request.method != 'GET' or request.user.is_authenticated:
+        return
+    known_tags, known_versions = getattr(request, 'page_tags', ([ALL], versions([ALL])))
+    request.page_tags = (known_tags + list(tags), known_versions + versions(tags))
+
+
+def cache_anonymous_page(view):
+    """Caches the responses of a view to the GET requests of
+    anonymous users, for each address and language, if the view
+    tags the page."""
+    @wraps(view)
+    def cached_view(request, *args, **kwargs):
+        if request.method != 'GET' or request.user.is_authenticated:
+            return view(request, *args, **kwargs)
+
+        key = page_key(request)
+        entry = cache.get(key)
+        if entry is not None:
+            tags, stamp, content_type, content, streaming = entry
+            if versions(tags) == stamp:
+                count(HITS_KEY)
+                response = make_response(request, content_type, content, streaming)
+                response['X-Cache'] = 'HIT'
+                return response
+
+        count(MISSES_KEY)
+        response = view(request, *args, **kwargs)
+        tags = getattr(request, 'page_tags', None)
+        if tags is not None and response.status_code == 200:
+            store_response(key, tags, response)
+        response['X-Cache'] = 'MISS'
+        return response
+
+    return cached_view
+
+
+def page_key(request):
+    uri = request.build_absolute_uri()
+    return PAGE_PREFIX + hashlib.md5(f'{uri}:{get_language()}'.encode('utf-8')).hexdigest()
+
+
+def store_response(key, tags, response):
+    """Caches the content of a response, streamed
+    responses are cached once they are sent."""
+    def store(content):
+        content = CSRF_INPUT.sub(rb'\1' + CSRF_PLACEHOLDER + rb'\2', content)
+        cache.set(key, (*tags, response['Content-Type'], content, response.streaming), PAGE_TIMEOUT)
+
+    if not response.streaming:
+        store(response.content)
+        return
+
+    stream = response.streaming_content
+    def streamed():
+        chunks = []
+        for chunk in stream:
+            chunks.append(chunk)
+            yield chunk
+        store(b''.join(chunks))
+    response.streaming_content = streamed()
+
+
+def make_response(request, content_type, content, streaming):
+    if CSRF_PLACEHOLDER in content:
+        content = content.replace(CSRF_PLACEHOLDER, get_token(request).encode('ascii'))
+    if streaming:
+        return StreamingHttpResponse([content], content_type=content_type)
+    return HttpResponse(content, content_type=content_type)
+
+
+def count(key):
+    with _counts_lock:
+        _counts[key] += 1
+    if monotonic() - _flushed >= STATS_INTERVAL:
+        flush_page_cache_stats()
+
+
+def flush_page_cache_stats():
+    """Adds the hits and misses counted by this process to the shared counters."""
+    global _flushed
+    with _counts_lock:
+        counts = dict(_counts)
+        _counts.clear()
+        _flushed = monotonic()
+    for key, amount in counts.items():
+        if cache.add(key, amount, None):
+            continue
+        try:
+            cache.incr(key, amount)
+        except ValueError:
+            cache.set(key, amount, None)
+
+
+def page_cache_stats():
+    """Returns the hits and misses of the cache since it was reset,
+    the ones of other processes might not be counted yet."""
+    flush_page_cache_stats()
+    stats = cache.get_many([HITS_KEY, MISSES_KEY])
+    return stats.get(HITS_KEY, 0), stats.get(MISSES_KEY, 0)
+
+
+def reset_page_cache_stats():
+    with _counts_lock:
+        _counts.clear()
+    cache.delete_many([HITS_KEY, MISSES_KEY])
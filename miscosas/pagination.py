@@ -0,0 +1,148 @@
+"""
+Pagination of the listings of app MisCosas
+"""
+
+import hashlib
+from collections import namedtuple
+
+from django.core.cache import cache
+from django.db.models import Q
+from django.db.models.query import QuerySet
+
+ENTRIES_PER_PAGE = 10
+
+# Seconds the edges of the pages of a listing are remembered,
+# they are read in a single pass over the index of the ordering
+EDGES_TIMEOUT = 60
+
+# Entries of a page, the cursors are the pks of the entries at
+# its edges or None if there are no pages after or before it
+Page = namedtuple('Page', ['entries', 'number', 'next_cursor', 'previous_cursor'])
+
+
+class KeysetPaginator:
+    """Divides a query set in pages.
+
+    Pages are found by seeking the entries that come after (or before)
+    the entry at the edge of the previous (or next) page, which uses
+    the indexes of the ordering instead of reading and skipping all
+    the entries of the previous pages."""
+
+    def __init__(self, qset: QuerySet, ordering=('pk',), per_page=ENTRIES_PER_PAGE):
+        """
+        Parameters
+        ----------------
+        qset : QuerySet
+            The entries to divide
+        ordering : tuple
+            Fields that sort the entries, like in order_by,
+            the last one must be 'pk' or '-pk'
+        per_page : int
+            Amount of entries in a page
+        """
+        self.qset = qset
+        self.ordering = ordering
+        self.fields = [field.lstrip('-') for field in ordering]
+        self.per_page = per_page
+
+    def page(self, number=1, after=None, before=None):
+        """Returns the Page with the given number,
+        or None if there are not that many pages.
+
+        If the pk of the last entry of the previous page (after) or the
+        first entry of the next page (before) is known the page is
+        found from it, otherwise from the edges of the pages."""
+        if after is not None:
+            values = self._values(after)
+            if values is not None:
+                return self._page_after(number, values)
+        if before is not None:
+            values = self._values(before)
+            if values is not None:
+                page = self._page_before(number, values)
+                # Going back from a page that is not at the edge of the
+                # numbered ones ends in a short page, the first one is full
+                if page.previous_cursor is not None or len(page.entries) == self.per_page:
+                    return page
+                number = 1
+
+        if number <= 1:
+            entries = list(self.qset.order_by(*self.ordering)[:self.per_page + 1])
+            return self._make_page(1, entries, None)
+
+        _, edges = self.edges()
+        if number - 2 >= len(edges):
+            return None
+        return self._page_after(number, edges[number - 2])
+
+    def edges(self):
+        """Returns the total amount of entries and the values of the
+        ordering fields of the last entry of each full page.
+
+        They are cached for a while so that the pages can be
+        found by number without skipping the entries before them."""
+        query = f'{self.qset.query}:{self.ordering}:{self.per_page}'
+        key = 'pagination:edges:' + hashlib.md5(query.encode('utf-8')).hexdigest()
+        found = cache.get(key)
+        if found is None:
+            total = 0
+            edges = []
+            # Only the ordering fields are read, which can be done from an index
+            for total, values in enumerate(self.qset.order_by(*self.ordering)
+                    .values_list(*self.fields).iterator(), 1):
+                if total % self.per_page == 0:
+                    edges.append(values)
+            found = (total, edges)
+            cache.set(key, found, EDGES_TIMEOUT)
+        return found
+
+    def count(self):
+        """Returns the total amount of entries, which might be out of date."""
+        return self.edges()[0]
+
+    def page_range(self, page: Page):
+        """Returns the numbers of the pages to link to."""
+        npages = -(-self.count() // self.per_page)
+        # The cached total might be out of date
+        if page.next_cursor is not None:
+            npages = max(npages, page.number + 1)
+        return range(1, max(npages, page.number, 1) + 1)
+
+    def _values(self, pk):
+        """Returns the values of the ordering fields of an entry."""
+        return self.qset.filter(pk=pk).values_list(*self.fields).first()
+
+    def _page_after(self, number, values):
+        entries = list(self.qset
+            .filter(self._seek(values, forward=True))
+            .order_by(*self.ordering)[:self.per_page + 1])
+        return self._make_page(number, entries, entries[0].pk if number > 1 and entries else None)
+
+    def _page_before(self, number, values):
+        reverse = [field[1:] if field.startswith('-') else '-' + field for field in self.ordering]
+        entries = list(self.qset
+            .filter(self._seek(values, forward=False))
+            .order_by(*reverse)[:self.per_page + 1])
+        has_previous = len(entries) > self.per_page
+        entries = entries[:self.per_page][::-1]
+        return Page(
+            entries,
+            max(number, 2) if has_previous else 1,
+            entries[-1].pk if entries else None,
+            entries[0].pk if has_previous else None)
+
+    def _make_page(self, number, entries, previous_cursor):
+        next_cursor = entries[self.per_page - 1].pk if len(entries) > self.per_page else None
+        return Page(entries[:self.per_page], number, next_cursor, previous_cursor)
+
+    def _seek(self, values, forward):
+        """Returns the condition for the entries that come after
+        (or before) an entry with the values of the ordering fields."""
+        condition = Q()
+        equal = {}
+        for field, value in zip(self.ordering, values):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') == forward else 'gt'
+            condition |= Q(**equal, **{f'{name}__{lookup}': value})
+            equal[name] = value
+        return condition
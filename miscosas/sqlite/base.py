@@ -0,0 +1,81 @@
+"""
+SQLite database backend that sets up each connection for
+readers and writers working at the same time, and retries
+the statements out of transactions that find the database locked
+"""
+
+import sqlite3
+import time
+
+from django.db.backends.sqlite3 import base
+
+# Applied to every new connection, OPTIONS['pragmas'] changes them.
+# With write-ahead logging readers do not wait for writers, and
+# writers wait up to busy_timeout milliseconds for each other.
+DEFAULT_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,
+    'cache_size': -64 * 1024,
+    'mmap_size': 256 * 1024 * 1024,
+    'temp_store': 'MEMORY',
+}
+
+# Times a statement is run again when the database is still locked
+# after busy_timeout, OPTIONS['lock_retries'] changes it
+LOCK_RETRIES = 3
+# Seconds to wait before the first retry, it doubles with each one
+RETRY_DELAY = 0.05
+
+
+def is_locked(error):
+    message = str(error)
+    return 'database is locked' in message or 'database table is locked' in message
+
+
+class SQLiteCursorWrapper(base.SQLiteCursorWrapper):
+
+    lock_retries = LOCK_RETRIES
+
+    def execute(self, query, params=None):
+        return self._retry(super().execute, query, params)
+
+    def executemany(self, query, param_list):
+        return self._retry(super().executemany, query, list(param_list))
+
+    def _retry(self, method, *args):
+        # Inside a transaction that already ran statements, like the ones
+        # of atomic blocks, the lock can be held by a writer waiting for
+        # this one to end, so the transaction has to be rolled back instead
+        if self.connection.in_transaction:
+            return method(*args)
+        delay = RETRY_DELAY
+        for _ in range(self.lock_retries):
+            try:
+                return method(*args)
+            except sqlite3.OperationalError as error:
+                if not is_locked(error):
+                    raise
+            time.sleep(delay)
+            delay *= 2
+        return method(*args)
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+
+    def get_connection_params(self):
+        params = super().get_connection_params()
+        self.pragmas = {**DEFAULT_PRAGMAS, **params.pop('pragmas', {})}
+        self.lock_retries = params.pop('lock_retries', LOCK_RETRIES)
+        return params
+
+    def get_new_connection(self, conn_params):
+        connection = super().get_new_connection(conn_params)
+        for name, value in self.pragmas.items():
+            connection.execute(f'PRAGMA {name} = {value}')
+        return connection
+
+    def create_cursor(self, name=None):
+        cursor = self.connection.cursor(factory=SQLiteCursorWrapper)
+        cursor.lock_retries = self.lock_retries
+        return cursor
@@ -0,0 +1,59 @@
+from django import template
+from django.core.cache import cache
+from django.template.defaulttags import CsrfTokenNode
+from django.utils.safestring import mark_safe
+from django.utils.translation import get_language
+
+from miscosas.fragments import fragment_key, FRAGMENT_TIMEOUT
+
+register = template.Library()
+
+# Stored in the fragments instead of the token of the user
+CSRF_PLACEHOLDER = 'CSRF-TOKEN-PLACEHOLDER'
+
+
+class CacheFragmentNode(template.Node):
+
+    def __init__(self, nodelist, name, instance, vary_on):
+        self.nodelist = nodelist
+        self.name = name
+        self.instance = instance
+        self.vary_on = vary_on
+
+    def render(self, context):
+        instance = self.instance.resolve(context)
+        vary_on = [get_language()] + [value.resolve(context) for value in self.vary_on]
+        key = fragment_key(self.name, instance, vary_on)
+
+        with context.push(csrf_token=CSRF_PLACEHOLDER):
+            placeholder_input = CsrfTokenNode().render(context)
+            content = cache.get(key)
+            if content is None:
+                content = self.nodelist.render(context)
+                cache.set(key, content, FRAGMENT_TIMEOUT)
+
+        if placeholder_input in content:
+            content = content.replace(placeholder_input, CsrfTokenNode().render(context))
+        return mark_safe(content)
+
+
+@register.tag
+def cachefragment(parser, token):
+    """Caches the content of the tag, rendered for an instance, until
+    its data changes. The content is rendered again for each language
+    and each combination of the other values given.
+
+        {% cachefragment 'item_brief' item request.path %}
+            ...
+        {% endcachefragment %}
+
+    Forms inside it get the csrf token of the current user."""
+    bits = token.split_contents()
+    if len(bits) < 3:
+        raise template.TemplateSyntaxError(
+            f"'{bits[0]}' takes at least a name and an instance")
+    nodelist = parser.parse(('endcachefragment',))
+    parser.delete_first_token()
+    name = bits[1].strip('\'"')
+    return CacheFragmentNode(nodelist, name, parser.compile_filter(bits[2]),
+                             [parser.compile_filter(bit) for bit in bits[3:]])
@@ -0,0 +1,24 @@
+from django import template
+
+from miscosas.models import Profile
+
+register = template.Library()
+
+
+@register.inclusion_tag('miscosas/element/profile_picture.html')
+def profile_picture(profile, width):
+    """Picture of a profile shown at width pixels, with the
+    thumbnails for screens of double density and in WebP."""
+    if not profile:
+        # Users made without their profile
+        return {'width': width, 'picture': Profile.DEFAULT_PICTURE,
+                'picture_2x': Profile.DEFAULT_PICTURE}
+    context = {
+        'width': width,
+        'picture': profile.thumbnail(width),
+        'picture_2x': profile.thumbnail(width * 2),
+    }
+    if profile.thumbnails:
+        context['webp'] = profile.thumbnail(width, 'webp')
+        context['webp_2x'] = profile.thumbnail(width * 2, 'webp')
+    return context
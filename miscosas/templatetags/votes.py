@@ -0,0 +1,15 @@
+from django import template
+
+register = template.Library()
+
+
+@register.filter
+def vote_of(vote_states: dict, item):
+    """Returns 'up' or 'down' for the vote of the user
+    on an item in the map of vote states, or ''."""
+    if not vote_states:
+        return ''
+    positive = vote_states.get(item.pk)
+    if positive is None:
+        return ''
+    return 'up' if positive else 'down'
@@ -0,0 +1,34 @@
+"""
+Test cases of app MisCosas, they empty the cache, so they use
+one in memory instead of the one of the site
+"""
+
+from django import test
+from django.test import override_settings
+
+TEST_CACHES = {
+    'default': {
+        'BACKEND': 'miscosas.tieredcache.TieredCache',
+        'LOCATION': 'miscosas-tests',
+        'OPTIONS': {'SHARED': 'shared'},
+    },
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'miscosas-tests',
+    },
+}
+
+
+@override_settings(CACHES=TEST_CACHES)
+class SimpleTestCase(test.SimpleTestCase):
+    pass
+
+
+@override_settings(CACHES=TEST_CACHES)
+class TransactionTestCase(test.TransactionTestCase):
+    pass
+
+
+@override_settings(CACHES=TEST_CACHES)
+class TestCase(test.TestCase):
+    pass
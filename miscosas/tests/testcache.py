@@ -0,0 +1,116 @@
+import os
+import tempfile
+import threading
+
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.test import override_settings
+
+from miscosas.tieredcache import TieredCache, JOURNAL_SEQUENCE, JOURNAL_LOCK_FILE
+from miscosas.tests.base import SimpleTestCase
+
+SHARED = {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'tiered-test'}
+
+
+@override_settings(CACHES={'default': SHARED, 'tiered-shared': SHARED})
+class TestTieredCache(SimpleTestCase):
+
+    def setUp(self):
+        ''' Makes the caches of two processes that share a cache '''
+        self.shared = caches['tiered-shared']
+        self.shared.clear()
+        self.first = self.worker('first')
+        self.second = self.worker('second')
+
+    def worker(self, name, **options):
+        options = {'SHARED': 'tiered-shared', 'SYNC_INTERVAL': 0, **options}
+        return TieredCache(f'{self.id()}-{name}', {'OPTIONS': options})
+
+    def test_shared(self):
+        ''' Tests the values written by a process are read by the other '''
+        self.first.set('key', 'value')
+        self.assertEqual(self.second.get('key'), 'value')
+        self.assertEqual(self.second.get_many(['key', 'other']), {'key': 'value'})
+        self.assertTrue(self.second.has_key('key'))
+
+    def test_local_reads(self):
+        ''' Tests the values read before come from the local cache '''
+        self.first.set('key', 'value')
+        self.second.get('key')
+        self.shared.set(self.second.make_key('key'), 'changed elsewhere')
+        self.assertEqual(self.second.get('key'), 'value')
+
+    def test_invalidation(self):
+        ''' Tests the changes of a process remove the old values in the other '''
+        self.first.set('key', 'value')
+        self.first.set('count', 1)
+        self.second.get_many(['key', 'count'])
+
+        self.first.set('key', 'new value')
+        self.first.incr('count')
+        self.assertEqual(self.second.get('key'), 'new value')
+        self.assertEqual(self.second.get('count'), 2)
+
+        self.first.delete('key')
+        self.assertIsNone(self.second.get('key'))
+        self.first.set_many({'key': 'again'})
+        self.assertEqual(self.second.get('key'), 'again')
+
+    def test_lost_journal(self):
+        ''' Tests the local cache is emptied when the changes cannot be known '''
+        self.first.set('key', 'value')
+        self.second.get('key')
+        self.shared.clear()
+        self.assertIsNone(self.second.get('key'))
+
+    def test_size(self):
+        ''' Tests the least recently used values leave the local cache '''
+        worker = self.worker('small', LOCAL_MAX_ENTRIES=2)
+        for key in ('a', 'b', 'c'):
+            worker.set(key, key)
+        worker.get('b')
+        worker.set('d', 'd')
+        self.assertEqual(list(worker._tier.entries), [worker.make_key('b'), worker.make_key('d')])
+        self.assertEqual(worker.get('a'), 'a')
+
+    def test_timeouts(self):
+        ''' Tests expired values are not read from any cache '''
+        self.first.set('key', 'value', 0)
+        self.assertIsNone(self.first.get('key'))
+        self.assertTrue(self.first.add('other', 'value'))
+        self.assertFalse(self.second.add('other', 'value'))
+
+        worker = self.worker('short', LOCAL_TIMEOUT=0)
+        worker.set('key', 'value')
+        self.shared.set(worker.make_key('key'), 'changed elsewhere')
+        self.assertEqual(worker.get('key'), 'changed elsewhere')
+
+    def test_files(self):
+        ''' Tests the journal of a shared file cache is numbered under a lock '''
+        with tempfile.TemporaryDirectory() as directory:
+            files = {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                     'LOCATION': directory}
+            with override_settings(CACHES={'default': SHARED, 'tiered-files': files}):
+                workers = [self.worker(f'files{i}', SHARED='tiered-files') for i in range(4)]
+
+                def write(worker):
+                    for i in range(20):
+                        worker.set(f'key{i}', i)
+
+                threads = [threading.Thread(target=write, args=(worker,)) for worker in workers]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+
+                self.assertEqual(caches['tiered-files'].get(JOURNAL_SEQUENCE), 80)
+                workers[0].clear()
+                self.assertTrue(os.path.exists(os.path.join(directory, JOURNAL_LOCK_FILE)))
+
+    def test_lock_needed(self):
+        ''' Tests a shared cache without atomic increments needs a lock file '''
+        database = {'BACKEND': 'django.core.cache.backends.db.DatabaseCache', 'LOCATION': 'cache'}
+        with override_settings(CACHES={'default': SHARED, 'tiered-database': database}):
+            with self.assertRaises(ImproperlyConfigured):
+                self.worker('database', SHARED='tiered-database')
+            self.worker('database', SHARED='tiered-database', JOURNAL_LOCK='/tmp/journal.lock')
@@ -1,12 +1,35 @@
-from time import sleep
+import os
+import threading
+from datetime import timedelta
+from time import sleep, time
+from unittest.mock import patch
 from urllib.error import URLError, HTTPError
 
-from django.test import TestCase
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Count
+from django.utils import timezone
 
-from miscosas.models import Item, Feed
+from miscosas.models import Item, Feed, FeedJob, KeyResolution
 from miscosas.apps import MisCosasConfig as Config
-from miscosas.feeds.feedhandler import FEEDS_DATA
+from miscosas.feeds.feedhandler import FEEDS_DATA, FeedData, FetchResult
+from miscosas.feeds.ytchannel import YTChannel
+from miscosas.feeds.lastfmartist import LastFmArtist
+from miscosas.feeds.subreddit import Subreddit
+from miscosas.feeds.flickrtag import FlickrTag
+from miscosas.feeds.goodreadsauthor import GoodreadsAuthor
+from miscosas.feeds.spotifyartist import SpotifyArtist, TokenCache
+from miscosas.feeds.keycache import resolve_name, NOT_FOUND_TTL
+from miscosas.feeds.refresh import refresh_feeds
+from miscosas.feeds.jobs import enqueue_feed, claim_job, run_due_jobs
+from miscosas.feeds.scheduler import (RefreshScheduler, next_interval, schedule_feed,
+                                      BASE_INTERVAL, MIN_INTERVAL, MAX_INTERVAL)
+from miscosas.tests.base import TestCase
+from miscosas.tests.stubserver import StubServer
 from miscosas.feeds.feedparser import ParsingError
+from miscosas.fragments import versions
+from miscosas.pagecache import feed_pages
 
 VALID_YOUTUBE_KEY = "UC300utwSVAYOoRLEqmsprfg"
 INVALID_YOUTUBE_KEY = "4v56789r384rgfrtg"
@@ -28,6 +51,8 @@ VALID_SPOTIFY_NAME_KEY = "Green Day"
 VALID_SPOTIFY_ID_KEY = "7oPftvlwr6VrsViSDV7fJY"
 INVALID_SPOTIFY_KEY = "iej%n4u5t(549.gjhg"
 
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), 'fixtures')
+
 
 class TestYoutubeFeed(TestCase):
 
@@ -287,3 +312,615 @@ class TestSpotifyFeed(TestCase):
         self.assertTrue(result)
         self.assertEqual(Feed.objects.count(), 1)
         self.assertEqual(Item.objects.count(), 10)
+
+
+class TestFeedStore(TestCase):
+
+    def entries(self, count, title='Title'):
+        return [{'key': f'item{i}', 'title': f'{title} {i}', 'description': ''}
+                for i in range(count)]
+
+    def test_store_new(self):
+        ''' Tests storing the entries of a new feed '''
+        feed, stats = FEEDS_DATA[Config.YOUTUBE].store('key', 'Feed', self.entries(50))
+
+        self.assertEqual(feed.title, 'Feed')
+        self.assertEqual(stats, (50, 0, 0))
+        self.assertEqual(Item.objects.filter(feed=feed).count(), 50)
+
+    def test_store_update(self):
+        ''' Tests storing entries of an existing feed, some of them changed '''
+        FEEDS_DATA[Config.YOUTUBE].store('key', 'Feed', self.entries(40))
+        entries = self.entries(10, 'Changed') + self.entries(50)[10:]
+        feed, stats = FEEDS_DATA[Config.YOUTUBE].store('key', 'Feed', entries)
+
+        self.assertEqual(stats, (10, 10, 30))
+        self.assertEqual(Feed.objects.count(), 1)
+        self.assertEqual(Item.objects.filter(feed=feed).count(), 50)
+        self.assertEqual(Feed.objects.get(pk=feed.pk).item_count, 50)
+        self.assertEqual(Item.objects.get(key='item0').title, 'Changed 0')
+
+    def test_store_queries(self):
+        ''' Tests the cost of storing does not depend on the amount of entries '''
+        FEEDS_DATA[Config.YOUTUBE].store('key', 'Feed', self.entries(25))
+        with self.assertNumQueries(7):
+            FEEDS_DATA[Config.YOUTUBE].store('key', 'Feed', self.entries(50, 'Changed'))
+
+    def test_store_unchanged(self):
+        ''' Tests storing the same entries again does not write the feed or renew its pages '''
+        feed, _ = FEEDS_DATA[Config.YOUTUBE].store('key', 'Feed', self.entries(5))
+        pages = versions(feed_pages(feed.pk))
+        feed, stats = FEEDS_DATA[Config.YOUTUBE].store('key', 'Feed', self.entries(5))
+
+        self.assertEqual(stats, (0, 0, 5))
+        self.assertEqual(Feed.objects.get(pk=feed.pk).updated, feed.updated)
+        self.assertEqual(versions(feed_pages(feed.pk)), pages)
+
+        FEEDS_DATA[Config.YOUTUBE].store('key', 'New title', self.entries(5))
+        self.assertNotEqual(versions(feed_pages(feed.pk)), pages)
+
+    def test_same_key_other_feed(self):
+        ''' Tests items with the same key in different feeds are kept apart '''
+        FEEDS_DATA[Config.YOUTUBE].store('key', 'Feed', self.entries(5))
+        FEEDS_DATA[Config.REDDIT].store('key', 'Feed', self.entries(5))
+
+        self.assertEqual(Feed.objects.count(), 2)
+        self.assertEqual(Item.objects.count(), 10)
+
+
+class SlowFeedData(FeedData):
+    """Feed source that takes a while to download its
+    documents and keeps track of the parallel downloads."""
+
+    def __init__(self, source):
+        super().__init__('', '', '', source, None, '')
+        self.lock = threading.Lock()
+        self.active = 0
+        self.max_active = 0
+
+    def fetch(self, feed_key, validators=None, resolve=True):
+        with self.lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        sleep(0.2)
+        with self.lock:
+            self.active -= 1
+        if feed_key == 'broken':
+            raise ParsingError("Feed has no items")
+        return FetchResult(feed_key, StaticParser(feed_key), None)
+
+
+class StaticParser:
+    """Parser result with a single item."""
+
+    def __init__(self, feed_key):
+        self.feed_key = feed_key
+
+    def feed_title(self):
+        return self.feed_key.title()
+
+    def iter_items(self):
+        yield {'key': self.feed_key, 'title': self.feed_key}
+
+
+class TestRefreshFeeds(TestCase):
+
+    def setUp(self):
+        self.sources = {
+            Config.YOUTUBE: SlowFeedData(Config.YOUTUBE),
+            Config.REDDIT: SlowFeedData(Config.REDDIT),
+        }
+        for source in self.sources:
+            for i in range(4):
+                Feed.objects.create(key=f'{source}{i}', title='', source=source, chosen=False)
+
+    def test_refresh_parallel(self):
+        ''' Tests feeds are downloaded in parallel within the limits '''
+        start = time()
+        with patch.dict(FEEDS_DATA, self.sources):
+            results = list(refresh_feeds(Feed.objects.all(), max_workers=6, max_per_source=2))
+        elapsed = time() - start
+
+        self.assertEqual(len(results), 8)
+        self.assertTrue(all(result.stats == (1, 0, 0) for result in results))
+        self.assertLess(elapsed, 0.8 * 8 * 0.2)
+        for feed_data in self.sources.values():
+            self.assertEqual(feed_data.max_active, 2)
+        self.assertEqual(Item.objects.count(), 8)
+        self.assertFalse(Feed.objects.filter(chosen=True).exists())
+
+    def test_refresh_errors(self):
+        ''' Tests a failing feed does not stop the rest '''
+        Feed.objects.create(key='broken', title='', source=Config.YOUTUBE)
+        with patch.dict(FEEDS_DATA, self.sources):
+            results = list(refresh_feeds(Feed.objects.all()))
+
+        errors = [result for result in results if result.error]
+        self.assertEqual(len(results), 9)
+        self.assertEqual(len(errors), 1)
+        self.assertEqual(errors[0].feed.key, 'broken')
+
+
+YT_DOCUMENT = b"""<?xml version="1.0" encoding="UTF-8"?>
+<feed xmlns:yt="http://www.youtube.com/xml/schemas/2015"
+      xmlns:media="http://search.yahoo.com/mrss/" xmlns="http://www.w3.org/2005/Atom">
+ <title>Channel</title>
+ <author><name>Channel</name><uri>https://www.youtube.com/channel/key</uri></author>
+ <entry>
+  <yt:videoId>video</yt:videoId>
+  <media:group>
+   <media:title>Video</media:title>
+   <media:thumbnail url="https://i.ytimg.com/vi/video/hqdefault.jpg"/>
+   <media:description>Description</media:description>
+  </media:group>
+ </entry>
+</feed>"""
+
+
+class TestConditionalFetch(TestCase):
+
+    def setUp(self):
+        self.server = StubServer().start()
+        self.feed_data = FeedData('', '', self.server.url + '/{feed}',
+                                  Config.YOUTUBE, YTChannel, '')
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_not_modified(self):
+        ''' Tests a document with the same ETag is not downloaded again '''
+        self.server.set_document('/key', YT_DOCUMENT, ETag='"v1"')
+        feed = self.feed_data.load('key')
+        self.assertEqual(feed.etag, '"v1"')
+
+        result = self.feed_data.fetch('key', feed.validators)
+        self.assertIsNone(result.parser)
+        self.assertEqual(self.server.requests[-1][1].get('If-None-Match'), '"v1"')
+
+    def test_same_content(self):
+        ''' Tests a document with the same body is not parsed again '''
+        self.server.set_document('/key', YT_DOCUMENT)
+        feed = self.feed_data.load('key')
+        self.assertTrue(feed.content_hash)
+
+        result = self.feed_data.fetch('key', feed.validators)
+        self.assertIsNone(result.parser)
+
+        self.server.set_document('/key', YT_DOCUMENT.replace(b'Video<', b'New title<'))
+        result = self.feed_data.fetch('key', feed.validators)
+        self.assertEqual(result.parser.items_data()[0]['title'], 'New title')
+
+    def test_load_unchosen(self):
+        ''' Tests loading an unchanged feed marks it as chosen again '''
+        self.server.set_document('/key', YT_DOCUMENT, ETag='"v1"')
+        feed = self.feed_data.load('key')
+        Feed.objects.update(chosen=False)
+
+        feed = self.feed_data.load('key')
+        self.assertTrue(Feed.objects.get(pk=feed.pk).chosen)
+        self.assertEqual(Item.objects.count(), 1)
+
+    def test_new_validators(self):
+        ''' Tests a document with the same body and a new ETag keeps the new ETag '''
+        self.server.set_document('/key', YT_DOCUMENT, ETag='"v1"')
+        self.feed_data.load('key')
+        self.server.set_document('/key', YT_DOCUMENT, ETag='"v2"')
+
+        feed = self.feed_data.load('key')
+        self.assertEqual(feed.etag, '"v2"')
+        self.assertEqual(Feed.objects.get(pk=feed.pk).etag, '"v2"')
+
+    def test_resolved_key(self):
+        ''' Tests a feed stored with a resolved key is found by its name '''
+        pre_load = lambda feed_key, api_key, resolve: ({}, 'id-' + feed_key.lower())
+        feed_data = FeedData('', '', self.server.url + '/{feed}',
+                             Config.GOODREADS, YTChannel, '', pre_load=pre_load)
+        self.server.set_document('/id-name', YT_DOCUMENT, ETag='"v1"')
+        feed = feed_data.load('Name')
+        self.assertEqual(feed.key, 'id-name')
+
+        feed_data.load('Name')
+        self.assertEqual(self.server.requests[-1][1].get('If-None-Match'), '"v1"')
+        self.assertEqual(Feed.objects.count(), 1)
+
+
+class TestParserFixtures(TestCase):
+
+    def parse(self, name, parser_class, chunk_size=None):
+        with open(os.path.join(FIXTURES_DIR, name), 'rb') as fixture:
+            parser = parser_class(fixture)
+            if chunk_size:
+                parser.CHUNK_SIZE = chunk_size
+            return parser.feed_title, parser.items_data()
+
+    def test_youtube(self):
+        ''' Tests parsing a recorded YouTube channel '''
+        feed_title, items = self.parse('youtube.xml', YTChannel)
+        self.assertEqual(feed_title(), 'Channel Name')
+        self.assertEqual(len(items), 15)
+        self.assertEqual(items[0]['key'], 'vid00000000AB')
+
+    def test_last_fm(self):
+        ''' Tests parsing a recorded Last.fm artist '''
+        feed_title, items = self.parse('lastfm.xml', LastFmArtist)
+        self.assertEqual(feed_title(), 'Linkin Park')
+        self.assertEqual(len(items), 15)
+        self.assertTrue(items[0]['picture'].endswith('300x300/0.png'))
+
+    def test_reddit(self):
+        ''' Tests parsing a recorded subreddit '''
+        feed_title, items = self.parse('reddit.xml', Subreddit)
+        self.assertEqual(feed_title(), 'memes')
+        self.assertEqual(len(items), 25)
+        self.assertEqual(items[0]['key'], 'abc0')
+        self.assertNotIn('[link]', items[0]['description'])
+
+    def test_flickr(self):
+        ''' Tests parsing a recorded Flickr tag '''
+        feed_title, items = self.parse('flickr.xml', FlickrTag)
+        self.assertEqual(feed_title(), 'Recent Uploads tagged fuenlabrada')
+        self.assertEqual(len(items), 20)
+        self.assertEqual(items[0]['key'], 'user0/4900000')
+
+    def test_goodreads(self):
+        ''' Tests parsing a recorded Goodreads author, without the less rated books '''
+        feed_title, items = self.parse('goodreads.xml', GoodreadsAuthor)
+        self.assertEqual(feed_title(), 'Trudi Canavan')
+        self.assertEqual(len(items), 16)
+
+    def test_spotify(self):
+        ''' Tests parsing a recorded Spotify artist '''
+        feed_title, items = self.parse('spotify.json', SpotifyArtist)
+        self.assertEqual(feed_title(), 'Green Day')
+        self.assertEqual(len(items), 10)
+
+    def test_split_content(self):
+        ''' Tests the content is the same when it is read in many pieces '''
+        _, items = self.parse('goodreads.xml', GoodreadsAuthor)
+        _, split_items = self.parse('goodreads.xml', GoodreadsAuthor, chunk_size=7)
+        self.assertEqual(items, split_items)
+        self.assertTrue(items[0]['description'].startswith('<p>'))
+
+
+def yt_document(count, complete=True):
+    """YouTube channel document with count videos,
+    the last one has no title if complete is False."""
+    entries = b"".join(
+        b"""
+ <entry>
+  <yt:videoId>video%d</yt:videoId>
+  <media:group>
+   <media:title>%s</media:title>
+   <media:thumbnail url="https://i.ytimg.com/vi/video/hqdefault.jpg"/>
+   <media:description>Description</media:description>
+  </media:group>
+ </entry>""" % (i, b"Video" if complete or i < count - 1 else b"")
+        for i in range(count))
+    start, end = YT_DOCUMENT.index(b"\n <entry>"), YT_DOCUMENT.index(b"\n</feed>")
+    return YT_DOCUMENT[:start] + entries + YT_DOCUMENT[end:]
+
+
+class SlowStream:
+    """Stream that returns the data in small chunks and counts
+    the items in the database each time it is read."""
+
+    def __init__(self, data, chunk_size=200):
+        self.data = data
+        self.chunk_size = chunk_size
+        self.position = 0
+        self.item_counts = []
+        self.closed = False
+
+    def read(self, amt=None):
+        self.item_counts.append(Item.objects.count())
+        chunk = self.data[self.position:self.position + self.chunk_size]
+        self.position += len(chunk)
+        return chunk
+
+    def close(self):
+        self.closed = True
+
+
+class SlowResponse(SlowStream):
+    """SlowStream returned by urlopen that counts the
+    transactions open each time it is read."""
+
+    headers = {}
+
+    def __init__(self, data, chunk_size=200):
+        super().__init__(data, chunk_size)
+        self.open_transactions = []
+
+    def read(self, amt=None):
+        self.open_transactions.append(len(connection.savepoint_ids))
+        return super().read(amt)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class TestStreamingParser(TestCase):
+
+    def test_items_while_reading(self):
+        ''' Tests items are parsed before the whole document is read '''
+        stream = SlowStream(yt_document(20))
+        items = YTChannel(stream).iter_items()
+        self.assertEqual(next(items)['key'], 'video0')
+        self.assertLess(stream.position, len(stream.data))
+
+        self.assertEqual(len(list(items)), 19)
+        self.assertTrue(stream.closed)
+
+    def test_limit(self):
+        ''' Tests the document stops being read after the item limit '''
+        stream = SlowStream(yt_document(20))
+        items = YTChannel(stream, limit=5).items_data()
+
+        self.assertEqual([item['key'] for item in items], [f'video{i}' for i in range(5)])
+        self.assertLess(stream.position, len(stream.data))
+        self.assertTrue(stream.closed)
+
+    def test_malformed(self):
+        ''' Tests a broken document raises a ParsingError '''
+        with self.assertRaisesMessage(ParsingError, 'Malformed document'):
+            YTChannel(SlowStream(yt_document(5)[:-20])).items_data()
+
+    @patch('miscosas.feeds.feedhandler.BATCH_SIZE', 2)
+    def test_store_while_reading(self):
+        ''' Tests items are written while the document is being read '''
+        stream = SlowStream(yt_document(20))
+        feed, stats = FEEDS_DATA[Config.YOUTUBE].store_parser('key', YTChannel(stream))
+
+        self.assertEqual(feed.title, 'Channel')
+        self.assertEqual(stats, (20, 0, 0))
+        self.assertGreater(stream.item_counts[-1], 0)
+
+    @patch('miscosas.feeds.feedhandler.BATCH_SIZE', 2)
+    def test_download_before_write(self):
+        ''' Tests a new feed is downloaded before the transaction that stores it begins '''
+        response = SlowResponse(yt_document(20))
+        open_transactions = len(connection.savepoint_ids)
+        with patch('miscosas.feeds.feedhandler.urlopen', return_value=response):
+            feed = FEEDS_DATA[Config.YOUTUBE].load('key')
+
+        self.assertEqual(set(response.open_transactions), {open_transactions})
+        self.assertEqual(Item.objects.filter(feed=feed).count(), 20)
+        self.assertTrue(feed.content_hash)
+
+    @patch('miscosas.feeds.feedhandler.BATCH_SIZE', 2)
+    def test_store_error(self):
+        ''' Tests nothing is stored when an item after the first batch is wrong '''
+        stream = SlowStream(yt_document(20, complete=False))
+        with self.assertRaisesMessage(ParsingError, 'Some item is missing fields'):
+            FEEDS_DATA[Config.YOUTUBE].store_parser('key', YTChannel(stream))
+
+        self.assertEqual(Feed.objects.count(), 0)
+        self.assertEqual(Item.objects.count(), 0)
+
+
+class TestSpotifyToken(TestCase):
+
+    def setUp(self):
+        self.server = StubServer().start()
+        self.tokens = TokenCache(self.server.url + '/token')
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_token_reused(self):
+        ''' Tests the token is requested once until it expires '''
+        self.server.set_document('/token', b'{"access_token": "abc", "expires_in": 3600}')
+        threads = [threading.Thread(target=self.tokens.get, args=('id:secret',)) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(self.tokens.get('id:secret'), 'abc')
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_token_expired(self):
+        ''' Tests the token is renewed when it is about to expire '''
+        expires_in = TokenCache.EXPIRY_MARGIN - 1
+        self.server.set_document('/token', f'{{"access_token": "abc", "expires_in": {expires_in}}}'.encode())
+        self.tokens.get('id:secret')
+        self.tokens.get('id:secret')
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_token_missing(self):
+        ''' Tests an answer without token raises an error '''
+        self.server.set_document('/token', b'{"error": "invalid_client"}')
+        with self.assertRaisesMessage(ParsingError, 'Could not get an access token'):
+            self.tokens.get('id:secret')
+
+
+class TestNameResolution(TestCase):
+
+    def setUp(self):
+        self.lookups = []
+
+    def lookup(self, name):
+        self.lookups.append(name)
+        return None if name == 'Nobody' else '1234'
+
+    def test_resolution_cached(self):
+        ''' Tests a name is only looked up once '''
+        self.assertEqual(resolve_name(Config.GOODREADS, 'Trudi Canavan', self.lookup), '1234')
+        self.assertEqual(resolve_name(Config.GOODREADS, ' trudi  CANAVAN', self.lookup), '1234')
+        self.assertEqual(self.lookups, ['Trudi Canavan'])
+
+    def test_resolution_per_source(self):
+        ''' Tests the same name is looked up for each source '''
+        resolve_name(Config.GOODREADS, 'Name', self.lookup)
+        resolve_name(Config.SPOTIFY, 'Name', self.lookup)
+        self.assertEqual(len(self.lookups), 2)
+
+    def test_not_found_cached(self):
+        ''' Tests names that do not exist are not looked up until they expire '''
+        self.assertIsNone(resolve_name(Config.SPOTIFY, 'Nobody', self.lookup))
+        self.assertIsNone(resolve_name(Config.SPOTIFY, 'Nobody', self.lookup))
+        self.assertEqual(len(self.lookups), 1)
+
+        KeyResolution.objects.update(date=timezone.now() - NOT_FOUND_TTL)
+        resolve_name(Config.SPOTIFY, 'Nobody', self.lookup)
+        self.assertEqual(len(self.lookups), 2)
+
+
+class TestFeedJobs(TestCase):
+
+    def setUp(self):
+        ''' Serves the feeds of a source from the stub server '''
+        cache.clear()
+        self.server = StubServer().start()
+        self.server.set_document('/key', YT_DOCUMENT)
+        feed_data = FeedData('', '', self.server.url + '/{feed}', Config.YOUTUBE, YTChannel, '')
+        self.sources = patch.dict(FEEDS_DATA, {Config.YOUTUBE: feed_data})
+        self.sources.start()
+        self.user = User.objects.create_user('root', password='toor')
+        self.client.force_login(self.user)
+
+    def tearDown(self):
+        self.sources.stop()
+        self.server.stop()
+
+    def test_post(self):
+        ''' Tests a posted feed is shown once a worker loads it '''
+        response = self.client.post('/feeds', {'key': 'key', 'source': Config.YOUTUBE})
+        self.assertEqual(self.server.requests, [])
+        job = FeedJob.objects.get()
+        self.assertRedirects(response, f'/job/{job.pk}', fetch_redirect_response=False)
+        response = self.client.get(f'/job/{job.pk}')
+        self.assertEqual(response.status_code, 202)
+        self.assertIn('Refresh', response)
+        response = self.client.get(f'/job/{job.pk}', HTTP_ACCEPT_LANGUAGE='es')
+        self.assertContains(response, 'Cargando alimentador', status_code=202)
+
+        self.assertEqual(len(run_due_jobs()), 1)
+        feed = Feed.objects.get()
+        self.assertRedirects(self.client.get(f'/job/{job.pk}'), f'/feed/{feed.pk}',
+                             fetch_redirect_response=False)
+        self.assertIn(feed, self.user.profile.chosen_feeds.all())
+
+    def test_same_feed(self):
+        ''' Tests a feed asked for twice is loaded once '''
+        other = User.objects.create_user('other')
+        first = enqueue_feed(Config.YOUTUBE, 'key', self.user)
+        self.assertEqual(enqueue_feed(Config.YOUTUBE, 'key', other), first)
+        run_due_jobs()
+        self.assertEqual(len(self.server.requests), 1)
+        self.assertEqual(Feed.objects.get().users.count(), 2)
+
+    def test_retries(self):
+        ''' Tests jobs are tried again later when the source fails '''
+        self.server.set_document('/key', b'Busy', status=503)
+        job = enqueue_feed(Config.YOUTUBE, 'key')
+        job, = run_due_jobs()
+        self.assertEqual((job.state, job.attempts), (FeedJob.PENDING, 1))
+        self.assertGreater(job.run_after, timezone.now())
+        self.assertEqual(run_due_jobs(), [])
+
+        self.server.set_document('/key', YT_DOCUMENT)
+        FeedJob.objects.update(run_after=timezone.now())
+        job, = run_due_jobs()
+        self.assertEqual((job.state, job.attempts), (FeedJob.DONE, 2))
+
+    def test_wrong_key(self):
+        ''' Tests jobs of feeds that do not exist are not tried again '''
+        job = enqueue_feed(Config.YOUTUBE, 'missing')
+        job, = run_due_jobs()
+        self.assertEqual(job.state, FeedJob.FAILED)
+        response = self.client.get(f'/job/{job.pk}')
+        self.assertEqual(response.status_code, 404)
+        self.assertContains(response, 'Not Found', status_code=404)
+
+    def test_leases(self):
+        ''' Tests a job is claimed again only when its lease ends '''
+        job = enqueue_feed(Config.YOUTUBE, 'key')
+        self.assertEqual(claim_job('first').pk, job.pk)
+        self.assertIsNone(claim_job('second'))
+
+        FeedJob.objects.update(lease_until=timezone.now())
+        job = claim_job('second')
+        self.assertEqual((job.worker, job.attempts), ('second', 2))
+
+
+class TestRefreshScheduler(TestCase):
+
+    def setUp(self):
+        self.now = timezone.now()
+        self.user = User.objects.create_user('root', password='toor')
+
+    def feed(self, key, **fields):
+        feed = Feed.objects.create(key=key, title='', source=Config.YOUTUBE, chosen=False)
+        Feed.objects.filter(pk=feed.pk).update(**fields)
+        return Feed.objects.annotate(subscribers=Count('users')).get(pk=feed.pk)
+
+    def test_intervals(self):
+        ''' Tests feeds with more new items or users are refreshed sooner '''
+        self.assertEqual(next_interval(0, 0), BASE_INTERVAL)
+        self.assertEqual(next_interval(2, 0), 30 * 60)
+        self.assertEqual(next_interval(2, 2), 2 * 60 * 60)
+        self.assertEqual(next_interval(2, 0, weight=2), 15 * 60)
+        self.assertEqual(next_interval(1000, 0), MIN_INTERVAL)
+        self.assertEqual(next_interval(0, 100), MAX_INTERVAL)
+
+    def test_backoff(self):
+        ''' Tests the interval of a feed doubles while it has no new items '''
+        last = self.now - timedelta(hours=1)
+        feed = self.feed('quiet', last_refresh=last, change_rate=1)
+        intervals = []
+        for _ in range(4):
+            next_refresh = schedule_feed(feed, 0, self.now)
+            intervals.append(next_refresh - self.now)
+            feed = Feed.objects.annotate(subscribers=Count('users')).get(pk=feed.pk)
+        self.assertTrue(all(later > 2 * earlier for earlier, later in zip(intervals, intervals[1:])))
+
+        schedule_feed(feed, 3, self.now + timedelta(hours=1))
+        feed.refresh_from_db()
+        self.assertEqual(feed.quiet_refreshes, 0)
+        self.assertEqual(feed.last_new_items, self.now + timedelta(hours=1))
+
+    def test_subscribers(self):
+        ''' Tests the feeds chosen by more users are refreshed sooner '''
+        alone = self.feed('alone')
+        popular = self.feed('popular')
+        self.user.profile.chosen_feeds.add(popular)
+        popular = Feed.objects.annotate(subscribers=Count('users')).get(pk=popular.pk)
+        self.assertLess(schedule_feed(popular, 1, self.now), schedule_feed(alone, 1, self.now))
+
+    def test_due_feeds(self):
+        ''' Tests only the due feeds are refreshed, the soonest first '''
+        sources = {Config.YOUTUBE: SlowFeedData(Config.YOUTUBE)}
+        for i in range(3):
+            self.feed(f'feed{i}', next_refresh=self.now - timedelta(minutes=i))
+        self.feed('later', next_refresh=self.now + timedelta(hours=1))
+        scheduler = RefreshScheduler(max_feeds=2)
+
+        with patch.dict(FEEDS_DATA, sources):
+            refreshed = [result.feed.key for result in scheduler.run_once(self.now)]
+            self.assertEqual(sorted(refreshed), ['feed1', 'feed2'])
+            refreshed = [result.feed.key for result in scheduler.run_once(self.now)]
+            self.assertEqual(refreshed, ['feed0'])
+            self.assertEqual(list(scheduler.run_once(self.now)), [])
+
+        self.assertFalse(Feed.objects.filter(next_refresh__lte=self.now).exists())
+        self.assertGreater(scheduler.next_due(), self.now)
+
+    def test_stored_key(self):
+        ''' Tests feeds are refreshed with their stored key without resolving it again '''
+        server = StubServer().start()
+        self.addCleanup(server.stop)
+        server.set_document('/stored', YT_DOCUMENT)
+        pre_load = lambda feed_key, api_key, resolve: ({}, 'other' if resolve else feed_key)
+        sources = {Config.YOUTUBE: FeedData('', '', server.url + '/{feed}',
+                                            Config.YOUTUBE, YTChannel, '', pre_load=pre_load)}
+        feed = self.feed('stored', next_refresh=self.now)
+
+        with patch.dict(FEEDS_DATA, sources):
+            result, = RefreshScheduler().run_once(self.now)
+        self.assertIsNone(result.error)
+        self.assertEqual(result.feed.pk, feed.pk)
+        self.assertEqual([path for path, _ in server.requests], ['/stored'])
@@ -0,0 +1,118 @@
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from io import StringIO
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import IntegrityError, connection
+
+from miscosas.apps import MisCosasConfig as Config
+from miscosas.models import Feed, Item, Vote
+from miscosas.sqlite.base import SQLiteCursorWrapper, RETRY_DELAY
+from miscosas.tests.base import SimpleTestCase, TestCase, TransactionTestCase
+
+
+class TestConnectionSettings(TestCase):
+
+    def pragma(self, name):
+        with connection.cursor() as cursor:
+            cursor.execute(f'PRAGMA {name}')
+            return cursor.fetchone()[0]
+
+    def test_pragmas(self):
+        ''' Tests the pragmas are set on the connections '''
+        self.assertEqual(self.pragma('busy_timeout'), 5000)
+        # NORMAL
+        self.assertEqual(self.pragma('synchronous'), 1)
+        self.assertEqual(self.pragma('cache_size'), -64 * 1024)
+
+
+class TestLockRetries(SimpleTestCase):
+
+    def setUp(self):
+        ''' Makes a database file with a connection that holds the write lock '''
+        self.directory = tempfile.TemporaryDirectory()
+        path = os.path.join(self.directory.name, 'db.sqlite3')
+        self.writer = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self.writer.execute('CREATE TABLE entry (value INTEGER)')
+        self.writer.execute('BEGIN IMMEDIATE')
+        self.connection = sqlite3.connect(path, timeout=0, isolation_level=None)
+
+    def tearDown(self):
+        self.connection.close()
+        self.writer.close()
+        self.directory.cleanup()
+
+    def test_retry(self):
+        ''' Tests a statement is run again once the database is unlocked '''
+        threading.Timer(0.02, self.writer.execute, ['COMMIT']).start()
+        cursor = self.connection.cursor(factory=SQLiteCursorWrapper)
+        cursor.execute('INSERT INTO entry VALUES (%s)', (1,))
+        self.assertEqual(self.connection.execute('SELECT COUNT(*) FROM entry').fetchone()[0], 1)
+
+    def test_no_retries_in_transaction(self):
+        ''' Tests the statements of an open transaction are not run again '''
+        self.connection.execute('BEGIN')
+        self.connection.execute('SELECT COUNT(*) FROM entry').fetchone()
+        cursor = self.connection.cursor(factory=SQLiteCursorWrapper)
+        start = time.monotonic()
+        with self.assertRaisesMessage(sqlite3.OperationalError, 'database is locked'):
+            cursor.execute('INSERT INTO entry VALUES (%s)', (1,))
+        self.assertLess(time.monotonic() - start, RETRY_DELAY)
+
+    def test_no_retries(self):
+        ''' Tests the error is raised when there are no retries left '''
+        cursor = self.connection.cursor(factory=SQLiteCursorWrapper)
+        cursor.lock_retries = 0
+        with self.assertRaisesMessage(sqlite3.OperationalError, 'database is locked'):
+            cursor.execute('INSERT INTO entry VALUES (%s)', (1,))
+
+
+class TestMaintenance(TransactionTestCase):
+
+    def test_maintenance(self):
+        ''' Tests the maintenance tasks can be run '''
+        output = StringIO()
+        call_command('db_maintenance', '--enable-incremental', stdout=output)
+        self.assertIn("Statistics updated", output.getvalue())
+        self.assertIn("free pages", output.getvalue())
+        self.assertIn("Maintenance done", output.getvalue())
+
+
+class TestQueryPlans(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('user', password='pass')
+        self.feed = Feed.objects.create(key='channel', source=Config.YOUTUBE)
+        self.item = Item.objects.create(key='video', title='Video', feed=self.feed)
+
+    def assertIndexUsed(self, queryset, index):
+        ''' Checks the plan of a query searches an index and needs no sorting '''
+        plan = queryset.explain()
+        self.assertIn(index, plan)
+        self.assertNotIn('USE TEMP B-TREE', plan)
+
+    def test_item_natural_key(self):
+        ''' Tests the items of a feed are found by their key '''
+        items = Item.objects.filter(feed=self.feed, key__in=['video', 'other'])
+        self.assertRegex(items.explain(),
+            r'SEARCH .*(item_feed_key_unique|sqlite_autoindex_miscosas_item)')
+
+    def test_repeated_item(self):
+        ''' Tests a feed cannot have two items with the same key '''
+        with self.assertRaises(IntegrityError):
+            Item.objects.create(key='video', title='Again', feed=self.feed)
+
+    def test_hot_queries(self):
+        ''' Tests the frequent queries use their indexes '''
+        self.assertIndexUsed(
+            Feed.objects.filter(key='channel', source=Config.YOUTUBE), 'feed_source_key_idx')
+        self.assertIndexUsed(
+            Item.objects.filter(upvote_count__gt=0), 'item_upvotes_idx')
+        self.assertIndexUsed(
+            Vote.objects.filter(user=self.user).order_by('-date')[:5], 'vote_user_date_idx')
+        self.assertIndexUsed(
+            self.item.comments.order_by('-date', '-pk'), 'comment_item_date_idx')
@@ -1,11 +1,26 @@
 import datetime
+import gzip
 import json
+import os
+import re
+import tempfile
+from io import StringIO
+from urllib.parse import quote
 from xml.etree import ElementTree
 
-from django.test import TestCase
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
+from django.core.cache import cache
+from django.core.management import call_command
+from django.utils import timezone
 
-from miscosas.models import Item, Feed, User, Profile, Vote
+from miscosas.models import Item, Feed, User, Profile, Vote, Comment
+from miscosas.feeds.jobs import run_due_jobs
 from miscosas.apps import MisCosasConfig as Config
+from miscosas.templatetags.fragment_cache import CSRF_PLACEHOLDER
+from miscosas.pagecache import page_cache_stats, reset_page_cache_stats, HITS_KEY
+from miscosas.tests.base import TestCase
 
 VALID_YOUTUBE_KEY = "UC300utwSVAYOoRLEqmsprfg"
 INVALID_YOUTUBE_KEY = "4v56789r384rgfrtg"
@@ -16,6 +31,9 @@ JSON = "?format=json"
 
 class TestGetViewsEmpty(TestCase):
 
+    def setUp(self):
+        cache.clear()
+
     def test_main_page(self):
         ''' Tests the index page with nothing on the database '''
 
@@ -61,9 +79,11 @@ class TestGetViewsContent(TestCase):
 
     def setUp(self):
         ''' Posts some forms to have content available '''
+        cache.clear()
 
         form = {'key': VALID_YOUTUBE_KEY, 'source': Config.YOUTUBE}
         self.client.post('/feeds', form)
+        run_due_jobs()
 
     def test_main_page(self):
         ''' Tests the index page after some feeds are added '''
@@ -119,6 +139,7 @@ class TestGetViewsAuthenticated(TestCase):
 
         form = {'key': VALID_YOUTUBE_KEY, 'source': Config.YOUTUBE}
         self.client.post('/feeds', form)
+        run_due_jobs()
         self.user = User.objects.create_user('root', password='toor')
         self.other_user = User.objects.create_user('aaa', password='aaa')
         self.client.force_login(self.user)
@@ -203,35 +224,37 @@ class TestGetViewsAuthenticated(TestCase):
 class TestGetPagesAsXml(TestCase):
 
     def setUp(self):
+        cache.clear()
         form = {'key': VALID_YOUTUBE_KEY, 'source': Config.YOUTUBE}
         self.client.post('/feeds', form)
+        run_due_jobs()
         self.user = User.objects.create_user('root', password='toor')
 
     def test_main_page(self):
         response = self.client.get('/' + XML)
         self.assertEqual(response['content-type'], 'text/xml')
         self.assertEqual(response.status_code, 200)
-        ElementTree.fromstring(response.content)
+        ElementTree.fromstring(b"".join(response.streaming_content))
 
     def test_main_page_logged_in(self):
         self.client.force_login(self.user)
         response = self.client.get('/' + XML)
         self.assertEqual(response['content-type'], 'text/xml')
         self.assertEqual(response.status_code, 200)
-        ElementTree.fromstring(response.content)
+        ElementTree.fromstring(b"".join(response.streaming_content))
 
     def test_main_page_no_content(self):
         Feed.objects.get().delete()
         response = self.client.get('/' + XML)
         self.assertEqual(response['content-type'], 'text/xml')
         self.assertEqual(response.status_code, 200)
-        ElementTree.fromstring(response.content)
+        ElementTree.fromstring(b"".join(response.streaming_content))
 
     def test_feeds_page(self):
         response = self.client.get('/feeds' + XML)
         self.assertEqual(response['content-type'], 'text/xml')
         self.assertEqual(response.status_code, 200)
-        ElementTree.fromstring(response.content)
+        ElementTree.fromstring(b"".join(response.streaming_content))
 
     def test_feed_page_no_content(self):
         Feed.objects.get().delete()
@@ -244,46 +267,66 @@ class TestGetPagesAsXml(TestCase):
         response = self.client.get('/feed/1' + XML)
         self.assertEqual(response['content-type'], 'text/xml')
         self.assertEqual(response.status_code, 200)
-        ElementTree.fromstring(response.content)
+        ElementTree.fromstring(b"".join(response.streaming_content))
 
     def test_item_page(self):
         response = self.client.get('/item/1' + XML)
         self.assertEqual(response['content-type'], 'text/xml')
         self.assertEqual(response.status_code, 200)
-        ElementTree.fromstring(response.content)
+        ElementTree.fromstring(b"".join(response.streaming_content))
 
     def test_item_page_logged_in(self):
         self.client.force_login(self.user)
         response = self.client.get('/item/1' + XML)
         self.assertEqual(response['content-type'], 'text/xml')
         self.assertEqual(response.status_code, 200)
-        ElementTree.fromstring(response.content)
+        ElementTree.fromstring(b"".join(response.streaming_content))
 
     def test_users_page(self):
         response = self.client.get('/users' + XML)
         self.assertEqual(response['content-type'], 'text/xml')
         self.assertEqual(response.status_code, 200)
-        ElementTree.fromstring(response.content)
+        ElementTree.fromstring(b"".join(response.streaming_content))
 
     def test_user_page(self):
         response = self.client.get('/user/' + self.user.username + XML)
         self.assertEqual(response['content-type'], 'text/xml')
         self.assertEqual(response.status_code, 200)
-        ElementTree.fromstring(response.content)
+        ElementTree.fromstring(b"".join(response.streaming_content))
 
     def test_own_user_page(self):
         self.client.force_login(self.user)
         response = self.client.get('/user/' + self.user.username + XML)
         self.assertEqual(response['content-type'], 'text/xml')
         self.assertEqual(response.status_code, 200)
-        ElementTree.fromstring(response.content)
+        ElementTree.fromstring(b"".join(response.streaming_content))
+
+    def test_streamed_document(self):
+        ''' Tests the document is sent in pieces and can be written without indentation '''
+        feed = Feed.objects.create(key='key', title='Feed', source=Config.YOUTUBE)
+        for i in range(5):
+            Item.objects.create(key=f'item{i}', title='Item', feed=feed)
+        response = self.client.get('/feeds' + XML)
+        self.assertTrue(response.streaming)
+        pieces = list(response.streaming_content)
+        self.assertGreater(len(pieces), 2)
+        indented = ElementTree.fromstring(b"".join(pieces))
+
+        response = self.client.get('/feeds' + XML + '&indent=0')
+        compact = b"".join(response.streaming_content)
+        # Only the XML declaration is in a line of its own
+        self.assertEqual(compact.count(b'\n'), 1)
+        self.assertEqual(len(ElementTree.fromstring(compact).findall('.//feed')),
+                         len(indented.findall('.//feed')))
 
 
 class TestGetPagesAsJson(TestCase):
 
     def setUp(self):
+        cache.clear()
         form = {'key': VALID_YOUTUBE_KEY, 'source': Config.YOUTUBE}
         self.client.post('/feeds', form)
+        run_due_jobs()
         self.user = User.objects.create_user('root', password='toor')
 
     def test_main_page(self):
@@ -356,3 +399,493 @@ class TestGetPagesAsJson(TestCase):
         self.assertEqual(response['content-type'], 'application/json')
         self.assertEqual(response.status_code, 200)
         json.loads(response.content)
+
+
+class TestIndexRanking(TestCase):
+
+    def setUp(self):
+        ''' Creates items and voters without fetching any feed '''
+        cache.clear()
+        self.feed = Feed.objects.create(key='key', title='Feed', source=Config.YOUTUBE)
+        self.items = [
+            Item.objects.create(key=f'item{i}', title=f'Item {i}', feed=self.feed)
+            for i in range(30)
+        ]
+        self.users = [User.objects.create_user(f'user{i}', password='pass') for i in range(4)]
+
+    def vote(self, item, ups, downs):
+        for user in self.users[:ups]:
+            Vote.objects.create(item=item, user=user, positive=True)
+        for user in self.users[ups:ups + downs]:
+            Vote.objects.create(item=item, user=user, positive=False)
+
+    def test_ranking_order(self):
+        ''' Tests items are sorted by score and then by upvotes '''
+        self.vote(self.items[0], 1, 0)
+        self.vote(self.items[1], 3, 1)
+        self.vote(self.items[2], 2, 0)
+        self.vote(self.items[3], 0, 2)
+
+        response = self.client.get('/')
+        popular = list(response.context['popular_items'])
+        self.assertEqual(popular, [self.items[1], self.items[2], self.items[0]])
+
+    def test_constant_queries(self):
+        ''' Tests the index cost does not depend on the amount of voted items '''
+        for item in self.items[:12]:
+            self.vote(item, 1, 1)
+        with CaptureQueriesContext(connection) as few_votes:
+            self.client.get('/')
+
+        for item in self.items[12:]:
+            self.vote(item, 2, 1)
+        with CaptureQueriesContext(connection) as many_votes:
+            self.client.get('/')
+
+        self.assertEqual(len(few_votes), len(many_votes))
+
+
+class TestPagination(TestCase):
+
+    def setUp(self):
+        ''' Creates a feed with items and comments without fetching any feed '''
+        cache.clear()
+        self.feed = Feed.objects.create(key='key', title='Feed', source=Config.YOUTUBE)
+        self.items = [
+            Item.objects.create(key=f'item{i}', title=f'Item {i}', feed=self.feed)
+            for i in range(35)
+        ]
+
+    def test_pages(self):
+        ''' Tests the entries and links of the pages found by number '''
+        response = self.client.get(f'/feed/{self.feed.pk}')
+        self.assertEqual(list(response.context['item_list']), self.items[:10])
+        self.assertEqual(list(response.context['pages']), [1, 2, 3, 4])
+        self.assertContains(response, f'?page=2&after={self.items[9].pk}')
+
+        response = self.client.get(f'/feed/{self.feed.pk}?page=4')
+        self.assertEqual(list(response.context['item_list']), self.items[30:])
+        self.assertIsNone(response.context['next_cursor'])
+        self.assertContains(response, f'?page=3&before={self.items[30].pk}')
+
+        response = self.client.get(f'/feed/{self.feed.pk}?page=5')
+        self.assertEqual(response.status_code, 404)
+
+    def test_cursors(self):
+        ''' Tests following the next and previous links gives the same pages '''
+        response = self.client.get(f'/feed/{self.feed.pk}?page=3&after={self.items[19].pk}')
+        self.assertEqual(list(response.context['item_list']), self.items[20:30])
+
+        response = self.client.get(f'/feed/{self.feed.pk}?page=2&before={self.items[20].pk}')
+        self.assertEqual(list(response.context['item_list']), self.items[10:20])
+        self.assertEqual(response.context['previous_cursor'], self.items[10].pk)
+        self.assertEqual(response.context['next_cursor'], self.items[19].pk)
+
+    def test_no_offset(self):
+        ''' Tests pages found by number are sought by key without skipping entries '''
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(f'/feed/{self.feed.pk}?page=3')
+        self.assertEqual(list(response.context['item_list']), self.items[20:30])
+        self.assertFalse(any('OFFSET' in query['sql'] for query in queries))
+
+    def test_back_to_first(self):
+        ''' Tests going back from a page off the numbered edges ends in a full first page '''
+        response = self.client.get(f'/feed/{self.feed.pk}?page=2&before={self.items[5].pk}')
+        self.assertEqual(list(response.context['item_list']), self.items[:10])
+        self.assertEqual(response.context['current_page'], 1)
+        self.assertIsNone(response.context['previous_cursor'])
+
+    def test_comment_order(self):
+        ''' Tests comments are paginated from the newest '''
+        user = User.objects.create_user('root', password='toor')
+        date = timezone.now()
+        for i in range(15):
+            comment = Comment.objects.create(item=self.items[0], user=user, title=f'{i}', content='')
+            # Some comments share the same date
+            Comment.objects.filter(pk=comment.pk).update(date=date - datetime.timedelta(minutes=i % 3))
+        expected = list(Comment.objects.order_by('-date', '-pk'))
+
+        response = self.client.get(f'/item/{self.items[0].pk}')
+        self.assertEqual(list(response.context['comment_list']), expected[:10])
+        cursor = response.context['next_cursor']
+        response = self.client.get(f'/item/{self.items[0].pk}?after={cursor}')
+        self.assertEqual(list(response.context['comment_list']), expected[10:])
+
+    def test_constant_queries(self):
+        ''' Tests the cost of a page does not depend on the amount of entries '''
+        User.objects.bulk_create(User(username=f'user{i}') for i in range(25))
+        users = list(User.objects.order_by('pk'))
+        self.client.get('/users')
+        with CaptureQueriesContext(connection) as few_users:
+            self.client.get(f'/users?after={users[9].pk}')
+
+        User.objects.bulk_create(User(username=f'new{i}') for i in range(100))
+        with CaptureQueriesContext(connection) as many_users:
+            self.client.get(f'/users?after={users[9].pk}')
+
+        self.assertEqual(len(few_users), len(many_users))
+        self.assertFalse(any('COUNT' in query['sql'] for query in many_users))
+
+
+class TestDocumentQueries(TestCase):
+
+    def setUp(self):
+        ''' Creates feeds, items and votes without fetching any feed '''
+        cache.clear()
+        self.user = User.objects.create_user('root', password='toor')
+        self.feeds = [Feed.objects.create(key=f'key{i}', title='Feed', source=Config.YOUTUBE)
+                      for i in range(2)]
+
+    def add_rows(self, count):
+        for feed in self.feeds:
+            for i in range(count):
+                item = Item.objects.create(key=f'item{Item.objects.count()}', title='Item', feed=feed)
+                Vote.objects.create(item=item, user=self.user, positive=True)
+                Comment.objects.create(item=item, user=self.user, title='Title', content='Content')
+        User.objects.bulk_create(User(username=f'user{User.objects.count()}-{i}') for i in range(count))
+
+    def queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+            if response.streaming:
+                b''.join(response.streaming_content)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_fixed_queries(self):
+        ''' Tests the documents of the pages take the same queries for more rows '''
+        self.client.force_login(self.user)
+        self.add_rows(11)
+        item = Item.objects.first()
+        urls = ['/', '/feeds', f'/feed/{self.feeds[0].pk}', f'/item/{item.pk}',
+                '/users', f'/user/{self.user.username}']
+        few_rows = {url + format: self.queries(url + format) for url in urls for format in (XML, JSON)}
+
+        self.add_rows(20)
+        cache.clear()
+        many_rows = {url + format: self.queries(url + format) for url in urls for format in (XML, JSON)}
+
+        self.assertEqual(few_rows, many_rows)
+        self.assertLessEqual(max(many_rows.values()), 12)
+
+    def test_json_fields(self):
+        ''' Tests the listings keep the names of their fields '''
+        self.add_rows(2)
+        feed = self.feeds[0]
+        items = json.loads(self.client.get(f'/feed/{feed.pk}' + JSON).content)['item_list']
+        self.assertEqual({item['feed_id'] for item in items}, {feed.pk})
+        feeds = json.loads(self.client.get('/feeds' + JSON).content)['all_feeds']
+        self.assertEqual([feed['items'] for feed in feeds], [2, 2])
+
+
+class TestExport(TestCase):
+
+    def setUp(self):
+        ''' Creates feeds, items, votes and comments without fetching any feed '''
+        self.user = User.objects.create_user('root', password='toor')
+        self.feed = Feed.objects.create(key='key', title='Feed', source=Config.YOUTUBE)
+        self.items = [Item.objects.create(key=f'item{i}', title='Item', feed=self.feed)
+                      for i in range(3)]
+        Vote.objects.create(item=self.items[0], user=self.user, positive=True)
+        Comment.objects.create(item=self.items[1], user=self.user, title='Title', content='Content')
+
+    def export(self, url='/export.ndjson', **headers):
+        response = self.client.get(url, **headers)
+        self.assertEqual(response.status_code, 200)
+        content = b''.join(response.streaming_content)
+        if response.get('Content-Encoding') == 'gzip':
+            content = gzip.decompress(content)
+        return [json.loads(line) for line in content.splitlines()]
+
+    def test_export(self):
+        ''' Tests every row is exported in a line and the watermark is the last one '''
+        rows = self.export()
+        types = [row['type'] for row in rows]
+        self.assertEqual(types, ['feed'] + ['item'] * 3 + ['vote', 'comment', 'watermark'])
+        self.assertEqual(rows[1]['upvote_count'], 1)
+        self.assertEqual(rows[0]['score'], 1)
+
+    def age_rows(self):
+        ''' Moves the times of the rows before the margin of the watermark '''
+        hour_ago = timezone.now() - datetime.timedelta(hours=1)
+        Feed.objects.update(updated=hour_ago)
+        Item.objects.update(updated=hour_ago)
+        Vote.objects.update(date=hour_ago)
+        Comment.objects.update(date=hour_ago)
+
+    def test_since(self):
+        ''' Tests only the rows changed after the watermark are exported again '''
+        self.age_rows()
+        watermark = quote(self.export()[-1]['until'])
+        self.assertEqual([row['type'] for row in self.export('/export.ndjson?since=' + watermark)],
+                         ['watermark'])
+
+        Vote.objects.create(item=self.items[2], user=self.user, positive=False)
+        rows = self.export('/export.ndjson?since=' + watermark)
+        self.assertEqual([row['type'] for row in rows], ['feed', 'item', 'vote', 'watermark'])
+        self.assertEqual(rows[1]['id'], self.items[2].pk)
+        self.assertEqual(rows[1]['downvote_count'], 1)
+
+    def test_late_rows(self):
+        ''' Tests rows with a time before the watermark are exported again '''
+        rows = self.export()
+        watermark = rows[-1]['until']
+        self.assertEqual(len(rows), 7)
+        rows = self.export('/export.ndjson?since=' + quote(watermark))
+        self.assertEqual([row['type'] for row in rows],
+                         ['feed'] + ['item'] * 3 + ['vote', 'comment', 'watermark'])
+
+    def test_deletions(self):
+        ''' Tests the rows removed after the watermark are exported as deletions '''
+        self.age_rows()
+        watermark = quote(self.export()[-1]['until'])
+        vote, comment = Vote.objects.get(), Comment.objects.get()
+        expected = [('vote', vote.pk), ('comment', comment.pk), ('item', self.items[1].pk)]
+        vote.delete()
+        self.items[1].delete()
+
+        rows = self.export('/export.ndjson?since=' + watermark)
+        deletions = [(row['table'], row['id']) for row in rows if row['type'] == 'deletion']
+        self.assertEqual(deletions, expected)
+        rows = self.export('/export.ndjson?tables=vote&since=' + watermark)
+        self.assertEqual([row['type'] for row in rows], ['deletion', 'watermark'])
+        rows = self.export()
+        self.assertNotIn('deletion', [row['type'] for row in rows])
+
+    def test_tables_and_gzip(self):
+        ''' Tests the export can be limited to some tables and compressed '''
+        rows = self.export('/export.ndjson?tables=item,comment', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual([row['type'] for row in rows], ['item'] * 3 + ['comment', 'watermark'])
+        response = self.client.get('/export.ndjson?tables=user')
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get('/export.ndjson?since=yesterday')
+        self.assertEqual(response.status_code, 400)
+
+    def test_command(self):
+        ''' Tests the command writes the same lines to a file '''
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'catalog.ndjson.gz')
+            call_command('export_catalog', '--gzip', '--table', 'vote', '--output', path, chunk_size=1)
+            with gzip.open(path) as output:
+                rows = [json.loads(line) for line in output]
+        self.assertEqual([row['type'] for row in rows], ['vote', 'watermark'])
+        self.assertEqual(rows[0]['item_id'], self.items[0].pk)
+
+    def test_command_stdout(self):
+        ''' Tests the command writes the lines to the stream it is given '''
+        output = StringIO()
+        call_command('export_catalog', '--table', 'comment', stdout=output)
+        rows = [json.loads(line) for line in output.getvalue().splitlines()]
+        self.assertEqual([row['type'] for row in rows], ['comment', 'watermark'])
+
+
+class TestVoteStates(TestCase):
+
+    def setUp(self):
+        ''' Creates items voted by the user and by others without fetching any feed '''
+        cache.clear()
+        self.user = User.objects.create_user('root', password='toor')
+        self.feed = Feed.objects.create(key='key', title='Feed', source=Config.YOUTUBE)
+        self.items = [Item.objects.create(key=f'item{i}', title='Item', feed=self.feed)
+                      for i in range(5)]
+        Vote.objects.create(item=self.items[0], user=self.user, positive=True)
+        Vote.objects.create(item=self.items[1], user=self.user, positive=False)
+        self.client.force_login(self.user)
+
+    def add_voters(self, count):
+        for i in range(count):
+            voter = User.objects.create_user(f'voter{User.objects.count()}')
+            for item in self.items:
+                Vote.objects.create(item=item, user=voter, positive=i % 2 == 0)
+
+    def test_vote_states(self):
+        ''' Tests the forms show the votes of the user '''
+        self.add_voters(2)
+        response = self.client.get(f'/feed/{self.feed.pk}')
+        self.assertContains(response, '<i class="material-icons">thumb_up</i>', count=1)
+        self.assertContains(response, '<i class="material-icons">thumb_down</i>', count=1)
+        self.assertEqual(response.context['vote_states'],
+                         {self.items[0].pk: True, self.items[1].pk: False})
+
+    def test_constant_queries(self):
+        ''' Tests the cost of the vote forms does not depend on the amount of votes '''
+        urls = ['/', f'/feed/{self.feed.pk}', f'/item/{self.items[0].pk}', f'/user/{self.user.username}']
+        self.add_voters(1)
+        few_votes = {}
+        for url in urls:
+            # Nothing is rendered from the cache
+            cache.clear()
+            with CaptureQueriesContext(connection) as queries:
+                self.client.get(url)
+            few_votes[url] = len(queries)
+
+        self.add_voters(10)
+        many_votes = {}
+        for url in urls:
+            cache.clear()
+            with CaptureQueriesContext(connection) as queries:
+                self.client.get(url)
+            many_votes[url] = len(queries)
+
+        self.assertEqual(few_votes, many_votes)
+
+
+class TestFragmentCache(TestCase):
+
+    def setUp(self):
+        ''' Creates a feed with items without fetching any feed '''
+        cache.clear()
+        self.user = User.objects.create_user('root', password='toor')
+        self.feed = Feed.objects.create(key='key', title='Feed', source=Config.YOUTUBE)
+        self.items = [Item.objects.create(key=f'item{i}', title=f'Item {i}', feed=self.feed)
+                      for i in range(5)]
+
+    def get(self, url, client=None, **headers):
+        client = client or self.client
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(url, **headers)
+        return response, len(queries)
+
+    def test_cached_rows(self):
+        ''' Tests the rows are rendered once and the page stays the same '''
+        first, first_queries = self.get('/feeds')
+        second, second_queries = self.get('/feeds')
+        self.assertLess(second_queries, first_queries)
+        # The csrf tokens are masked differently each time
+        token = re.compile(rb'value="[^"]{64}"')
+        self.assertEqual(token.sub(b'', first.content), token.sub(b'', second.content))
+
+    def test_changes(self):
+        ''' Tests the rows are rendered again when their data changes '''
+        self.client.force_login(self.user)
+        url = f'/feed/{self.feed.pk}'
+        self.client.get(url)
+
+        item = self.items[0]
+        item.title = 'Renamed'
+        item.save()
+        self.assertContains(self.client.get(url), 'Renamed')
+
+        self.client.post(f'/item/{item.pk}', {'action': 'upvote'})
+        self.assertContains(self.client.get(url), '<i class="material-icons">thumb_up</i>', count=1)
+        self.assertContains(self.client.get('/feeds'), 'Score: 1')
+
+        Item.objects.create(key='new', title='New', feed=self.feed)
+        self.assertContains(self.client.get('/feeds'), 'Total items: 6')
+
+    def test_viewer(self):
+        ''' Tests the rows depend on the user, the language and the votes of the user '''
+        url = f'/feed/{self.feed.pk}'
+        self.assertNotContains(self.client.get(url), 'vote-form')
+        self.assertContains(self.client.get(url, HTTP_ACCEPT_LANGUAGE='es'), 'Abrir en')
+        self.assertContains(self.client.get(url), 'Open in')
+
+        other = User.objects.create_user('other', password='other')
+        Vote.objects.create(item=self.items[0], user=other, positive=True)
+        self.client.force_login(other)
+        self.assertContains(self.client.get(url), '<i class="material-icons">thumb_up</i>', count=1)
+        self.client.force_login(self.user)
+        self.assertNotContains(self.client.get(url), '<i class="material-icons">thumb_up</i>')
+
+    def test_csrf_token(self):
+        ''' Tests the forms of cached rows carry the token of each user '''
+        url = f'/feed/{self.feed.pk}'
+        self.client.force_login(self.user)
+        self.client.get(url)
+
+        client = Client(enforce_csrf_checks=True)
+        client.force_login(self.user)
+        response = client.get(url)
+        self.assertNotContains(response, CSRF_PLACEHOLDER)
+        token = re.search(r'name="csrfmiddlewaretoken" value="([^"]+)"', response.content.decode()).group(1)
+        response = client.post(f'/item/{self.items[0].pk}',
+                               {'action': 'upvote', 'path': url, 'csrfmiddlewaretoken': token})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(Vote.objects.count(), 1)
+
+
+class TestPageCache(TestCase):
+
+    def setUp(self):
+        ''' Creates two feeds with items without fetching any feed '''
+        cache.clear()
+        reset_page_cache_stats()
+        self.user = User.objects.create_user('root', password='toor')
+        self.feeds = [Feed.objects.create(key=f'key{i}', title=f'Feed {i}', source=Config.YOUTUBE)
+                      for i in range(2)]
+        self.items = [Item.objects.create(key=f'item{i}', title=f'Item {i}', feed=feed)
+                      for feed in self.feeds for i in range(3)]
+
+    def assertCache(self, url, status, **headers):
+        response = self.client.get(url, **headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Cache'], status, url)
+        # Streamed pages are cached once they are sent
+        if response.streaming:
+            return b''.join(response.streaming_content)
+        return response.content
+
+    def test_hits(self):
+        ''' Tests anonymous requests are answered from the cache and counted '''
+        item = self.items[0]
+        urls = ['/', '/feeds', f'/feed/{self.feeds[0].pk}', f'/item/{item.pk}',
+                f'/feed/{self.feeds[0].pk}?page=1', '/feeds' + XML, '/feeds' + JSON]
+        for url in urls:
+            self.assertCache(url, 'MISS')
+        for url in urls:
+            self.assertCache(url, 'HIT')
+        self.assertCache('/', 'MISS', HTTP_ACCEPT_LANGUAGE='es')
+        self.assertEqual(page_cache_stats(), (len(urls), len(urls) + 1))
+
+        call_command('page_cache_stats', '--reset', stdout=StringIO())
+        self.assertEqual(page_cache_stats(), (0, 0))
+
+    def test_hits_flushed(self):
+        ''' Tests the requests are not counted in the shared cache one by one '''
+        page_cache_stats()
+        self.assertCache('/', 'MISS')
+        self.assertCache('/', 'HIT')
+        self.assertIsNone(cache.get(HITS_KEY))
+        self.assertEqual(page_cache_stats(), (1, 1))
+
+    def test_documents(self):
+        ''' Tests the cached documents are the same as the first ones '''
+        first = self.assertCache(f'/feed/{self.feeds[0].pk}' + XML, 'MISS')
+        second = self.assertCache(f'/feed/{self.feeds[0].pk}' + XML, 'HIT')
+        self.assertEqual(second, first)
+        ElementTree.fromstring(second)
+
+    def test_logged_in(self):
+        ''' Tests the pages of logged in users are not cached '''
+        self.client.force_login(self.user)
+        response = self.client.get('/')
+        self.assertNotIn('X-Cache', response)
+
+    def test_vote_purges(self):
+        ''' Tests a vote on an item purges its page, its feed page and the index '''
+        item = self.items[0]
+        other_feed = f'/feed/{self.feeds[1].pk}'
+        urls = ['/', '/feeds', f'/feed/{item.feed_id}', f'/item/{item.pk}']
+        for url in urls + [other_feed, f'/item/{self.items[1].pk}']:
+            self.client.get(url)
+
+        Vote.objects.create(item=item, user=self.user, positive=True)
+        for url in urls:
+            self.assertCache(url, 'MISS')
+        self.assertCache(other_feed, 'HIT')
+        self.assertIn(b'Item 0', self.client.get('/').content)
+
+    def test_csrf_token(self):
+        ''' Tests the forms of cached pages carry a token for each user '''
+        url = f'/feed/{self.feeds[0].pk}'
+        self.client.get(url)
+
+        client = Client(enforce_csrf_checks=True)
+        response = client.get(url)
+        self.assertEqual(response['X-Cache'], 'HIT')
+        self.assertNotContains(response, CSRF_PLACEHOLDER)
+        token = re.search(r'name="csrfmiddlewaretoken" value="([^"]+)"', response.content.decode()).group(1)
+        response = client.post(url, {'action': 'unchoose', 'csrfmiddlewaretoken': token})
+        self.assertEqual(response.status_code, 200)
+        self.feeds[0].refresh_from_db()
+        self.assertFalse(self.feeds[0].chosen)
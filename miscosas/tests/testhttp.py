@@ -0,0 +1,258 @@
+import gzip
+import os
+import tempfile
+import threading
+import zlib
+from io import BytesIO
+from time import monotonic
+from unittest.mock import patch
+from urllib.error import URLError, HTTPError
+
+from django.core.cache import cache
+from django.test import override_settings
+from PIL import Image
+
+from miscosas.apps import MisCosasConfig as Config
+from miscosas.feeds.feedhandler import FeedData
+from miscosas.feeds.httppool import ConnectionPool
+from miscosas.feeds.ratelimit import (RateLimiter, LIMITERS, set_rate_limit,
+                                      limiter_for, retry_after)
+from miscosas.imageproxy import trim_cache, check_public_url, LOW_WATER
+from miscosas.models import Feed, Item
+from miscosas.tests.base import SimpleTestCase, TestCase
+from miscosas.tests.stubserver import StubServer
+
+DOCUMENT = b"<feed><title>Stub</title></feed>" * 100
+
+
+class TestConnectionPool(SimpleTestCase):
+
+    def setUp(self):
+        self.server = StubServer().start()
+        self.server.set_document('/feed', DOCUMENT)
+        self.pool = ConnectionPool(maxsize=2, timeout=5)
+
+    def tearDown(self):
+        self.pool.clear()
+        self.server.stop()
+
+    def test_keep_alive(self):
+        ''' Tests consecutive requests reuse the same connection '''
+        for _ in range(5):
+            with self.pool.urlopen(self.server.url + '/feed') as response:
+                self.assertEqual(response.read(), DOCUMENT)
+
+        self.assertEqual(len(self.server.requests), 5)
+        self.assertEqual(len(self.server.clients), 1)
+
+    def test_pool_size(self):
+        ''' Tests parallel requests open several connections and keep only some '''
+        barrier = threading.Barrier(4)
+        responses = []
+
+        def request():
+            response = self.pool.urlopen(self.server.url + '/feed')
+            barrier.wait()
+            responses.append(response.read())
+
+        threads = [threading.Thread(target=request) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(responses, [DOCUMENT] * 4)
+        self.assertEqual(len(self.server.clients), 4)
+        self.assertEqual(sum(len(idle) for idle in self.pool._idle.values()), 2)
+
+    def test_gzip(self):
+        ''' Tests gzip responses are decompressed '''
+        self.server.set_document('/gzip', gzip.compress(DOCUMENT), **{'Content-Encoding': 'gzip'})
+        with self.pool.urlopen(self.server.url + '/gzip') as response:
+            self.assertEqual(response.read(), DOCUMENT)
+        self.assertEqual(self.server.requests[0][1]['Accept-Encoding'], 'gzip, deflate')
+
+    def test_deflate(self):
+        ''' Tests deflate responses are decompressed in chunks '''
+        self.server.set_document('/deflate', zlib.compress(DOCUMENT), **{'Content-Encoding': 'deflate'})
+        with self.pool.urlopen(self.server.url + '/deflate') as response:
+            chunks = iter(lambda: response.read(100), b'')
+            self.assertEqual(b''.join(chunks), DOCUMENT)
+
+    def test_redirect(self):
+        ''' Tests redirections are followed '''
+        self.server.set_document('/old', b'', 301, Location='/feed')
+        with self.pool.urlopen(self.server.url + '/old') as response:
+            self.assertEqual(response.read(), DOCUMENT)
+            self.assertEqual(response.url, self.server.url + '/feed')
+
+    def test_not_found(self):
+        ''' Tests error statuses raise HTTPError like urllib '''
+        with self.assertRaisesMessage(HTTPError, '404: Not Found'):
+            self.pool.urlopen(self.server.url + '/missing')
+
+    def test_no_server(self):
+        ''' Tests connection problems raise URLError like urllib '''
+        self.server.stop()
+        with self.assertRaises(URLError):
+            self.pool.urlopen(self.server.url + '/feed')
+        self.server = StubServer().start()
+
+
+
+class TestRateLimits(SimpleTestCase):
+
+    def setUp(self):
+        self.server = StubServer().start()
+        self.server.set_document('/feed', DOCUMENT)
+        self.pool = ConnectionPool(maxsize=2, timeout=5)
+        self.limiters = patch.dict(LIMITERS)
+        self.limiters.start()
+
+    def tearDown(self):
+        self.limiters.stop()
+        self.pool.clear()
+        self.server.stop()
+
+    def test_token_bucket(self):
+        ''' Tests requests over the rate wait for their turn '''
+        limiter = RateLimiter(rate=20, burst=2)
+        start = monotonic()
+        for _ in range(6):
+            limiter.acquire()
+        self.assertGreaterEqual(monotonic() - start, 4 / 20 * 0.9)
+
+        limiter.pause(0.2)
+        start = monotonic()
+        limiter.acquire()
+        self.assertGreaterEqual(monotonic() - start, 0.2 * 0.9)
+
+    def test_source_limit(self):
+        ''' Tests the sources limit the requests to their host '''
+        FeedData('', '', self.server.url + '/{feed}', Config.YOUTUBE, None, '', rate_limit=(10, 1))
+        start = monotonic()
+        for _ in range(4):
+            with self.pool.urlopen(self.server.url + '/feed') as response:
+                response.read()
+        self.assertGreaterEqual(monotonic() - start, 3 / 10 * 0.9)
+        self.assertIsNone(limiter_for('http://other.host/feed'))
+
+    def test_retry_after(self):
+        ''' Tests busy servers are asked again after the time they give '''
+        set_rate_limit(self.server.url, 100, 1)
+        self.server.set_document('/busy', b'Busy', 429, **{'Retry-After': '1'})
+        threading.Timer(0.3, self.server.set_document, ['/busy', DOCUMENT]).start()
+        start = monotonic()
+        with self.pool.urlopen(self.server.url + '/busy') as response:
+            self.assertEqual(response.read(), DOCUMENT)
+        self.assertGreaterEqual(monotonic() - start, 0.9)
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_long_retry_after(self):
+        ''' Tests requests are not made again if the server asks to wait too long '''
+        self.server.set_document('/busy', b'Busy', 503, **{'Retry-After': '3600'})
+        with self.assertRaisesMessage(HTTPError, '503'):
+            self.pool.urlopen(self.server.url + '/busy')
+        self.assertEqual(len(self.server.requests), 1)
+        self.assertEqual(retry_after({'Retry-After': 'Wed, 21 Oct 2015 07:28:00 GMT'}), 0)
+
+
+class TestItemPicture(TestCase):
+
+    def setUp(self):
+        ''' Serves a picture for an item from the stub server '''
+        cache.clear()
+        self.server = StubServer().start()
+        content = BytesIO()
+        Image.new('RGB', (1600, 1200), 'teal').save(content, 'jpeg')
+        self.server.set_document('/picture.jpg', content.getvalue(), **{'Content-Type': 'image/jpeg'})
+        self.directory = tempfile.TemporaryDirectory()
+        self.settings = override_settings(IMAGE_CACHE_DIR=self.directory.name,
+                                          IMAGE_PROXY_ALLOW_PRIVATE=True)
+        self.settings.enable()
+        feed = Feed.objects.create(key='tag', title='Feed', source=Config.FLICKR)
+        self.item = Item.objects.create(key='photo', title='Photo', feed=feed,
+                                        picture=self.server.url + '/picture.jpg')
+
+    def tearDown(self):
+        self.settings.disable()
+        self.directory.cleanup()
+        self.server.stop()
+
+    def test_resized(self):
+        ''' Tests the picture is resized and fetched only once '''
+        for _ in range(3):
+            response = self.client.get(f'/img/{self.item.pk}/320')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response['Content-Type'], 'image/jpeg')
+            with Image.open(BytesIO(b''.join(response.streaming_content))) as picture:
+                self.assertEqual(picture.size, (320, 240))
+        self.assertEqual(len(self.server.requests), 1)
+        self.assertIn('max-age', response['Cache-Control'])
+
+    def test_not_modified(self):
+        ''' Tests a picture the browser already has is not sent again '''
+        etag = self.client.get(f'/img/{self.item.pk}/160')['ETag']
+        response = self.client.get(f'/img/{self.item.pk}/160', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+    def test_wrong_pictures(self):
+        ''' Tests unknown sizes, items and pictures are not found '''
+        self.assertEqual(self.client.get(f'/img/{self.item.pk}/100').status_code, 404)
+        self.assertEqual(self.client.get('/img/1000/160').status_code, 404)
+        Item.objects.filter(pk=self.item.pk).update(picture=self.server.url + '/missing.jpg')
+        for _ in range(2):
+            self.assertEqual(self.client.get(f'/img/{self.item.pk}/160').status_code, 404)
+        # Failures are remembered for a while
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_size_budget(self):
+        ''' Tests the least recently used pictures are removed first '''
+        paths = []
+        for size in (160, 320, 640):
+            self.client.get(f'/img/{self.item.pk}/{size}')
+            paths += [os.path.join(directory, name)
+                      for directory, _, names in os.walk(self.directory.name)
+                      for name in names if os.path.join(directory, name) not in paths]
+        # The middle one was used the longest ago, the first one was used last
+        os.utime(paths[1], (1000, 1000))
+        os.utime(paths[2], (2000, 2000))
+        kept = os.path.getsize(paths[0]) + os.path.getsize(paths[2])
+        trim_cache(int(kept / LOW_WATER) + 1)
+        self.assertEqual([os.path.exists(path) for path in paths], [True, False, True])
+
+    def test_running_size(self):
+        ''' Tests the directory is only walked again once it is too big '''
+        with patch('os.walk', wraps=os.walk) as walk:
+            for size in (160, 320, 640):
+                self.client.get(f'/img/{self.item.pk}/{size}')
+        self.assertEqual(walk.call_count, 1)
+
+        # Only the new picture fits
+        smallest = min(os.path.getsize(os.path.join(directory, name))
+                       for directory, _, names in os.walk(self.directory.name) for name in names)
+        self.server.set_document('/other.jpg', self.server.documents['/picture.jpg'][0])
+        Item.objects.filter(pk=self.item.pk).update(picture=self.server.url + '/other.jpg')
+        with override_settings(IMAGE_CACHE_MAX_BYTES=int(smallest / LOW_WATER) + 1), \
+                patch('os.walk', wraps=os.walk) as walk:
+            self.assertEqual(self.client.get(f'/img/{self.item.pk}/160').status_code, 200)
+        self.assertEqual(walk.call_count, 1)
+        self.assertEqual(len([name for _, _, names in os.walk(self.directory.name) for name in names]), 1)
+
+    def test_removed_copy(self):
+        ''' Tests the original picture is linked if its copy is removed before it is sent '''
+        with patch('miscosas.views.proxied_picture', return_value=os.path.join(self.directory.name, 'gone')):
+            response = self.client.get(f'/img/{self.item.pk}/160')
+        self.assertRedirects(response, self.item.picture, fetch_redirect_response=False)
+
+    def test_private_addresses(self):
+        ''' Tests pictures are only downloaded from public http addresses '''
+        with override_settings(IMAGE_PROXY_ALLOW_PRIVATE=False):
+            self.assertEqual(self.client.get(f'/img/{self.item.pk}/160').status_code, 404)
+            for url in ('http://127.0.0.1/a.jpg', 'http://10.1.2.3/a.jpg', 'http://169.254.169.254/',
+                        'http://[::1]/a.jpg', 'http://localhost/a.jpg', 'file:///etc/passwd'):
+                with self.assertRaises(URLError):
+                    check_public_url(url)
+            check_public_url('https://93.184.216.34/a.jpg')
+        self.assertEqual(len(self.server.requests), 0)
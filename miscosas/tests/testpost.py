@@ -1,11 +1,21 @@
+import os
+import tempfile
+from io import BytesIO
 from time import sleep
+from unittest import mock
 
-from django.test import TestCase
+from django.test import override_settings
 from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.storage import FileSystemStorage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from PIL import Image
 
 from miscosas.forms import FeedForm
-from miscosas.models import Item, Feed, Comment, Vote
+from miscosas.models import Item, Feed, FeedJob, Comment, Vote, Profile, rebuild_counters
+from miscosas.feeds.jobs import run_due_jobs
 from miscosas.apps import MisCosasConfig as Config
+from miscosas.tests.base import TestCase
 
 VALID_YOUTUBE_KEY = "UC300utwSVAYOoRLEqmsprfg"
 INVALID_YOUTUBE_KEY = "4v56789r384rgfrtg"
@@ -26,20 +36,30 @@ VALID_SPOTIFY_KEY = "Green Day"
 INVALID_SPOTIFY_KEY = "iej%n4u5t(549.gjhg"
 
 
+@override_settings(FEED_JOB_ATTEMPTS=1)
 class TestPostFeedViews(TestCase):
 
     def setUp(self):
+        cache.clear()
         # Some APIs refuse the connection if too many requests
         # are made too close together
         sleep(1)
 
+    def post_feed(self, form):
+        ''' Posts a feed, loads it like a worker and gets the page of the job '''
+        response = self.client.post('/feeds', form)
+        job = FeedJob.objects.get()
+        self.assertRedirects(response, f'/job/{job.pk}', fetch_redirect_response=False)
+        run_due_jobs()
+        return self.client.get(f'/job/{job.pk}')
+
     def test_feed_youtube_right(self):
         ''' Tests posting the feed form with a valid key '''
         form_data = {'key': VALID_YOUTUBE_KEY, 'source': Config.YOUTUBE}
         form = FeedForm(data=form_data)
         self.assertTrue(form.is_valid())
 
-        response = self.client.post('/feeds', form.cleaned_data)
+        response = self.post_feed(form.cleaned_data)
         self.assertRedirects(response, '/feed/1')
         self.assertEqual(Feed.objects.count(), 1)
         self.assertEqual(Item.objects.count(), 15)
@@ -50,7 +70,7 @@ class TestPostFeedViews(TestCase):
         form = FeedForm(form_data)
         self.assertTrue(form.is_valid())
 
-        response = self.client.post('/feeds', form.cleaned_data)
+        response = self.post_feed(form.cleaned_data)
         self.assertEqual(response.status_code, 404)
         self.assertIn('miscosas/content/not_found.html',
             [t.name for t in response.templates])
@@ -61,7 +81,7 @@ class TestPostFeedViews(TestCase):
         form = FeedForm(data=form_data)
         self.assertTrue(form.is_valid())
 
-        response = self.client.post('/feeds', form.cleaned_data)
+        response = self.post_feed(form.cleaned_data)
         self.assertRedirects(response, '/feed/1')
         self.assertEqual(Feed.objects.count(), 1)
         self.assertEqual(Item.objects.count(), 15)
@@ -72,7 +92,7 @@ class TestPostFeedViews(TestCase):
         form = FeedForm(form_data)
         self.assertTrue(form.is_valid())
 
-        response = self.client.post('/feeds', form.cleaned_data)
+        response = self.post_feed(form.cleaned_data)
         self.assertEqual(response.status_code, 404)
         self.assertIn('miscosas/content/not_found.html',
             [t.name for t in response.templates])
@@ -83,7 +103,7 @@ class TestPostFeedViews(TestCase):
         form = FeedForm(data=form_data)
         self.assertTrue(form.is_valid())
 
-        response = self.client.post('/feeds', form.cleaned_data)
+        response = self.post_feed(form.cleaned_data)
         self.assertRedirects(response, '/feed/1')
         self.assertEqual(Feed.objects.count(), 1)
         self.assertEqual(Item.objects.count(), 26)
@@ -94,7 +114,7 @@ class TestPostFeedViews(TestCase):
         form = FeedForm(form_data)
         self.assertTrue(form.is_valid())
 
-        response = self.client.post('/feeds', form.cleaned_data)
+        response = self.post_feed(form.cleaned_data)
         self.assertEqual(response.status_code, 404)
         self.assertIn('miscosas/content/not_found.html',
             [t.name for t in response.templates])
@@ -105,7 +125,7 @@ class TestPostFeedViews(TestCase):
         form = FeedForm(data=form_data)
         self.assertTrue(form.is_valid())
 
-        response = self.client.post('/feeds', form.cleaned_data)
+        response = self.post_feed(form.cleaned_data)
         self.assertRedirects(response, '/feed/1')
         self.assertEqual(Feed.objects.count(), 1)
         self.assertEqual(Item.objects.count(), 20)
@@ -116,7 +136,7 @@ class TestPostFeedViews(TestCase):
         form = FeedForm(form_data)
         self.assertTrue(form.is_valid())
 
-        response = self.client.post('/feeds', form.cleaned_data)
+        response = self.post_feed(form.cleaned_data)
         self.assertEqual(response.status_code, 404)
         self.assertIn('miscosas/content/not_found.html',
             [t.name for t in response.templates])
@@ -127,7 +147,7 @@ class TestPostFeedViews(TestCase):
         form = FeedForm(data=form_data)
         self.assertTrue(form.is_valid())
 
-        response = self.client.post('/feeds', form.cleaned_data)
+        response = self.post_feed(form.cleaned_data)
         self.assertRedirects(response, '/feed/1')
         self.assertEqual(Feed.objects.count(), 1)
         self.assertEqual(Item.objects.count(), 14)
@@ -138,7 +158,7 @@ class TestPostFeedViews(TestCase):
         form = FeedForm(form_data)
         self.assertTrue(form.is_valid())
 
-        response = self.client.post('/feeds', form.cleaned_data)
+        response = self.post_feed(form.cleaned_data)
         self.assertEqual(response.status_code, 404)
         self.assertIn('miscosas/content/not_found.html',
             [t.name for t in response.templates])
@@ -149,7 +169,7 @@ class TestPostFeedViews(TestCase):
         form = FeedForm(data=form_data)
         self.assertTrue(form.is_valid())
 
-        response = self.client.post('/feeds', form.cleaned_data)
+        response = self.post_feed(form.cleaned_data)
         self.assertRedirects(response, '/feed/1')
         self.assertEqual(Feed.objects.count(), 1)
         self.assertEqual(Item.objects.count(), 10)
@@ -160,7 +180,7 @@ class TestPostFeedViews(TestCase):
         form = FeedForm(form_data)
         self.assertTrue(form.is_valid())
 
-        response = self.client.post('/feeds', form.cleaned_data)
+        response = self.post_feed(form.cleaned_data)
         self.assertEqual(response.status_code, 404)
         self.assertIn('miscosas/content/not_found.html',
             [t.name for t in response.templates])
@@ -251,6 +271,7 @@ class TestPostVoteForm(TestCase):
 
     def setUp(self):
         ''' Set up some items so that votes can be added '''
+        cache.clear()
         form = {'key': VALID_YOUTUBE_KEY, 'source': Config.YOUTUBE}
         self.client.post('/feeds', form)
         self.user = User.objects.create_user('root', password='toor')
@@ -261,6 +282,7 @@ class TestPostVoteForm(TestCase):
         ''' Tests voting without being logged in '''
         self.client.logout()
         self.client.post(f'/item/{self.item.pk}', {'action': 'downvote'})
+        self.item.refresh_from_db()
         self.assertEqual(Vote.objects.count(), 0)
         self.assertEqual(self.item.upvote_count, 0)
         self.assertEqual(self.item.downvote_count, 0)
@@ -268,6 +290,8 @@ class TestPostVoteForm(TestCase):
     def test_vote_first_time(self):
         ''' Tests voting without having voted before '''
         self.client.post(f'/item/{self.item.pk}', {'action': 'upvote'})
+        self.item.refresh_from_db()
+        self.user.profile.refresh_from_db()
         self.assertEqual(Vote.objects.count(), 1)
         self.assertEqual(Vote.objects.get().item, self.item)
         self.assertEqual(Vote.objects.get().user, self.user)
@@ -279,6 +303,8 @@ class TestPostVoteForm(TestCase):
         ''' Tests voting twice the same item '''
         self.client.post(f'/item/{self.item.pk}', {'action': 'upvote'})
         self.client.post(f'/item/{self.item.pk}', {'action': 'upvote'})
+        self.item.refresh_from_db()
+        self.user.profile.refresh_from_db()
         self.assertEqual(self.item.upvote_count, 0)
         self.assertEqual(self.item.downvote_count, 0)
         self.assertEqual(self.user.profile.vote_count, 0)
@@ -293,6 +319,9 @@ class TestPostVoteForm(TestCase):
         self.assertTrue(Vote.objects.get().positive)
 
         self.assertEqual(Vote.objects.count(), 1)
+        self.item.refresh_from_db()
+        self.assertEqual(self.item.upvote_count, 1)
+        self.assertEqual(self.item.downvote_count, 0)
 
     def test_vote_invalid_item(self):
         ''' Tests voting on an invalid item '''
@@ -300,6 +329,76 @@ class TestPostVoteForm(TestCase):
         self.assertEqual(Vote.objects.count(), 0)
 
 
+class TestPostCounters(TestCase):
+
+    def setUp(self):
+        ''' Creates an item without fetching any feed '''
+        self.feed = Feed.objects.create(key='key', title='Feed', source=Config.YOUTUBE)
+        self.item = Item.objects.create(key='item', title='Item', feed=self.feed)
+        self.user = User.objects.create_user('root', password='toor')
+        self.client.force_login(self.user)
+
+    def assertCounters(self, upvotes, downvotes, comments):
+        item = Item.objects.get(pk=self.item.pk)
+        profile = Profile.objects.get(user=self.user)
+        self.assertEqual(item.upvote_count, upvotes)
+        self.assertEqual(item.downvote_count, downvotes)
+        self.assertEqual(Feed.objects.get(pk=self.feed.pk).score, upvotes - downvotes)
+        self.assertEqual(profile.vote_count, upvotes + downvotes)
+        self.assertEqual(profile.comment_count, comments)
+
+    def test_vote_counters(self):
+        ''' Tests counters follow votes being made, flipped and removed '''
+        url = f'/item/{self.item.pk}'
+        self.client.post(url, {'action': 'upvote', 'path': url})
+        self.assertCounters(1, 0, 0)
+        self.client.post(url, {'action': 'downvote', 'path': url})
+        self.assertCounters(0, 1, 0)
+        self.client.post(url, {'action': 'downvote', 'path': url})
+        self.assertCounters(0, 0, 0)
+
+    def test_comment_counters(self):
+        ''' Tests counters follow comments being added and deleted '''
+        url = f'/item/{self.item.pk}'
+        self.client.post(url, {'action': 'comment', 'title': 'a', 'content': 'b', 'path': url})
+        self.assertCounters(0, 0, 1)
+        comment = Comment.objects.get()
+        self.client.post(url, {'action': 'delete', 'pk': comment.pk, 'path': url})
+        self.assertCounters(0, 0, 0)
+
+    def test_rebuild_counters(self):
+        ''' Tests counters are recalculated from the existing rows '''
+        Vote.objects.create(item=self.item, user=self.user, positive=False)
+        Comment.objects.create(item=self.item, user=self.user, title='a', content='b')
+        Item.objects.update(upvote_count=5, downvote_count=5)
+        Feed.objects.update(score=3, item_count=4)
+        Profile.objects.update(vote_count=0, comment_count=9)
+
+        rebuild_counters()
+        self.assertCounters(0, 1, 1)
+        self.assertEqual(Feed.objects.get(pk=self.feed.pk).item_count, 1)
+
+    def test_item_count(self):
+        ''' Tests the item counter of the feed follows items being added and deleted '''
+        Item.objects.create(key='other', title='Other', feed=self.feed)
+        self.assertEqual(Feed.objects.get(pk=self.feed.pk).item_count, 2)
+        self.item.delete()
+        self.assertEqual(Feed.objects.get(pk=self.feed.pk).item_count, 1)
+
+    def test_stale_save(self):
+        ''' Tests saving instances loaded before a vote keeps the counters '''
+        url = f'/item/{self.item.pk}'
+        self.client.post(url, {'action': 'upvote', 'path': url})
+
+        self.item.title = 'Changed'
+        self.item.save()
+        self.feed.chosen = False
+        self.feed.save()
+        self.user.save()
+        self.assertCounters(1, 0, 0)
+        self.assertEqual(Item.objects.get(pk=self.item.pk).title, 'Changed')
+
+
 class TestPostProfileForm(TestCase):
 
     def setUp(self):
@@ -342,10 +441,87 @@ class TestPostProfileForm(TestCase):
         self.assertEqual(profile.theme, Config.LIGHTMODE)
 
 
+class TestPostProfilePicture(TestCase):
+
+    def setUp(self):
+        ''' Uploads the pictures to a temporary directory '''
+        self.media = tempfile.TemporaryDirectory()
+        self.settings = override_settings(MEDIA_ROOT=self.media.name)
+        self.settings.enable()
+        self.user = User.objects.create_user('root', password='toor')
+        self.client.force_login(self.user)
+        cache.clear()
+
+    def tearDown(self):
+        self.settings.disable()
+        self.media.cleanup()
+
+    def upload(self, name='picture.png', size=(800, 600), color='teal'):
+        content = BytesIO()
+        Image.new('RGBA', size, color).save(content, 'png')
+        form = {
+            '_picture': SimpleUploadedFile(name, content.getvalue(), 'image/png'),
+            'theme': Config.LIGHTMODE,
+            'font_size': Config.MEDIUM_FONT,
+        }
+        return self.client.post('/user/' + self.user.username, form)
+
+    def test_thumbnails(self):
+        ''' Tests an uploaded picture gets square thumbnails in every format '''
+        self.assertEqual(self.upload().status_code, 200)
+        profile = Profile.objects.get(user=self.user)
+        self.assertEqual(sorted(profile.thumbnails), ['128', '40', '512'])
+        for size, formats in profile.thumbnails.items():
+            for image_format, name in formats.items():
+                self.assertIn(profile.picture_hash, name)
+                with Image.open(os.path.join(self.media.name, name)) as thumbnail:
+                    self.assertEqual(thumbnail.size, (int(size), int(size)))
+                    self.assertEqual(thumbnail.format.lower(), image_format)
+
+    def test_same_content(self):
+        ''' Tests pictures with the same content share their thumbnails '''
+        self.upload()
+        first = Profile.objects.get(user=self.user).thumbnails
+        self.upload('other.png')
+        self.assertEqual(Profile.objects.get(user=self.user).thumbnails, first)
+
+    def test_old_thumbnails(self):
+        ''' Tests the thumbnails of a picture are deleted once no profile has it '''
+        self.upload()
+        first = Profile.objects.get(user=self.user).thumbnails['40']['jpeg']
+        self.upload(color='navy')
+        second = Profile.objects.get(user=self.user).thumbnails['40']['jpeg']
+        self.assertFalse(os.path.exists(os.path.join(self.media.name, first)))
+        self.assertTrue(os.path.exists(os.path.join(self.media.name, second)))
+
+        self.user.delete()
+        self.assertFalse(os.path.exists(os.path.join(self.media.name, second)))
+
+    def test_user_list(self):
+        ''' Tests the user list shows the small thumbnails without reading files '''
+        self.upload()
+        profile = Profile.objects.get(user=self.user)
+        self.client.logout()
+        with mock.patch('os.path.isfile') as isfile, \
+                mock.patch.object(FileSystemStorage, 'exists') as exists:
+            response = self.client.get('/users')
+        self.assertFalse(isfile.called or exists.called)
+        self.assertContains(response, '/media/' + profile.thumbnails['40']['jpeg'])
+        self.assertContains(response, '/media/' + profile.thumbnails['128']['webp'] + ' 2x')
+        self.assertNotContains(response, '/media/' + profile.picture + "'")
+
+    def test_no_picture(self):
+        ''' Tests the default picture is shown before any upload '''
+        response = self.client.get('/user/' + self.user.username)
+        self.assertContains(response, '/media/' + Profile.DEFAULT_PICTURE)
+        self.assertNotContains(response, 'image/webp')
+
+
 class TestPostFeedChoose(TestCase):
 
     def setUp(self):
         ''' Set up some feeds so that votes can be added '''
+        cache.clear()
         form = {'key': VALID_YOUTUBE_KEY, 'source': Config.YOUTUBE}
         self.client.post('/feeds', form)
         form = {'key': VALID_LAST_FM_KEY, 'source': Config.LASTFM}
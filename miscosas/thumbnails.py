@@ -0,0 +1,87 @@
+"""
+Fixed size copies of the profile pictures, made when they are uploaded
+"""
+
+import hashlib
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+
+# Widths of the square thumbnails, in pixels
+THUMBNAIL_SIZES = (40, 128, 512)
+# Formats of each thumbnail, the first one is understood by every browser
+THUMBNAIL_FORMATS = {
+    'jpeg': {'extension': 'jpg', 'quality': 85, 'optimize': True, 'progressive': True},
+    'webp': {'extension': 'webp', 'quality': 80, 'method': 4},
+}
+THUMBNAIL_DIR = 'thumbnails'
+
+
+def picture_hash(file) -> str:
+    """Hash of the content of a file, which names its thumbnails."""
+    digest = hashlib.sha256()
+    file.seek(0)
+    for chunk in iter(lambda: file.read(64 * 1024), b''):
+        digest.update(chunk)
+    file.seek(0)
+    return digest.hexdigest()[:32]
+
+
+def thumbnail_name(content_hash: str, size: int, image_format: str) -> str:
+    extension = THUMBNAIL_FORMATS[image_format]['extension']
+    return f'{THUMBNAIL_DIR}/{content_hash}-{size}.{extension}'
+
+
+def make_thumbnails(file, storage=default_storage):
+    """Stores the thumbnails of a picture file and returns its hash
+    and a map of sizes to the names of each format.
+
+    Pictures with the same content share their thumbnails,
+    so the ones that are already stored are not made again."""
+    content_hash = picture_hash(file)
+    names = {str(size): {image_format: thumbnail_name(content_hash, size, image_format)
+                         for image_format in THUMBNAIL_FORMATS}
+             for size in THUMBNAIL_SIZES}
+    if all(storage.exists(name) for formats in names.values() for name in formats.values()):
+        return content_hash, names
+
+    with Image.open(file) as image:
+        # Photos from phones are often stored sideways
+        image = ImageOps.exif_transpose(image)
+        if image.mode in ('RGBA', 'LA', 'P'):
+            image = image.convert('RGBA')
+            background = Image.new('RGBA', image.size, 'white')
+            image = Image.alpha_composite(background, image)
+        image = image.convert('RGB')
+
+        for size in THUMBNAIL_SIZES:
+            thumbnail = ImageOps.fit(image, (size, size), Image.LANCZOS)
+            for image_format, options in THUMBNAIL_FORMATS.items():
+                name = names[str(size)][image_format]
+                if storage.exists(name):
+                    continue
+                options = {key: value for key, value in options.items() if key != 'extension'}
+                output = BytesIO()
+                thumbnail.save(output, image_format, **options)
+                storage.save(name, ContentFile(output.getvalue()))
+    file.seek(0)
+    return content_hash, names
+
+
+def delete_thumbnails(thumbnails: dict, storage=default_storage):
+    """Deletes the files of a map of thumbnails made by make_thumbnails."""
+    for formats in thumbnails.values():
+        for name in formats.values():
+            storage.delete(name)
+
+
+def nearest_thumbnail(thumbnails: dict, width: int, image_format='jpeg'):
+    """Name of the smallest thumbnail at least as wide as width,
+    or the largest one, None if there are no thumbnails."""
+    sizes = sorted(int(size) for size in thumbnails)
+    if not sizes:
+        return None
+    size = next((size for size in sizes if size >= width), sizes[-1])
+    return thumbnails[str(size)][image_format]
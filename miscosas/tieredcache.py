@@ -0,0 +1,288 @@
+"""
+Cache backend that keeps the entries each process uses
+in a small local cache in front of a shared one
+"""
+
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.base import BaseCache, DEFAULT_TIMEOUT
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files import locks
+
+# Keys of the shared cache that record the changed keys, so that the
+# other processes remove them from their local caches
+JOURNAL_SEQUENCE = 'tiered:journal'
+JOURNAL_ENTRY = 'tiered:journal:{}'
+
+# Backends whose incr reads the value and writes it apart, two processes
+# could take the same entry of the journal and one change would be lost,
+# so the journal is numbered while holding a lock on a file
+NON_ATOMIC_BACKENDS = (
+    'django.core.cache.backends.filebased.FileBasedCache',
+    'django.core.cache.backends.db.DatabaseCache',
+)
+FILE_BACKEND = 'django.core.cache.backends.filebased.FileBasedCache'
+
+# Lock file of the journal in the directory of a shared file cache,
+# which only removes its own files when it is cleared
+JOURNAL_LOCK_FILE = 'tiered-journal.lock'
+
+# Beyond this amount of changes since the last time a
+# process read the journal it empties its local cache
+MAX_JOURNAL_READ = 1000
+
+# The local caches of the process, by location
+_tiers = {}
+_tiers_lock = threading.Lock()
+
+_missing = object()
+
+
+class LocalTier:
+    """Least recently used entries of the shared cache, they are
+    kept for a short time even if nothing says they changed."""
+
+    def __init__(self, max_entries, timeout):
+        self.max_entries = max_entries
+        self.timeout = timeout
+        # Keys and their expiration time and pickled value
+        self.entries = OrderedDict()
+        self.lock = threading.RLock()
+        # Last entry of the journal that was read and when
+        self.sequence = None
+        self.synced = 0.0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return _missing
+            expiry, data = entry
+            if expiry <= time.time():
+                del self.entries[key]
+                return _missing
+            self.entries.move_to_end(key)
+        return pickle.loads(data)
+
+    def set(self, key, value, expiry=None):
+        """Keeps a value until expiry, an absolute time,
+        or the timeout of the local cache if it is sooner."""
+        local_expiry = time.time() + self.timeout
+        if expiry is not None:
+            local_expiry = min(local_expiry, expiry)
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        with self.lock:
+            self.entries[key] = (local_expiry, data)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def discard(self, keys):
+        with self.lock:
+            for key in keys:
+                self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class TieredCache(BaseCache):
+    """Reads go to a local cache of the process before the shared cache,
+    writes go to both and are written in a journal in the shared cache.
+
+    Every SYNC_INTERVAL seconds the journal is read and the keys that
+    other processes changed are removed from the local cache.
+
+    The entries of the journal are numbered with the incr of the shared
+    cache, which is atomic in memcached or redis. The file and database
+    caches are incremented while holding a lock on the JOURNAL_LOCK file,
+    which is in the directory of a file cache unless it is given.
+
+    Options:
+        SHARED: alias of the shared cache in CACHES
+        LOCAL_MAX_ENTRIES: entries kept in the local cache
+        LOCAL_TIMEOUT: seconds an entry is kept in the local cache
+        SYNC_INTERVAL: seconds between reads of the journal
+        JOURNAL_TIMEOUT: seconds the entries of the journal are kept
+        JOURNAL_LOCK: path of the lock file of the journal
+    """
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self._shared_alias = options.get('SHARED', 'shared')
+        self._journal_lock = options.get('JOURNAL_LOCK')
+        shared_params = settings.CACHES.get(self._shared_alias, {})
+        if self._journal_lock is None and shared_params.get('BACKEND') in NON_ATOMIC_BACKENDS:
+            if shared_params['BACKEND'] != FILE_BACKEND:
+                raise ImproperlyConfigured(
+                    f"The shared cache '{self._shared_alias}' needs a JOURNAL_LOCK file")
+            self._journal_lock = os.path.join(shared_params['LOCATION'], JOURNAL_LOCK_FILE)
+        self._sync_interval = options.get('SYNC_INTERVAL', 1)
+        self._journal_timeout = options.get('JOURNAL_TIMEOUT', 60)
+        with _tiers_lock:
+            if location not in _tiers:
+                _tiers[location] = LocalTier(options.get('LOCAL_MAX_ENTRIES', 1000),
+                                             options.get('LOCAL_TIMEOUT', 5))
+            self._tier = _tiers[location]
+
+    @property
+    def shared(self):
+        return caches[self._shared_alias]
+
+    def _key(self, key, version):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        return key
+
+    def _timeout(self, timeout):
+        return self.default_timeout if timeout is DEFAULT_TIMEOUT else timeout
+
+    def get(self, key, default=None, version=None):
+        self._sync()
+        key = self._key(key, version)
+        value = self._tier.get(key)
+        if value is _missing:
+            value = self.shared.get(key, _missing)
+            if value is _missing:
+                return default
+            self._tier.set(key, value)
+        return value
+
+    def get_many(self, keys, version=None):
+        self._sync()
+        keys = {self._key(key, version): key for key in keys}
+        found = {}
+        for key in keys:
+            value = self._tier.get(key)
+            if value is not _missing:
+                found[key] = value
+        missing = [key for key in keys if key not in found]
+        if missing:
+            for key, value in self.shared.get_many(missing).items():
+                self._tier.set(key, value)
+                found[key] = value
+        return {keys[key]: value for key, value in found.items()}
+
+    def has_key(self, key, version=None):
+        return self.get(key, _missing, version=version) is not _missing
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self._key(key, version)
+        self.shared.set(key, value, self._timeout(timeout))
+        self._tier.set(key, value, self.get_backend_timeout(timeout))
+        self._publish([key])
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self._key(key, version)
+        if not self.shared.add(key, value, self._timeout(timeout)):
+            return False
+        self._tier.set(key, value, self.get_backend_timeout(timeout))
+        self._publish([key])
+        return True
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        data = {self._key(key, version): (key, value) for key, value in data.items()}
+        failed = set(self.shared.set_many(
+            {key: value for key, (_, value) in data.items()}, self._timeout(timeout)))
+        expiry = self.get_backend_timeout(timeout)
+        for key, (_, value) in data.items():
+            if key not in failed:
+                self._tier.set(key, value, expiry)
+        self._publish(list(data))
+        return [data[key][0] for key in failed]
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        return self.shared.touch(self._key(key, version), self._timeout(timeout))
+
+    def incr(self, key, delta=1, version=None):
+        key = self._key(key, version)
+        value = self.shared.incr(key, delta)
+        self._tier.set(key, value)
+        self._publish([key])
+        return value
+
+    def delete(self, key, version=None):
+        key = self._key(key, version)
+        deleted = self.shared.delete(key)
+        self._tier.discard([key])
+        self._publish([key])
+        return deleted
+
+    def delete_many(self, keys, version=None):
+        keys = [self._key(key, version) for key in keys]
+        self.shared.delete_many(keys)
+        self._tier.discard(keys)
+        self._publish(keys)
+
+    def clear(self):
+        # The journal goes too, which makes every process empty its local cache
+        self.shared.clear()
+        with self._tier.lock:
+            self._tier.clear()
+            self._tier.sequence = 0
+
+    def _publish(self, keys):
+        """Writes changed keys in the journal."""
+        shared = self.shared
+        if self._journal_lock is None:
+            last = self._reserve(len(keys))
+        else:
+            os.makedirs(os.path.dirname(self._journal_lock), exist_ok=True)
+            with open(self._journal_lock, 'ab') as lock:
+                locks.lock(lock, locks.LOCK_EX)
+                try:
+                    last = self._reserve(len(keys))
+                finally:
+                    locks.unlock(lock)
+        first = last - len(keys) + 1
+        shared.set_many({JOURNAL_ENTRY.format(first + i): key for i, key in enumerate(keys)},
+                        self._journal_timeout)
+        with self._tier.lock:
+            # The local cache already has these changes
+            if self._tier.sequence == first - 1:
+                self._tier.sequence = last
+
+    def _reserve(self, count):
+        """Adds count entries to the journal, returns the number of the last one."""
+        try:
+            return self.shared.incr(JOURNAL_SEQUENCE, count)
+        except ValueError:
+            self.shared.add(JOURNAL_SEQUENCE, 0, None)
+            return self.shared.incr(JOURNAL_SEQUENCE, count)
+
+    def _sync(self):
+        """Removes from the local cache the keys changed by other
+        processes, or everything if the changes cannot be known."""
+        tier = self._tier
+        now = time.monotonic()
+        if now - tier.synced < self._sync_interval:
+            return
+        tier.synced = now
+
+        sequence = self.shared.get(JOURNAL_SEQUENCE, 0)
+        with tier.lock:
+            known = tier.sequence
+            if known == sequence:
+                return
+            if known is None or sequence < known or sequence - known > MAX_JOURNAL_READ:
+                tier.clear()
+                tier.sequence = sequence
+                return
+
+        entries = [JOURNAL_ENTRY.format(number) for number in range(known + 1, sequence + 1)]
+        changed = self.shared.get_many(entries)
+        with tier.lock:
+            if len(changed) < len(entries):
+                # Some entries expired before they were read
+                tier.clear()
+            else:
+                tier.discard(changed.values())
+            tier.sequence = max(tier.sequence or 0, sequence)
@@ -18,10 +18,13 @@ urlpatterns = [
     # App
     path('feeds', views.feeds_page, name='feeds'),
     path('feed/<str:feed_id>', views.feed_page, name='feed'),
+    path('job/<str:job_id>', views.job_page, name='job'),
     path('item/<str:item_id>', views.item_page, name='item'),
+    path('img/<int:item_id>/<int:size>', views.item_picture, name='item_picture'),
     path('users', views.users_page, name='users'),
     path('user/<str:username>', views.user_page, name='user'),
     path('about', views.about_page, name='about'),
     path('comments.rss', RssFeed(), name='rss'),
+    path('export.ndjson', views.export, name='export'),
     path('', views.index, name='index'),
 ]
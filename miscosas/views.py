@@ -4,59 +4,73 @@ Django views for app MisCosas
 
 from urllib.error import URLError, HTTPError
 
+from django.http import (StreamingHttpResponse, HttpResponseBadRequest,
+                         FileResponse, HttpResponseNotModified, Http404)
 from django.shortcuts import render, redirect
 from django.core.handlers.wsgi import WSGIRequest
 from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import F
 from django.db.models.query import QuerySet
 from django.contrib.auth import login
+from django.utils import timezone
+from django.utils.cache import patch_vary_headers, patch_cache_control
+from django.utils.dateparse import parse_datetime
 from django.utils.translation import gettext_lazy as _
 
-from .models import Feed, Item, User, Vote, Comment
+from .models import Feed, FeedJob, Item, User, Vote, Comment
 from .forms import FeedForm, CommentForm, ProfileForm, RegistrationForm
 from .feeds.feedhandler import FEEDS_DATA
 from .feeds.serializepage import render_document
 from .feeds.feedparser import ParsingError
+from .feeds.jobs import enqueue_feed, JOB_REFRESH
+from .feeds.export import export_lines, blocks, gzip_lines, EXPORT_TABLES
+from .pagination import KeysetPaginator, ENTRIES_PER_PAGE
+from .pagecache import cache_anonymous_page, tag_page, item_tag, feed_tag, INDEX, FEEDS
+from .imageproxy import proxied_picture, picture_key, PictureError, PROXY_SIZES, PICTURE_MAX_AGE
 
 
-ENTRIES_PER_PAGE = 10
-
-
+@cache_anonymous_page
 def index(request: WSGIRequest):
-    # Selects the items that have been voted the most
-    # from all the items that have been voted
-    items = list(Item.objects.filter(votes__isnull=False).distinct())
-    items = [item for item in items if item.upvote_count > 0]
-    items.sort(key=lambda i: i.upvote_count, reverse=True)
-    items.sort(key=lambda i: i.upvote_count - i.downvote_count, reverse=True)
+    tag_page(request, INDEX)
+    # Ranks the items with at least one upvote by their score,
+    # breaking ties with the amount of upvotes
+    popular_items = (Item.objects
+        .filter(upvote_count__gt=0)
+        .annotate(score=F('upvote_count') - F('downvote_count'))
+        .order_by('-score', '-upvote_count', 'pk')
+        .select_related('feed')[:ENTRIES_PER_PAGE])
 
     latest_votes = []
     if request.user.is_authenticated:
-        latest_votes = [v.item for v in Vote.objects.filter(user=request.user).order_by('-date')]
+        votes = (Vote.objects.filter(user=request.user)
+            .select_related('item__feed')
+            .order_by('-date')[:5])
+        latest_votes = [v.item for v in votes]
 
     context = {
-        'popular_items': items[:ENTRIES_PER_PAGE],
+        'popular_items': popular_items,
         'chosen_feeds': Feed.objects.filter(chosen=True),
-        'user_latest_votes': latest_votes[:5],
+        'user_latest_votes': latest_votes,
+        'vote_states': vote_states(request, popular_items, latest_votes),
         'form': FeedForm(),
     }
 
     return render_or_document(request, 'miscosas/content/index.html', context)
 
 
+@cache_anonymous_page
 def feeds_page(request: WSGIRequest):
     # New feed
     if request.method == 'POST':
         form = FeedForm(request.POST)
         if form.is_valid():
             feed = form.save(commit=False)
-            try:
-                feed = FEEDS_DATA[feed.source].load(feed.key)
-                if request.user.is_authenticated:
-                    request.user.profile.chosen_feeds.add(feed)
-                return redirect(f'feed/{feed.pk}')
-            except (URLError, HTTPError, ParsingError) as error:
-                return not_found(request, error)
+            # Loaded by a worker, not to keep the request waiting for the source
+            job = enqueue_feed(feed.source, feed.key, request.user)
+            return redirect(f'job/{job.pk}')
 
+    tag_page(request, FEEDS)
     feeds = Feed.objects.all()
     pages = pagination(request, feeds)
 
@@ -65,14 +79,18 @@ def feeds_page(request: WSGIRequest):
         'form': FeedForm(),
         'pages': pages['pages'],
         'current_page': pages['current_page'],
+        'next_cursor': pages['next_cursor'],
+        'previous_cursor': pages['previous_cursor'],
     }
     return render_or_document(request, 'miscosas/content/feeds.html', context)
 
 
+@cache_anonymous_page
 def feed_page(request: WSGIRequest, feed_id: str):
     # Get feed id
     try:
         pk = int(feed_id)
+        tag_page(request, feed_tag(pk))
         feed = Feed.objects.get(pk=pk)
     except (Feed.DoesNotExist, ValueError):
         return not_found(request)
@@ -94,21 +112,45 @@ def feed_page(request: WSGIRequest, feed_id: str):
     context = {
         'feed': feed,
         'item_list': pages['set'],
+        'vote_states': vote_states(request, pages['set']),
         'pages': pages['pages'],
         'current_page': pages['current_page'],
+        'next_cursor': pages['next_cursor'],
+        'previous_cursor': pages['previous_cursor'],
         'source_image': FEEDS_DATA[feed.source].icon,
     }
 
     return render_or_document(request, 'miscosas/content/feed_page.html', context)
 
 
+def job_page(request: WSGIRequest, job_id: str):
+    """Waits for a feed to be loaded and then shows it."""
+    try:
+        job = FeedJob.objects.get(pk=int(job_id))
+    except (FeedJob.DoesNotExist, ValueError):
+        return not_found(request)
+
+    if job.state == FeedJob.DONE and job.feed_id:
+        return redirect(f'/feed/{job.feed_id}')
+    if job.finished:
+        return render(request, 'miscosas/content/not_found.html',
+            {'error': job.error}, status=404)
+
+    response = render(request, 'miscosas/content/feed_job.html', {'job': job}, status=202)
+    response['Refresh'] = str(JOB_REFRESH)
+    return response
+
+
+@cache_anonymous_page
 def item_page(request: WSGIRequest, item_id: str):
     # Get item id
     try:
         pk = int(item_id)
+        tag_page(request, item_tag(pk))
         item = Item.objects.get(pk=pk)
     except (Item.DoesNotExist, ValueError):
         return not_found(request)
+    tag_page(request, feed_tag(item.feed_id))
 
     # Handle posts to this page
     if request.method == 'POST' and request.user.is_authenticated:
@@ -119,15 +161,17 @@ def item_page(request: WSGIRequest, item_id: str):
             # Ignore wrong post attempts
             pass
 
-    comments = item.comments.all().order_by('-date')
-    pages = pagination(request, comments)
+    pages = pagination(request, item.comments.all(), ordering=('-date', '-pk'))
 
     context = {
         'item': item,
+        'vote_states': vote_states(request, [item]),
         'comment_list': pages['set'],
         'form': CommentForm(),
         'pages': pages['pages'],
         'current_page': pages['current_page'],
+        'next_cursor': pages['next_cursor'],
+        'previous_cursor': pages['previous_cursor'],
         'source_image': FEEDS_DATA[item.feed.source].icon,
     }
     return render_or_document(request, 'miscosas/content/item_page.html', context)
@@ -141,6 +185,8 @@ def users_page(request: WSGIRequest):
         'user_list': pages['set'],
         'pages': pages['pages'],
         'current_page': pages['current_page'],
+        'next_cursor': pages['next_cursor'],
+        'previous_cursor': pages['previous_cursor'],
     }
     return render_or_document(request, 'miscosas/content/users.html', context)
 
@@ -159,11 +205,16 @@ def user_page(request: WSGIRequest, username: str):
         if form.is_valid():
             form.save()
 
+    upvoted = Item.objects.filter(votes__user=owner, votes__positive=True).select_related('feed')
+    downvoted = Item.objects.filter(votes__user=owner, votes__positive=False).select_related('feed')
+    commented = Item.objects.filter(comments__user=owner).distinct().select_related('feed')
+
     context = {
         'owner': owner,
-        'upvoted_item_list': Item.objects.filter(votes__user=owner, votes__positive=True),
-        'downvoted_item_list': Item.objects.filter(votes__user=owner, votes__positive=False),
-        'commented_item_list': Item.objects.filter(comments__user=owner).distinct(),
+        'upvoted_item_list': upvoted,
+        'downvoted_item_list': downvoted,
+        'commented_item_list': commented,
+        'vote_states': vote_states(request, upvoted, downvoted, commented),
         'chosen_feeds_list': owner.profile.chosen_feeds.all(),
         'form': ProfileForm(instance=owner.profile),
         'user_match': user_match,
@@ -171,6 +222,63 @@ def user_page(request: WSGIRequest, username: str):
     return render_or_document(request, 'miscosas/content/user_page.html', context)
 
 
+def export(request: WSGIRequest):
+    """The whole catalog as NDJSON, sent while it is read.
+
+    The since parameter limits it to the rows changed after a time,
+    and tables to a comma separated list of tables."""
+    since = None
+    if request.GET.get('since'):
+        since = parse_datetime(request.GET['since'])
+        if since is None:
+            return HttpResponseBadRequest("Invalid since time")
+        if timezone.is_naive(since):
+            since = timezone.make_aware(since, timezone.utc)
+
+    tables = list(EXPORT_TABLES)
+    if request.GET.get('tables'):
+        tables = request.GET['tables'].split(',')
+        if any(table not in EXPORT_TABLES for table in tables):
+            return HttpResponseBadRequest("Unknown table")
+
+    content = blocks(export_lines(since, tables))
+    gzip = 'gzip' in request.META.get('HTTP_ACCEPT_ENCODING', '')
+    if gzip:
+        content = gzip_lines(content)
+    response = StreamingHttpResponse(content, content_type='application/x-ndjson')
+    if gzip:
+        response['Content-Encoding'] = 'gzip'
+    patch_vary_headers(response, ('Accept-Encoding',))
+    return response
+
+
+def item_picture(request: WSGIRequest, item_id: int, size: int):
+    """Picture of an item resized to a width, from the
+    copy stored the first time it was requested."""
+    url = Item.objects.filter(pk=item_id).values_list('picture', flat=True).first()
+    if not url or size not in PROXY_SIZES:
+        return not_found(request)
+
+    # The copy changes only if the item gets another picture
+    etag = f'"{picture_key(url, size)}"'
+    if etag in request.META.get('HTTP_IF_NONE_MATCH', ''):
+        response = HttpResponseNotModified()
+    else:
+        try:
+            path = proxied_picture(url, size)
+        except PictureError:
+            return not_found(request)
+        try:
+            picture = open(path, 'rb')
+        except FileNotFoundError:
+            # Removed to make room for other pictures in the meantime
+            return redirect(url)
+        response = FileResponse(picture, content_type='image/jpeg')
+    response['ETag'] = etag
+    patch_cache_control(response, public=True, max_age=PICTURE_MAX_AGE)
+    return response
+
+
 def about_page(request: WSGIRequest):
     """Page with information about the web app."""
     return render(request, 'miscosas/content/about.html')
@@ -212,55 +320,90 @@ def render_or_document(request: WSGIRequest, template: str, context: dict):
     return render(request, template, context)
 
 
-def pagination(request: WSGIRequest, qset: QuerySet):
+def pagination(request: WSGIRequest, qset: QuerySet, ordering=('pk',)):
     """Divides the entries in a query set in pages.
 
-    Returns a dictionary with data for the context."""
-    pages = range(1, qset.count() // ENTRIES_PER_PAGE + 2)
-    if len(qset) % 10 == 0 and len(pages) > 1:
-        pages = pages[:-1]
+    The links to the next and previous pages carry the pk of the
+    entry at the edge of the current one, to find them from it.
+
+    Returns a dictionary with data for the context, raises
+    Http404 if the page is after the last one."""
     try:
-        current_page = int(request.GET.get('page', 1))
+        current_page = max(int(request.GET.get('page', 1)), 1)
     except ValueError:
         current_page = 1
-    item_i = ENTRIES_PER_PAGE * (current_page - 1)
-    item_f = item_i + ENTRIES_PER_PAGE
+    paginator = KeysetPaginator(qset, ordering)
+    page = paginator.page(current_page,
+                          after=cursor_param(request, 'after'),
+                          before=cursor_param(request, 'before'))
+    if page is None:
+        raise Http404
 
     return {
-        'set': qset[item_i:item_f],
-        'pages': pages,
-        'current_page': current_page,
+        'set': page.entries,
+        'pages': paginator.page_range(page),
+        'current_page': page.number,
+        'next_cursor': page.next_cursor,
+        'previous_cursor': page.previous_cursor,
     }
 
+def vote_states(request: WSGIRequest, *item_lists):
+    """Reads in a single query the votes of the user for the items
+    in the lists, which the vote forms show.
+
+    Returns a dictionary with the pk of each voted item and
+    whether the vote is positive."""
+    # The documents of the pages have no forms
+    if not request.user.is_authenticated or request.GET.get('format'):
+        return {}
+    pks = {item.pk for items in item_lists for item in items}
+    if not pks:
+        return {}
+    return dict(Vote.objects
+        .filter(user=request.user, item__in=pks)
+        .values_list('item_id', 'positive'))
+
+def cursor_param(request: WSGIRequest, name: str):
+    """Returns the pk in a query parameter or None."""
+    try:
+        return int(request.GET[name])
+    except (KeyError, ValueError):
+        return None
+
 def item_post(request: WSGIRequest, item: Item):
-    """Handles the content of a POST request to the item page."""
-    # Add comment to item
-    if request.POST['action'] == 'comment':
-        form = CommentForm(request.POST)
-        if form.is_valid():
-            comment = form.save(commit=False)
-            comment.user = request.user
-            comment.item = item
-            comment.save()
-    # Vote item
-    elif request.POST['action'] == 'upvote' or request.POST['action'] == 'downvote':
-        positive = request.POST['action'] == 'upvote'
-        try:
-            vote = Vote.objects.get(item=item, user=request.user)
-            old_state = vote.positive
-            vote.delete()
-            if old_state != positive:
+    """Handles the content of a POST request to the item page.
+
+    Votes and comments are changed in a transaction so that
+    the counters they update stay consistent."""
+    with transaction.atomic():
+        # Add comment to item
+        if request.POST['action'] == 'comment':
+            form = CommentForm(request.POST)
+            if form.is_valid():
+                comment = form.save(commit=False)
+                comment.user = request.user
+                comment.item = item
+                comment.save()
+        # Vote item
+        elif request.POST['action'] == 'upvote' or request.POST['action'] == 'downvote':
+            positive = request.POST['action'] == 'upvote'
+            try:
+                vote = Vote.objects.select_for_update().get(item=item, user=request.user)
+                if vote.positive == positive:
+                    vote.delete()
+                else:
+                    vote.positive = positive
+                    vote.save()
+            except Vote.DoesNotExist:
                 Vote(positive=positive, user=request.user, item=item).save()
-        except Vote.DoesNotExist:
-            Vote(positive=positive, user=request.user, item=item).save()
-    # Delete comment
-    elif request.POST['action'] == 'delete':
-        try:
-            pk = int(request.POST['pk'])
-            comment = Comment.objects.get(pk=pk)
-            if comment.user == request.user and comment.item == item:
-                comment.delete()
-        except (ValueError, Comment.DoesNotExist):
-            pass
+        # Delete comment
+        elif request.POST['action'] == 'delete':
+            try:
+                pk = int(request.POST['pk'])
+                comment = Comment.objects.get(pk=pk)
+                if comment.user == request.user and comment.item == item:
+                    comment.delete()
+            except (ValueError, Comment.DoesNotExist):
+                pass
 
     return request.POST['path']
@@ -79,10 +79,22 @@ WSGI_APPLICATION = 'project.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/3.0/ref/settings/#databases
 
+# The SQLite backend of miscosas turns on write-ahead logging and retries
+# the statements that find the database locked, see miscosas/sqlite/base.py.
+# Connections are kept open for CONN_MAX_AGE seconds between requests.
+
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
+        'ENGINE': 'miscosas.sqlite',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        'CONN_MAX_AGE': 600,
+        'OPTIONS': {
+            'pragmas': {
+                'synchronous': 'NORMAL',
+                'busy_timeout': 5000,
+            },
+            'lock_retries': 3,
+        },
     }
 }
 
@@ -130,3 +142,59 @@ MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
 LOGIN_REDIRECT_URL = "/"
 LOGOUT_REDIRECT_URL = "/"
+
+
+# Requests to the feed sources
+# Idle connections kept open for each host and seconds to wait for a response
+
+FEEDS_HTTP_POOL_SIZE = 4
+FEEDS_HTTP_TIMEOUT = 10
+
+
+# Pictures of the items
+# Directory of their resized copies and its maximum size in bytes, and
+# whether they can be downloaded from private addresses of the network
+
+IMAGE_CACHE_DIR = os.path.join(BASE_DIR, 'imagecache')
+IMAGE_CACHE_MAX_BYTES = 256 * 1024 * 1024
+IMAGE_PROXY_ALLOW_PRIVATE = False
+
+
+# Cache
+# Each process keeps the entries it uses the most in a local cache in front of
+# the shared one, which is a directory of files unless SHARED_CACHE_URL names
+# a memcached (memcached://host:port) or redis (redis://host:port) server
+
+SHARED_CACHE_URL = os.environ.get('SHARED_CACHE_URL', '')
+
+if SHARED_CACHE_URL.startswith('memcached://'):
+    SHARED_CACHE = {
+        'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+        'LOCATION': SHARED_CACHE_URL[len('memcached://'):],
+    }
+elif SHARED_CACHE_URL.startswith('redis://'):
+    # Needs the django-redis package
+    SHARED_CACHE = {
+        'BACKEND': 'django_redis.cache.RedisCache',
+        'LOCATION': SHARED_CACHE_URL,
+    }
+else:
+    SHARED_CACHE = {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(BASE_DIR, 'cache'),
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    }
+
+CACHES = {
+    'default': {
+        'BACKEND': 'miscosas.tieredcache.TieredCache',
+        'LOCATION': 'miscosas',
+        'OPTIONS': {
+            'SHARED': 'shared',
+            'LOCAL_MAX_ENTRIES': 1000,
+            'LOCAL_TIMEOUT': 5,
+            'SYNC_INTERVAL': 1,
+        },
+    },
+    'shared': SHARED_CACHE,
+}